@@ -7,12 +7,8 @@ class DepthCamera:
         self.pipeline = rs.pipeline()
         config = rs.config()
 
-        # Get device product line for setting a supporting resolution
-        pipeline_wrapper = rs.pipeline_wrapper(self.pipeline)
-        pipeline_profile = config.resolve(pipeline_wrapper)
-        device = pipeline_profile.get_device()
-        device_product_line = str(device.get_info(rs.camera_info.product_line))
-
+        # The streams are fixed, so there is no need to resolve the device
+        # profile (a full device enumeration) before starting the pipeline
         config.enable_stream(rs.stream.depth, 1280, 720, rs.format.z16, 30)
         config.enable_stream(rs.stream.color, 1280, 720, rs.format.bgr8, 30)
 
@@ -0,0 +1,108 @@
+"""
+Adaptive quality controller to hold a target frame rate.
+
+The per-frame processing time is compared against the frame budget
+(1 / target fps). When the smoothed time stays over budget the
+controller steps down a ladder of degradations, and it steps back
+up only once the time has stayed well under budget for a longer
+while (hysteresis). Every change is printed and appended to a CSV
+log, so that recordings made under load stay interpretable.
+"""
+
+
+import csv
+import json
+import time
+
+
+# Ordered from full quality to cheapest. Each level lists every setting
+# the recorder applies:
+#   decimation    - magnitude of rs.decimation_filter
+#   spatial       - run rs.spatial_filter
+#   preview_every - show one frame out of N on screen
+DEFAULT_LADDER = [
+    {"decimation": 1, "spatial": True, "preview_every": 1},
+    {"decimation": 1, "spatial": True, "preview_every": 3},
+    {"decimation": 1, "spatial": False, "preview_every": 3},
+    {"decimation": 1, "spatial": False, "preview_every": 5},
+    {"decimation": 2, "spatial": False, "preview_every": 5},
+    {"decimation": 3, "spatial": False, "preview_every": 10},
+]
+
+
+class AdaptiveQualityController:
+    def __init__(self, target_fps, ladder=DEFAULT_LADDER, log_path=None,
+                 smoothing=0.1, down_after=15, up_after=90, up_margin=0.7):
+        self.budget = 1.0 / target_fps
+        self.ladder = ladder
+        self.level = 0
+
+        # Exponential moving average of the processing time
+        self.smoothing = smoothing
+        self.average = None
+
+        # Hysteresis: step down quickly when over budget, step up slowly
+        # and only when there is a comfortable margin
+        self.down_after = down_after
+        self.up_after = up_after
+        self.up_margin = up_margin
+        self.over_count = 0
+        self.under_count = 0
+        self.frame_index = 0
+
+        self.log_file = None
+        self.log_writer = None
+        if log_path is not None:
+            self.log_file = open(log_path, "w", newline="")
+            self.log_writer = csv.writer(self.log_file)
+            self.log_writer.writerow(["frame", "time", "event", "level", "average_ms", "budget_ms", "settings"])
+            self._log("start")
+
+    @property
+    def settings(self):
+        return self.ladder[self.level]
+
+    def update(self, frame_time):
+        # Feed the processing time of the last frame (seconds).
+        # Returns True when the level changed and the settings must be re-applied.
+        self.frame_index += 1
+        if self.average is None:
+            self.average = frame_time
+        else:
+            self.average += self.smoothing * (frame_time - self.average)
+
+        self.over_count = self.over_count + 1 if self.average > self.budget else 0
+        self.under_count = self.under_count + 1 if self.average < self.budget * self.up_margin else 0
+
+        if self.over_count >= self.down_after and self.level < len(self.ladder) - 1:
+            self.level += 1
+            self._changed("down")
+            return True
+        if self.under_count >= self.up_after and self.level > 0:
+            self.level -= 1
+            self._changed("up")
+            return True
+        return False
+
+    def _changed(self, event):
+        # Give the new level time to show its effect before deciding again
+        self.over_count = 0
+        self.under_count = 0
+        print("Quality {} to level {} ({:.1f} ms/frame, budget {:.1f} ms): {}".format(
+            event, self.level, 1000 * self.average, 1000 * self.budget, self.settings))
+        self._log(event)
+
+    def _log(self, event):
+        if self.log_writer is None:
+            return
+        average_ms = "" if self.average is None else round(1000 * self.average, 2)
+        self.log_writer.writerow([self.frame_index, "{:.5f}".format(time.time()), event, self.level,
+                                  average_ms, round(1000 * self.budget, 2), json.dumps(self.settings)])
+        self.log_file.flush()
+
+    def close(self):
+        if self.log_file is not None:
+            self._log("stop")
+            self.log_file.close()
+            self.log_file = None
+            self.log_writer = None
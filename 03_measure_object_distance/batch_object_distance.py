@@ -0,0 +1,116 @@
+"""
+Headless batch version of measure_object_distance.py for recordings.
+A .bag is played back as fast as it can be read, its frames go through
+Mask R-CNN in batches (cv2.dnn.blobFromImages) and the distance of
+every detected object, over the depth pixels of its mask, is written
+to a columnar file: CSV, Parquet or NPZ after the output extension.
+"""
+
+
+import os
+import time
+import argparse
+import numpy as np
+from realsense_camera import RealsenseCamera
+from mask_rcnn import MaskRCNN
+from results_writer import ResultsWriter
+
+
+# distances in mm, coverage is the fraction of the mask with a valid depth
+COLUMNS = ["frame", "timestamp", "class_id", "class_name", "score", "x", "y", "x2", "y2",
+           "distance_min", "distance_median", "distance_mean", "distance_max", "coverage"]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default='record.bag', type=str, help="Path to the bag file")
+    parser.add_argument(
+        '--output', '-o', default='distances.csv', type=str, help="Results file, .csv, .parquet or .npz")
+    parser.add_argument(
+        '--batch_size', '-b', default=4, type=int, help="Frames per forward pass")
+    parser.add_argument(
+        '--input_size', default=None, type=int, nargs=2, help="Network input width and height, full frame if not given")
+    parser.add_argument(
+        '--chunk_rows', default=4096, type=int, help="Rows buffered before each write")
+    parser.add_argument(
+        '--table_align', action='store_true', help="Align with reprojection tables instead of rs.align")
+    return parser
+
+
+def get_args(parser):
+    args = parser.parse_args()
+    if os.path.splitext(args.input)[1] != ".bag":
+        print("The given file is not of correct file format.")
+        print("Only .bag files are accepted")
+        exit()
+    return args
+
+
+def distance_stats(depth_image, box, mask, depth_scale):
+    # min, median, mean and max distance (mm) of the valid depth pixels under the mask
+    x, y, x2, y2 = box
+    roi = depth_image[y:y2, x:x2]
+    valid = mask & (roi > 0)
+    count = np.count_nonzero(valid)
+    if count == 0:
+        return np.nan, np.nan, np.nan, np.nan, 0.0
+    values = roi[valid] * (depth_scale * 1000)
+    return values.min(), np.median(values), values.mean(), values.max(), count / np.count_nonzero(mask)
+
+
+def main(args):
+    camera = RealsenseCamera(table_align=args.table_align, input=args.input)
+    mrcnn = MaskRCNN()
+    writer = ResultsWriter(args.output, COLUMNS, args.chunk_rows)
+
+    frame_count = 0
+    object_count = 0
+    detect_time = 0.0
+    bgr_frames, depth_frames, frame_info = [], [], []
+    start_time = time.perf_counter()
+    last_report = start_time
+    try:
+        while not camera.finished:
+            ret, bgr_frame, depth_frame = camera.get_frame_stream()
+            if ret:
+                # Copies, the librealsense frames go back to their pool while the batch fills
+                bgr_frames.append(bgr_frame.copy())
+                depth_frames.append(depth_frame.copy())
+                frame_info.append((camera.frame_number, camera.timestamp))
+            # a last, shorter batch at the end of the recording
+            if len(bgr_frames) < args.batch_size and not (camera.finished and bgr_frames):
+                continue
+
+            detect_start = time.perf_counter()
+            detections = mrcnn.detect_objects_mask_batch(bgr_frames, args.input_size)
+            detect_time += time.perf_counter() - detect_start
+
+            for (frame_number, timestamp), depth_image, frame_detections in zip(frame_info, depth_frames, detections):
+                for class_id, score, box, mask in frame_detections:
+                    writer.append((frame_number, timestamp, class_id, mrcnn.classes[class_id], score) + box +
+                                  distance_stats(depth_image, box, mask, camera.depth_scale))
+                    object_count += 1
+            frame_count += len(bgr_frames)
+            bgr_frames, depth_frames, frame_info = [], [], []
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print("{} frames  {:.1f} frames/s  {} objects".format(
+                    frame_count, frame_count / (now - start_time), object_count))
+                last_report = now
+    finally:
+        writer.close()
+        camera.release()
+
+    elapsed = time.perf_counter() - start_time
+    print("Done: {} frames in {:.1f} s, {:.1f} frames/s ({:.1f} frames/s in the network), {} objects written to {}".format(
+        frame_count, elapsed, frame_count / max(elapsed, 1e-6), frame_count / max(detect_time, 1e-6),
+        object_count, args.output))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = get_args(parser)
+    print(args)
+    main(args)
@@ -0,0 +1,119 @@
+"""
+Speed and recall of the depth-gated Mask R-CNN (depth_regions.py)
+against full frame inference, on a .bag recording. Every frame goes
+through both; a full frame detection is recalled when a gated one of
+the same class overlaps it (IoU). Recall is given over all the
+detections and over the near ones, closer than --max_distance, which
+are the ones the gate is meant to keep.
+"""
+
+
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+from realsense_camera import RealsenseCamera
+from mask_rcnn import MaskRCNN
+from depth_regions import DepthGate
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default='record.bag', type=str, help="Path to the bag file")
+    parser.add_argument(
+        '--frames', default=300, type=int, help="At most this many frames")
+    parser.add_argument(
+        '--max_distance', default=3.0, type=float, help="Depth gate range in meters")
+    parser.add_argument(
+        '--full_frame_every', default=30, type=int, help="One frame out of this many goes whole through the network")
+    parser.add_argument(
+        '--iou', default=0.5, type=float, help="Overlap for a gated detection to match a full frame one")
+    parser.add_argument(
+        '--table_align', action='store_true', help="Align with reprojection tables instead of rs.align")
+    return parser
+
+
+def get_args(parser):
+    args = parser.parse_args()
+    if os.path.splitext(args.input)[1] != ".bag":
+        print("The given file is not of correct file format.")
+        print("Only .bag files are accepted")
+        exit()
+    return args
+
+
+def iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def median_distance(depth_image, box, contours, depth_scale):
+    # meters, over the valid depth pixels of the mask
+    x, y, x2, y2 = box
+    mask = np.zeros((y2 - y, x2 - x), np.uint8)
+    cv2.drawContours(mask, contours, -1, 1, -1)
+    values = depth_image[y:y2, x:x2][(mask > 0) & (depth_image[y:y2, x:x2] > 0)]
+    return np.median(values) * depth_scale if len(values) else np.inf
+
+
+def detections(mrcnn):
+    return list(zip(mrcnn.obj_boxes, mrcnn.obj_classes, mrcnn.obj_contours))
+
+
+def main(args):
+    camera = RealsenseCamera(table_align=args.table_align, input=args.input)
+    mrcnn = MaskRCNN()
+    mrcnn.warm_up()
+    gate = DepthGate(args.max_distance, args.full_frame_every)
+
+    full_time = gated_time = 0.0
+    full_count = near_count = recalled = near_recalled = gated_count = 0
+    frame_count = 0
+    try:
+        while frame_count < args.frames and not camera.finished:
+            ret, bgr_frame, depth_image = camera.get_frame_stream()
+            if not ret:
+                continue
+            frame_count += 1
+
+            start = time.perf_counter()
+            mrcnn.detect_objects_mask(bgr_frame)
+            full_time += time.perf_counter() - start
+            full = detections(mrcnn)
+
+            start = time.perf_counter()
+            regions = gate.propose(depth_image, camera.depth_scale)
+            mrcnn.detect_objects_mask_regions(bgr_frame, regions)
+            gated_time += time.perf_counter() - start
+            gated = detections(mrcnn)
+            gated_count += len(gated)
+
+            for box, class_id, contours in full:
+                near = median_distance(depth_image, box, contours, camera.depth_scale) < args.max_distance
+                found = any(gated_class == class_id and iou(box, gated_box) >= args.iou
+                            for gated_box, gated_class, _ in gated)
+                full_count += 1
+                near_count += near
+                recalled += found
+                near_recalled += found and near
+    finally:
+        camera.release()
+
+    print(gate.summary())
+    print("full frame {:.1f} fps, gated {:.1f} fps, speedup {:.2f}x".format(
+        frame_count / max(full_time, 1e-6), frame_count / max(gated_time, 1e-6), full_time / max(gated_time, 1e-6)))
+    print("{} full frame detections ({} near), {} gated".format(full_count, near_count, gated_count))
+    print("recall {:.1%}, near recall {:.1%}".format(recalled / max(full_count, 1), near_recalled / max(near_count, 1)))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = get_args(parser)
+    print(args)
+    main(args)
@@ -0,0 +1,115 @@
+"""
+Depth-gated region proposals for Mask R-CNN.
+
+Most of a 1280x720 frame is background far from the camera, while
+only objects within a few meters are measured. The aligned depth image
+is thresholded at max_distance, its connected regions become padded
+crops, and the network only runs on them: its cost grows with the
+pixels of its input. Every full_frame_every frames, and when the
+regions cover most of the frame anyway, the whole frame goes through
+the network instead. A floor in view is near too and joins the objects
+standing on it into one wide region: such scenes mostly fall back to
+the full frame, lower max_distance to keep the floor out of the gate.
+
+Backends with a fixed input size (ssd, yolo) resize every input to it,
+a crop costs them as much as the whole frame: with fixed_input the gate
+only skips the frames without near regions and runs the others whole.
+"""
+
+
+import cv2
+import numpy as np
+
+
+def near_regions(depth_image, depth_scale, max_distance=3.0, min_area=0.005, pad=0.15, min_size=192, step=4):
+    # Boxes (x, y, x2, y2) around the connected regions closer than max_distance (m).
+    # min_area is a fraction of the frame, pad a fraction of the box size, and the boxes
+    # are at least min_size pixels wide and high. The depth is scanned every step pixels.
+    height, width = depth_image.shape[:2]
+    small = depth_image[::step, ::step]
+    near = ((small > 0) & (small < max_distance / depth_scale)).astype(np.uint8)
+    # close the holes and gaps of the stereo matching, drop the speckles
+    kernel = np.ones((3, 3), np.uint8)
+    near = cv2.morphologyEx(near, cv2.MORPH_CLOSE, kernel)
+    near = cv2.morphologyEx(near, cv2.MORPH_OPEN, kernel)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(near, connectivity=8)
+
+    boxes = []
+    min_pixels = min_area * near.size
+    for x, y, w, h, area in stats[1:count]:
+        if area < min_pixels:
+            continue
+        x, y, w, h = int(x) * step, int(y) * step, int(w) * step, int(h) * step
+        pad_x = max(int(w * pad), (min_size - w) // 2)
+        pad_y = max(int(h * pad), (min_size - h) // 2)
+        boxes.append([max(x - pad_x, 0), max(y - pad_y, 0), min(x + w + pad_x, width), min(y + h + pad_y, height)])
+    return merge_boxes(boxes)
+
+
+def merge_boxes(boxes):
+    # Overlapping boxes are replaced by their union until none overlap, an object
+    # is then never cut between two crops
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
+
+
+class DepthGate:
+    # Decides, frame by frame, on which crops the network runs: None for the whole
+    # frame, an empty list when nothing is near. Counts what it decided for the report.
+    def __init__(self, max_distance=3.0, full_frame_every=30, max_coverage=0.6, min_area=0.005, pad=0.15,
+                 min_size=192, fixed_input=False):
+        self.max_distance = max_distance
+        self.full_frame_every = full_frame_every
+        self.max_coverage = max_coverage
+        self.min_area = min_area
+        self.pad = pad
+        self.min_size = min_size
+        self.fixed_input = fixed_input
+        self.frames = 0
+        self.full_frames = 0
+        self.empty_frames = 0
+        self.crops = 0
+        # network cost relative to full frames: the pixels fed to it, or the passes
+        # with a fixed input size
+        self.cost = 0.0
+
+    def propose(self, depth_image, depth_scale):
+        index = self.frames
+        self.frames += 1
+        regions = None
+        if self.full_frame_every <= 0 or index % self.full_frame_every != 0:
+            regions = near_regions(depth_image, depth_scale, self.max_distance, self.min_area, self.pad,
+                                   self.min_size)
+            area = sum((x2 - x) * (y2 - y) for x, y, x2, y2 in regions)
+            coverage = area / float(depth_image.shape[0] * depth_image.shape[1])
+            if coverage > self.max_coverage or (regions and self.fixed_input):
+                # the crops would cost about as much as the frame
+                regions = None
+        if regions is None:
+            self.full_frames += 1
+            self.cost += 1.0
+        elif not regions:
+            self.empty_frames += 1
+        else:
+            self.crops += len(regions)
+            self.cost += coverage
+        return regions
+
+    def summary(self):
+        frames = max(self.frames, 1)
+        return "{} frames: {} full, {} without near regions, {:.1f} crops per gated frame, {:.0%} of the full frame cost".format(
+            self.frames, self.full_frames, self.empty_frames,
+            self.crops / max(self.frames - self.full_frames - self.empty_frames, 1), self.cost / frames)
@@ -0,0 +1,188 @@
+"""
+Motion-gated detection reuse.
+
+The scene is mostly still from one frame to the next, the network
+does not need to see every frame. The scheduler measures the change
+on a downsampled frame (color or depth difference) and, while it
+stays under the threshold, moves the previous detections with sparse
+optical flow instead of running the detector: corners are tracked
+(Lucas-Kanade) inside every mask and the box and the mask follow
+their median shift and spread. The detector runs again on a large
+change, when the flow loses an object or moves it too far, and every
+refresh_every frames.
+
+On the periodic refreshes the propagated detections are compared with
+the new ones, the drift of the overlay (IoU and center distance) is
+part of the summary.
+"""
+
+
+import time
+import cv2
+import numpy as np
+
+
+def _iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+class DetectionScheduler:
+    # change_threshold is the fraction of the downsampled pixels that changed by more than
+    # change_level gray levels, or for source="depth" by more than depth_change of their depth
+    # (the stereo noise grows with the distance); max_motion is in pixels
+    def __init__(self, change_threshold=0.02, refresh_every=15, source="color", scale=0.25, change_level=20,
+                 depth_change=0.05, max_motion=40.0, min_points=4):
+        self.change_threshold = change_threshold
+        self.refresh_every = refresh_every
+        self.source = source
+        self.scale = scale
+        self.change_level = change_level
+        self.depth_change = depth_change
+        self.max_motion = max_motion
+        self.min_points = min_points
+        self.lk_params = dict(winSize=(21, 21), maxLevel=3,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+        self.detections = None
+        self.gray = None
+        self.small = None
+        self.since_inference = 0
+        # counts and times for the summary
+        self.frames = 0
+        self.inferences = {"first": 0, "change": 0, "motion": 0, "refresh": 0}
+        self.inference_time = 0.0
+        self.total_time = 0.0
+        self.drift_iou = []
+        self.drift_center = []
+
+    def update(self, bgr_frame, depth_image, detect):
+        # detections for this frame, detect(bgr_frame) is called when they cannot be reused
+        start = time.perf_counter()
+        self.frames += 1
+        gray = cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2GRAY)
+        small = self._downsample(gray if self.source == "color" else depth_image)
+
+        reason = None
+        propagated = None
+        if self.detections is None:
+            reason = "first"
+        elif self.since_inference + 1 >= self.refresh_every:
+            reason = "refresh"
+            propagated = self._propagate(gray)
+        elif self._change(small) > self.change_threshold:
+            reason = "change"
+        else:
+            propagated = self._propagate(gray)
+            if propagated is None:
+                reason = "motion"
+
+        if reason is None:
+            self.detections = propagated
+            self.since_inference += 1
+        else:
+            inference_start = time.perf_counter()
+            self.detections = detect(bgr_frame)
+            self.inference_time += time.perf_counter() - inference_start
+            self.inferences[reason] += 1
+            self.since_inference = 0
+            if reason == "refresh" and propagated is not None:
+                self._measure_drift(propagated, self.detections)
+        self.reused = reason is None
+        self.gray = gray
+        self.small = small
+        self.total_time += time.perf_counter() - start
+        return self.detections
+
+    def _downsample(self, image):
+        # nearest for depth, averaging would mix the holes into the depths
+        interpolation = cv2.INTER_AREA if self.source == "color" else cv2.INTER_NEAREST
+        return cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=interpolation)
+
+    def _change(self, small):
+        # fraction of the pixels that changed, for depth only where both frames have one
+        if self.source == "color":
+            changed = cv2.absdiff(small, self.small) > self.change_level
+        else:
+            valid = (small > 0) & (self.small > 0)
+            changed = valid & (np.abs(small.astype(np.int32) - self.small) > self.depth_change * self.small)
+        return np.count_nonzero(changed) / float(changed.size)
+
+    def _propagate(self, gray):
+        # previous detections moved to this frame, None when one of them cannot be followed
+        height, width = gray.shape
+        moved = []
+        for detection in self.detections:
+            x, y, x2, y2 = detection.box
+            region = np.zeros_like(self.gray)
+            if detection.mask is not None:
+                region[y:y2, x:x2][detection.mask] = 255
+            else:
+                region[y:y2, x:x2] = 255
+            points = cv2.goodFeaturesToTrack(self.gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=region)
+            if points is None or len(points) < self.min_points:
+                return None
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, points, None, **self.lk_params)
+            found = status.ravel() == 1
+            if np.count_nonzero(found) < self.min_points:
+                return None
+            old, new = points[found, 0], new_points[found, 0]
+            dx, dy = np.median(new - old, axis=0)
+            if np.hypot(dx, dy) > self.max_motion:
+                return None
+            # scale from the spread of the points around their median
+            old_spread = np.median(np.linalg.norm(old - np.median(old, axis=0), axis=1))
+            new_spread = np.median(np.linalg.norm(new - np.median(new, axis=0), axis=1))
+            scale = np.clip(new_spread / old_spread, 0.8, 1.25) if old_spread > 1 else 1.0
+            detection = self._move(detection, dx, dy, scale, width, height)
+            if detection is not None:
+                moved.append(detection)
+        return moved
+
+    def _move(self, detection, dx, dy, scale, width, height):
+        # box and mask shifted by (dx, dy) and scaled around the center, cut to the frame
+        x, y, x2, y2 = detection.box
+        cx, cy = (x + x2) / 2 + dx, (y + y2) / 2 + dy
+        w, h = max(int(round((x2 - x) * scale)), 1), max(int(round((y2 - y) * scale)), 1)
+        nx, ny = int(round(cx - w / 2)), int(round(cy - h / 2))
+        left, top = max(nx, 0), max(ny, 0)
+        right, bottom = min(nx + w, width), min(ny + h, height)
+        if right <= left or bottom <= top:
+            # left the frame
+            return None
+        mask = detection.mask
+        if mask is not None:
+            if mask.shape != (h, w):
+                mask = cv2.resize(mask.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST) > 0
+            mask = mask[top - ny:bottom - ny, left - nx:right - nx]
+        return detection._replace(box=(left, top, right, bottom), mask=mask)
+
+    def _measure_drift(self, propagated, detections):
+        # best match of the same class for every new detection
+        for detection in detections:
+            matches = [(_iou(detection.box, old.box), old) for old in propagated if old.class_id == detection.class_id]
+            if not matches:
+                continue
+            iou, old = max(matches, key=lambda match: match[0])
+            if iou <= 0:
+                continue
+            self.drift_iou.append(iou)
+            self.drift_center.append(np.hypot((detection.box[0] + detection.box[2] - old.box[0] - old.box[2]) / 2,
+                                              (detection.box[1] + detection.box[3] - old.box[1] - old.box[3]) / 2))
+
+    def summary(self):
+        inferences = sum(self.inferences.values())
+        frames = max(self.frames, 1)
+        # the detection stage if the detector ran on every frame
+        inference_fps = inferences / max(self.inference_time, 1e-6)
+        text = "{} frames: {} inferences ({}), {:.0%} saved, detection stage {:.1f} fps against {:.1f} fps".format(
+            self.frames, inferences, ", ".join("{} {}".format(name, count) for name, count in self.inferences.items()),
+            1 - inferences / float(frames), frames / max(self.total_time, 1e-6), inference_fps)
+        if self.drift_iou:
+            text += ", drift at refresh: IoU {:.2f}, center {:.1f} px".format(np.mean(self.drift_iou),
+                                                                             np.mean(self.drift_center))
+        return text
@@ -0,0 +1,276 @@
+"""
+Object detectors for the distance demo, registered by name.
+
+Every backend returns a list of Detection for a BGR frame, boxes in
+frame coordinates and, when the backend has_masks, a boolean mask of
+the box. The distance stage takes the depth under the mask, or under
+the middle of the box for box-only backends.
+
+    mask_rcnn   Mask R-CNN Inception v2 (mask_rcnn.py), masks, CUDA by default
+    ssd         SSD MobileNet v2 (TensorFlow) through cv2.dnn, boxes only
+    yolo        YOLOv4-tiny (Darknet) through cv2.dnn, boxes only
+    synthetic   moving ellipses, no model, for tests and benchmarks
+    none        no detections, the cost of everything but the network
+"""
+
+
+import os
+from collections import namedtuple
+import cv2
+import numpy as np
+
+
+Detection = namedtuple("Detection", ["class_id", "class_name", "score", "box", "mask"])
+
+DETECTORS = {}
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dnn")
+
+
+def register(name):
+    def decorator(cls):
+        cls.name = name
+        DETECTORS[name] = cls
+        return cls
+    return decorator
+
+
+def create_detector(name, **options):
+    if name not in DETECTORS:
+        raise ValueError("Unknown detector {}, choose from {}".format(name, ", ".join(sorted(DETECTORS))))
+    return DETECTORS[name](**options)
+
+
+def read_classes(path):
+    with open(path, "r") as file_object:
+        return [line.strip() for line in file_object.readlines()]
+
+
+def set_target(net, target):
+    if target == "cuda":
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+    else:
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+
+class Detector:
+    name = None
+    has_masks = False
+    # network input sizes (width, height) from the default down, for the quality
+    # ladder of measure_object_distance.py; None is the default of the backend
+    input_sizes = [None]
+    # every input is resized to the network size, a crop costs as much as the frame
+    fixed_input = False
+
+    def __init__(self, classes=None):
+        self.classes = classes or []
+        self.input_size = None
+
+    def class_name(self, class_id):
+        if 0 <= class_id < len(self.classes):
+            return self.classes[class_id]
+        return "class {}".format(class_id)
+
+    def detect(self, bgr_frame):
+        raise NotImplementedError
+
+    def set_input_size(self, input_size):
+        self.input_size = input_size
+
+    def detect_regions(self, bgr_frame, regions):
+        # regions from DepthGate.propose(): None for the whole frame, else the crops
+        # (x, y, x2, y2) go through detect() one by one, boxes moved back to the frame
+        if regions is None:
+            return self.detect(bgr_frame)
+        detections = []
+        for left, top, right, bottom in regions:
+            for detection in self.detect(bgr_frame[top:bottom, left:right]):
+                x, y, x2, y2 = detection.box
+                detections.append(detection._replace(box=(x + left, y + top, x2 + left, y2 + top)))
+        return detections
+
+    def warm_up(self, width=1280, height=720):
+        # The first forward pass allocates the layers, pay for it on a blank frame
+        self.detect(np.zeros((height, width, 3), np.uint8))
+
+
+@register("mask_rcnn")
+class MaskRCNNDetector(Detector):
+    has_masks = True
+    # the blob is the frame itself by default
+    input_sizes = [None, (960, 540), (640, 360), (480, 270)]
+
+    def __init__(self, model_dir=None, target="cuda", **options):
+        from mask_rcnn import MaskRCNN
+        self.mrcnn = MaskRCNN(model_dir or MODEL_DIR, cuda=target == "cuda")
+        super().__init__(self.mrcnn.classes)
+
+    def detect(self, bgr_frame):
+        detections = self.mrcnn.detect_objects_mask_batch([bgr_frame], self.input_size)[0]
+        return [Detection(class_id, self.class_name(class_id), score, box, mask)
+                for class_id, score, box, mask in detections]
+
+    def detect_regions(self, bgr_frame, regions):
+        # the crops go through the network in one batch, see detect_objects_mask_regions
+        if regions is None:
+            return self.detect(bgr_frame)
+        self.mrcnn.detect_objects_mask_regions(bgr_frame, regions)
+        detections = []
+        for box, class_id, score, contours in zip(self.mrcnn.obj_boxes, self.mrcnn.obj_classes,
+                                                  self.mrcnn.obj_scores, self.mrcnn.obj_contours):
+            x, y, x2, y2 = box
+            mask = np.zeros((y2 - y, x2 - x), np.uint8)
+            cv2.drawContours(mask, contours, -1, 1, -1)
+            detections.append(Detection(int(class_id), self.class_name(int(class_id)), float(score), tuple(box),
+                                        mask > 0))
+        return detections
+
+
+class DnnBoxDetector(Detector):
+    # Single shot detectors through cv2.dnn_DetectionModel, which does the resizing,
+    # the scaling and the non maximum suppression
+    model = None
+    config = None
+    classes_file = None
+    input_size = (300, 300)
+    input_sizes = [None, (256, 256), (192, 192)]
+    fixed_input = True
+    scale = 1.0
+
+    def __init__(self, model=None, config=None, classes=None, target="cpu", input_size=None, confidence=0.5,
+                 nms=0.4, **options):
+        model = model or os.path.join(MODEL_DIR, self.model)
+        config = config or os.path.join(MODEL_DIR, self.config)
+        classes = classes or os.path.join(MODEL_DIR, self.classes_file)
+        for path in (model, config):
+            if not os.path.isfile(path):
+                raise FileNotFoundError("{} model file {} not found, see --model and --config".format(self.name, path))
+        super().__init__(read_classes(classes) if os.path.isfile(classes) else None)
+        self.net = cv2.dnn_DetectionModel(model, config)
+        set_target(self.net, target)
+        self.default_size = tuple(input_size or self.input_size)
+        self.net.setInputParams(size=self.default_size, scale=self.scale, swapRB=True)
+        self.input_size = self.default_size
+        self.confidence = confidence
+        self.nms = nms
+
+    def set_input_size(self, input_size):
+        self.input_size = tuple(input_size or self.default_size)
+        self.net.setInputSize(self.input_size)
+
+    def detect_regions(self, bgr_frame, regions):
+        # crops would each cost a whole pass, the frame goes through once when
+        # anything is near
+        if regions is not None and not regions:
+            return []
+        return self.detect(bgr_frame)
+
+    def detect(self, bgr_frame):
+        class_ids, scores, boxes = self.net.detect(bgr_frame, self.confidence, self.nms)
+        frame_height, frame_width = bgr_frame.shape[:2]
+        detections = []
+        for class_id, score, (x, y, w, h) in zip(np.array(class_ids).ravel(), np.array(scores).ravel(), boxes):
+            x, y = max(int(x), 0), max(int(y), 0)
+            x2, y2 = min(x + int(w), frame_width), min(y + int(h), frame_height)
+            if x2 > x and y2 > y:
+                detections.append(Detection(int(class_id), self.class_name(int(class_id)), float(score),
+                                            (x, y, x2, y2), None))
+        return detections
+
+
+@register("ssd")
+class SSDDetector(DnnBoxDetector):
+    model = "ssd_mobilenet_v2_coco_2018_03_29.pb"
+    config = "ssd_mobilenet_v2_coco_2018_03_29.pbtxt"
+    classes_file = "classes.txt"
+    input_size = (300, 300)
+    scale = 1.0
+
+
+@register("yolo")
+class YOLODetector(DnnBoxDetector):
+    model = "yolov4-tiny.weights"
+    config = "yolov4-tiny.cfg"
+    classes_file = "coco.names"
+    input_size = (416, 416)
+    # multiples of 32
+    input_sizes = [None, (320, 320), (256, 256)]
+    scale = 1 / 255.0
+
+
+@register("synthetic")
+class SyntheticDetector(Detector):
+    # count ellipses crossing the frame, the same for the same frame index
+    has_masks = True
+
+    def __init__(self, count=2, masks=True, **options):
+        super().__init__(["object"])
+        self.count = count
+        self.has_masks = masks
+        self.index = 0
+
+    def detect(self, bgr_frame):
+        frame_height, frame_width = bgr_frame.shape[:2]
+        w, h = frame_width // 5, frame_height // 3
+        detections = []
+        for i in range(self.count):
+            x = (self.index * 8 + i * frame_width // max(self.count, 1)) % (frame_width - w)
+            y = (frame_height - h) * (i + 1) // (self.count + 1)
+            mask = None
+            if self.has_masks:
+                mask = np.zeros((h, w), np.uint8)
+                cv2.ellipse(mask, (w // 2, h // 2), (w // 2, h // 2), 0, 0, 360, 1, -1)
+                mask = mask > 0
+            detections.append(Detection(0, "object", 1.0, (x, y, x + w, y + h), mask))
+        self.index += 1
+        return detections
+
+
+@register("none")
+class NullDetector(Detector):
+    def __init__(self, **options):
+        super().__init__()
+
+    def detect(self, bgr_frame):
+        return []
+
+
+def detection_distance(depth_image, detection, depth_scale, use_mask=True, box_fraction=0.5):
+    # Median distance (m) of the valid depth pixels under the mask, or, without a mask,
+    # under the middle box_fraction of the box where the object most likely is
+    x, y, x2, y2 = detection.box
+    if use_mask and detection.mask is not None:
+        roi = depth_image[y:y2, x:x2]
+        values = roi[detection.mask & (roi > 0)]
+    else:
+        margin_x = int((x2 - x) * (1 - box_fraction) / 2)
+        margin_y = int((y2 - y) * (1 - box_fraction) / 2)
+        roi = depth_image[y + margin_y:y2 - margin_y, x + margin_x:x2 - margin_x]
+        values = roi[roi > 0]
+    if len(values) == 0:
+        return np.nan
+    return float(np.median(values)) * depth_scale
+
+
+def draw_detections(bgr_frame, detections, distances, colors):
+    # Masks (or boxes) with the class name and the distance of every detection
+    for detection, distance in zip(detections, distances):
+        x, y, x2, y2 = detection.box
+        color = colors[detection.class_id % len(colors)]
+        color = (int(color[0]), int(color[1]), int(color[2]))
+        if detection.mask is not None:
+            roi = bgr_frame[y:y2, x:x2]
+            overlay = np.zeros_like(roi)
+            overlay[detection.mask] = color
+            roi = cv2.addWeighted(roi, 1, overlay, 0.5, 0.0)
+            contours, _ = cv2.findContours(detection.mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(roi, contours, -1, color, 3)
+            bgr_frame[y:y2, x:x2] = roi
+        cv2.rectangle(bgr_frame, (x, y), (x2, y2), color, 1)
+        cv2.rectangle(bgr_frame, (x, y), (x + 250, y + 70), color, -1)
+        cv2.putText(bgr_frame, detection.class_name.capitalize(), (x + 5, y + 25), 0, 0.8, (255, 255, 255), 2)
+        text = "-" if np.isnan(distance) else "{:.0f} cm".format(distance * 100)
+        cv2.putText(bgr_frame, text, (x + 5, y + 60), 0, 1.0, (255, 255, 255), 2)
+    return bgr_frame
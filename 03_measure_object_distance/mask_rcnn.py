@@ -1,16 +1,21 @@
 # https://pysource.com/instance-segmentation-mask-rcnn-with-python-and-opencv
+import os
 import cv2
 import numpy as np
 
 
 class MaskRCNN:
-    def __init__(self):
+    def __init__(self, model_dir="dnn", cuda=True):
         # Loading Mask RCNN
         self.net = cv2.dnn.readNetFromTensorflow(
-            "dnn/frozen_inference_graph_coco.pb",
-            "dnn/mask_rcnn_inception_v2_coco_2018_01_28.pbtxt")
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+            os.path.join(model_dir, "frozen_inference_graph_coco.pb"),
+            os.path.join(model_dir, "mask_rcnn_inception_v2_coco_2018_01_28.pbtxt"))
+        if cuda:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        else:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
 
         # Generate random colors
         np.random.seed(2)
@@ -21,19 +26,25 @@ class MaskRCNN:
         self.mask_threshold = 0.3
 
         self.classes = []
-        with open("dnn/classes.txt", "r") as file_object:
+        with open(os.path.join(model_dir, "classes.txt"), "r") as file_object:
             for class_name in file_object.readlines():
                 class_name = class_name.strip()
                 self.classes.append(class_name)
 
         self.obj_boxes = []
         self.obj_classes = []
+        self.obj_scores = []
         self.obj_centers = []
         self.obj_contours = []
 
         # Distances
         self.distances = []
 
+    def warm_up(self, width=1280, height=720):
+        # The first forward pass allocates the layers (and the CUDA kernels),
+        # pay for it on a blank frame before the first real one arrives
+        self.detect_objects_mask(np.zeros((height, width, 3), np.uint8))
+
     def detect_objects_mask(self, bgr_frame):
         blob = cv2.dnn.blobFromImage(bgr_frame, swapRB=True)
         self.net.setInput(blob)
@@ -47,6 +58,7 @@ class MaskRCNN:
         # Object Boxes
         self.obj_boxes = []
         self.obj_classes = []
+        self.obj_scores = []
         self.obj_centers = []
         self.obj_contours = []
 
@@ -63,27 +75,127 @@ class MaskRCNN:
             y = int(box[4] * frame_height)
             x2 = int(box[5] * frame_width)
             y2 = int(box[6] * frame_height)
-            self.obj_boxes.append([x, y, x2, y2])
+            self._append_object(class_id, score, (x, y, x2, y2), masks[i, int(class_id)])
 
-            cx = (x + x2) // 2
-            cy = (y + y2) // 2
-            self.obj_centers.append((cx, cy))
+        return self.obj_boxes, self.obj_classes, self.obj_contours, self.obj_centers
 
-            # append class
-            self.obj_classes.append(class_id)
+    def detect_objects_mask_regions(self, bgr_frame, regions):
+        # regions from DepthGate.propose(): None runs the whole frame, else only the
+        # crops (x, y, x2, y2) go through the network. Several crops are padded to the
+        # size of the largest one and batched, unless that costs more than the frame.
+        # Boxes and contours are in full frame coordinates, as with detect_objects_mask.
+        if regions is None:
+            return self.detect_objects_mask(bgr_frame)
 
-            # Contours
-            # Get mask coordinates
-            # Get the mask
-            mask = masks[i, int(class_id)]
-            roi_height, roi_width = y2 - y, x2 - x
-            mask = cv2.resize(mask, (roi_width, roi_height))
-            _, mask = cv2.threshold(mask, self.mask_threshold, 255, cv2.THRESH_BINARY)
-            contours, _ = cv2.findContours(np.array(mask, np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            self.obj_contours.append(contours)
+        self.obj_boxes = []
+        self.obj_classes = []
+        self.obj_scores = []
+        self.obj_centers = []
+        self.obj_contours = []
+
+        frame_height, frame_width, _ = bgr_frame.shape
+        canvas_width = max([x2 - x for x, y, x2, y2 in regions], default=0)
+        canvas_height = max([y2 - y for x, y, x2, y2 in regions], default=0)
+        if len(regions) > 1 and len(regions) * canvas_width * canvas_height <= frame_width * frame_height:
+            canvases = []
+            for x, y, x2, y2 in regions:
+                canvas = np.zeros((canvas_height, canvas_width, 3), np.uint8)
+                canvas[:y2 - y, :x2 - x] = bgr_frame[y:y2, x:x2]
+                canvases.append(canvas)
+            batches = [(regions, canvases)]
+        else:
+            batches = [([region], [bgr_frame[region[1]:region[3], region[0]:region[2]]]) for region in regions]
+
+        for batch_regions, images in batches:
+            blob = cv2.dnn.blobFromImages(images, swapRB=True)
+            self.net.setInput(blob)
+            boxes, masks = self.net.forward(["detection_out_final", "detection_masks"])
+
+            image_height, image_width, _ = images[0].shape
+            for i in range(boxes.shape[2]):
+                # first column is the index of the crop in the batch
+                image_id, class_id, score = boxes[0, 0, i, :3]
+                if score < self.detection_threshold:
+                    continue
+
+                # back to the frame, without the padding of the canvas
+                left, top, right, bottom = batch_regions[int(image_id)]
+                box_x = int(boxes[0, 0, i, 3] * image_width)
+                box_y = int(boxes[0, 0, i, 4] * image_height)
+                box_x2 = int(boxes[0, 0, i, 5] * image_width)
+                box_y2 = int(boxes[0, 0, i, 6] * image_height)
+                x = left + max(box_x, 0)
+                y = top + max(box_y, 0)
+                x2 = left + min(box_x2, right - left)
+                y2 = top + min(box_y2, bottom - top)
+                if x2 <= x or y2 <= y:
+                    continue
+                # the mask covers the whole box, it is resized to it and then cut like the box
+                mask = cv2.resize(masks[i, int(class_id)], (box_x2 - box_x, box_y2 - box_y))
+                mask = mask[y - top - box_y:y2 - top - box_y, x - left - box_x:x2 - left - box_x]
+                self._append_object(class_id, score, (x, y, x2, y2), mask)
 
         return self.obj_boxes, self.obj_classes, self.obj_contours, self.obj_centers
 
+    def _append_object(self, class_id, score, box, mask):
+        # box in frame coordinates, mask is the network output for the class of the object
+        x, y, x2, y2 = box
+        self.obj_boxes.append([x, y, x2, y2])
+        self.obj_scores.append(score)
+
+        cx = (x + x2) // 2
+        cy = (y + y2) // 2
+        self.obj_centers.append((cx, cy))
+
+        # append class
+        self.obj_classes.append(class_id)
+
+        # Contours
+        # Get the mask
+        roi_height, roi_width = y2 - y, x2 - x
+        if mask.shape != (roi_height, roi_width):
+            mask = cv2.resize(mask, (roi_width, roi_height))
+        _, mask = cv2.threshold(mask, self.mask_threshold, 255, cv2.THRESH_BINARY)
+        contours, _ = cv2.findContours(np.array(mask, np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        self.obj_contours.append(contours)
+
+    def detect_objects_mask_batch(self, bgr_frames, input_size=None):
+        # One forward pass for a list of frames of the same size. Returns, for each
+        # frame, a list of (class_id, score, box, mask), the mask being a boolean
+        # image of the box. The drawing methods are not updated. input_size=(width,
+        # height) feeds a downscaled blob to the network, boxes are normalized so
+        # they still map back to the full frame.
+        if input_size is None:
+            blob = cv2.dnn.blobFromImages(bgr_frames, swapRB=True)
+        else:
+            blob = cv2.dnn.blobFromImages(bgr_frames, size=tuple(input_size), swapRB=True)
+        self.net.setInput(blob)
+
+        boxes, masks = self.net.forward(["detection_out_final", "detection_masks"])
+
+        detections = [[] for _ in bgr_frames]
+        frame_height, frame_width, _ = bgr_frames[0].shape
+        for i in range(boxes.shape[2]):
+            # first column is the index of the frame in the batch
+            image_id, class_id, score = boxes[0, 0, i, :3]
+            if score < self.detection_threshold:
+                continue
+
+            box_x = int(boxes[0, 0, i, 3] * frame_width)
+            box_y = int(boxes[0, 0, i, 4] * frame_height)
+            box_x2 = int(boxes[0, 0, i, 5] * frame_width)
+            box_y2 = int(boxes[0, 0, i, 6] * frame_height)
+            x, y = max(box_x, 0), max(box_y, 0)
+            x2, y2 = min(box_x2, frame_width), min(box_y2, frame_height)
+            if x2 <= x or y2 <= y:
+                continue
+
+            # the mask covers the whole box, it is resized to it and then cut like the box
+            mask = cv2.resize(masks[i, int(class_id)], (box_x2 - box_x, box_y2 - box_y)) > self.mask_threshold
+            mask = mask[y - box_y:y2 - box_y, x - box_x:x2 - box_x]
+            detections[int(image_id)].append((int(class_id), float(score), (x, y, x2, y2), mask))
+        return detections
+
     def draw_object_mask(self, bgr_frame):
         # loop through the detection
         for box, class_id, contours in zip(self.obj_boxes, self.obj_classes, self.obj_contours):
@@ -1,33 +1,171 @@
 #https://pysource.com
-import cv2
-from realsense_camera import RealsenseCamera
-from mask_rcnn import MaskRCNN
+import time
+start_time = time.perf_counter()
+import argparse
+from startup import StartupReport, BackgroundTask
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--detector', default='mask_rcnn', type=str,
+	help="Detector backend: mask_rcnn, ssd, yolo, synthetic or none (see detectors.py)")
+parser.add_argument('--model', default=None, type=str, help="Weights of the ssd/yolo detector, default in dnn/")
+parser.add_argument('--config', default=None, type=str, help="Network description of the ssd/yolo detector")
+parser.add_argument('--classes', default=None, type=str, help="Class names of the ssd/yolo detector, one per line")
+parser.add_argument('--target', default=None, type=str, choices=['cpu', 'cuda'],
+	help="Where the network runs, CUDA for mask_rcnn and CPU for the others by default")
+parser.add_argument('--input', '-i', default=None, type=str, help="Play back a .bag file instead of the camera")
+parser.add_argument('--reuse', action='store_true',
+	help="Reuse the detections, moved with optical flow, while the frame barely changes")
+parser.add_argument('--change_threshold', default=0.02, type=float,
+	help="Reuse: fraction of changed pixels above which the detector runs again")
+parser.add_argument('--change_source', default='color', type=str, choices=['color', 'depth'],
+	help="Reuse: measure the change on the color or on the depth frame")
+parser.add_argument('--refresh_every', default=15, type=int, help="Reuse: run the detector at least every this many frames")
+parser.add_argument('--fast_start', action='store_true',
+	help="Load and warm up the network on a background thread while the camera starts")
+parser.add_argument('--depth_gate', action='store_true',
+	help="Run the network only on crops around the regions closer than --max_distance")
+parser.add_argument('--max_distance', default=3.0, type=float, help="Depth gate range in meters")
+parser.add_argument('--full_frame_every', default=30, type=int,
+	help="Depth gate: one frame out of this many goes whole through the network, 0 for never")
+parser.add_argument('--target_fps', default=0, type=float,
+	help="Lower the network input size and the preview rate to hold this processing rate, 0 to disable")
+parser.add_argument('--quality_log', default=None, type=str, help="CSV log of the --target_fps quality changes")
+args = parser.parse_args()
+report = StartupReport(start_time)
+
+
+def load_network(warm_up):
+	# OpenCV is imported here so that its import overlaps the camera start
+	with report.phase("import dnn"):
+		from detectors import create_detector
+	with report.phase("model load"):
+		options = {"model": args.model, "config": args.config, "classes": args.classes}
+		if args.target is not None:
+			options["target"] = args.target
+		detector = create_detector(args.detector, **options)
+	if warm_up:
+		with report.phase("warm-up"):
+			detector.warm_up()
+	return detector
+
+
+if args.fast_start:
+	network = BackgroundTask(lambda: load_network(warm_up=True), name="network")
 
 # Load Realsense camera
-rs = RealsenseCamera()
-mrcnn = MaskRCNN()
+with report.phase("import camera"):
+	from realsense_camera import RealsenseCamera
+with report.phase("pipeline start"):
+	rs = RealsenseCamera(input=args.input)
+
+if args.fast_start:
+	detector = network.result()
+else:
+	detector = load_network(warm_up=False)
+import cv2
+import numpy as np
+from detectors import detection_distance, draw_detections
+
+# Depth-gated region proposals, the network skips the far background
+gate = None
+if args.depth_gate:
+	from depth_regions import DepthGate
+	gate = DepthGate(args.max_distance, args.full_frame_every, fixed_input=detector.fixed_input)
 
+# Detections reused while the scene is still, the network runs on changes
+scheduler = None
+if args.reuse:
+	from detection_reuse import DetectionScheduler
+	scheduler = DetectionScheduler(args.change_threshold, args.refresh_every, args.change_source)
+
+# Steps down the preview rate, then the network input sizes of the backend, when
+# processing falls behind the target fps (see adaptive_quality.py)
+quality = None
+preview_every = 1
+if args.target_fps > 0:
+	from adaptive_quality import AdaptiveQualityController
+	ladder = [{"dnn_size": None, "preview_every": 1}]
+	ladder += [{"dnn_size": size, "preview_every": 3} for size in detector.input_sizes]
+	quality = AdaptiveQualityController(args.target_fps, ladder, log_path=args.quality_log)
+
+
+def detect(bgr_frame):
+	if gate is None:
+		return detector.detect(bgr_frame)
+	regions = gate.propose(depth_frame, rs.depth_scale)
+	return detector.detect_regions(bgr_frame, regions)
+
+# Generate random colors
+np.random.seed(2)
+colors = np.random.randint(0, 255, (90, 3))
+
+# Rates of the loop and of the detector alone, per backend
+frame_count = 0
+detect_time = 0.0
+loop_start = time.perf_counter()
+
+first_frame = True
 while True:
 	# Get frame in real time from Realsense camera
 	ret, bgr_frame, depth_frame = rs.get_frame_stream()
+	if not ret:
+		if rs.finished:
+			break
+		continue
+	# processing time is measured from here, waiting for the camera is not part of it
+	frame_start = time.perf_counter()
+	if first_frame:
+		report.mark("first frame")
 
-	# Get object mask
-	boxes, classes, contours, centers = mrcnn.detect_objects_mask(bgr_frame)
+	# Get objects, masks for the backends that have them
+	detect_start = time.perf_counter()
+	if scheduler is None:
+		detections = detect(bgr_frame)
+	else:
+		detections = scheduler.update(bgr_frame, depth_frame, detect)
+	detect_time += time.perf_counter() - detect_start
+	frame_count += 1
+	if first_frame:
+		report.mark("first detection")
+		report.print()
+		first_frame = False
+		# the rates leave out the start-up
+		frame_count, detect_time, loop_start = 0, 0.0, time.perf_counter()
 
-	# Draw object mask
-	bgr_frame = mrcnn.draw_object_mask(bgr_frame)
+	# Distance of the objects, over the mask or the middle of the box
+	distances = [detection_distance(depth_frame, detection, rs.depth_scale, detector.has_masks)
+	             for detection in detections]
 
-	# Show depth info of the objects
-	mrcnn.draw_object_info(bgr_frame, depth_frame)
+	# Draw object masks and depth info
+	bgr_frame = draw_detections(bgr_frame, detections, distances, colors)
+	if frame_count:
+		cv2.putText(bgr_frame, "{} {:.1f} fps (detector {:.1f} fps)".format(
+			detector.name, frame_count / (time.perf_counter() - loop_start), frame_count / max(detect_time, 1e-6)),
+			(10, bgr_frame.shape[0] - 15), 0, 0.8, (255, 255, 255), 2)
 
 	# Show RGB and depth frames
-	cv2.imshow("depth frame", depth_frame)
-	cv2.imshow("BGR frame", bgr_frame)
+	if frame_count % preview_every == 0:
+		cv2.imshow("depth frame", depth_frame)
+		cv2.imshow("BGR frame", bgr_frame)
 
 	key = cv2.waitKey(1)
 	if key == 27:
 		break
 
+	# Apply the new settings when the controller changes level
+	# the first frame, with the start-up in it, is left out
+	if quality is not None and frame_count and quality.update(time.perf_counter() - frame_start):
+		detector.set_input_size(quality.settings["dnn_size"])
+		preview_every = quality.settings["preview_every"]
+
+if frame_count:
+	print("{}: {} frames, {:.1f} fps, detector {:.1f} fps".format(
+		detector.name, frame_count, frame_count / (time.perf_counter() - loop_start), frame_count / max(detect_time, 1e-6)))
+if gate is not None:
+	print(gate.summary())
+if scheduler is not None:
+	print(scheduler.summary())
+if quality is not None:
+	quality.close()
 rs.release()
 cv2.destroyAllWindows()
-
@@ -1,27 +1,64 @@
 #https://pysource.com
 import pyrealsense2 as rs
 import numpy as np
+from reprojection_align import ReprojectionAlign
 
 
 class RealsenseCamera:
-    def __init__(self):
+    def __init__(self, table_align=False, align_cache_dir="align_cache", input=None):
+        # input is a .bag file played back as fast as it can be read, instead of the camera
         # Configure depth and color streams
         print("Loading Intel Realsense Camera")
         self.pipeline = rs.pipeline()
 
         config = rs.config()
-        config.enable_stream(rs.stream.color, 1280, 720, rs.format.bgr8, 30)
-        config.enable_stream(rs.stream.depth, 1280, 720, rs.format.z16, 30)
+        if input is None:
+            config.enable_stream(rs.stream.color, 1280, 720, rs.format.bgr8, 30)
+            config.enable_stream(rs.stream.depth, 1280, 720, rs.format.z16, 30)
+        else:
+            config.enable_device_from_file(input, repeat_playback=False)
 
         # Start streaming
-        self.pipeline.start(config)
+        profile = self.pipeline.start(config)
+        self.playback = None
+        if input is not None:
+            self.playback = profile.get_device().as_playback()
+            self.playback.set_real_time(False)
+        # meters per depth unit
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
         align_to = rs.stream.color
         self.align = rs.align(align_to)
 
+        # Static rig: align with reprojection tables computed once per calibration
+        self.table_align = None
+        if table_align:
+            self.table_align = ReprojectionAlign.from_profile(profile, align_cache_dir)
+
+        # Filters to fill the holes in the depth image
+        self.spatial = rs.spatial_filter()
+        self.spatial.set_option(rs.option.holes_fill, 3)
+        self.hole_filling = rs.hole_filling_filter()
+
+        # Color timestamp (ms) and frame number of the last frames returned,
+        # finished once a played back recording has no more frames
+        self.timestamp = None
+        self.frame_number = None
+        self.finished = False
+
     def get_frame_stream(self):
         # Wait for a coherent pair of frames: depth and color
-        frames = self.pipeline.wait_for_frames()
-        aligned_frames = self.align.process(frames)
+        if self.playback is None:
+            frames = self.pipeline.wait_for_frames()
+        else:
+            success, frames = self.pipeline.try_wait_for_frames(1000)
+            if not success:
+                self.finished = True
+                return False, None, None
+        if self.table_align is None:
+            aligned_frames = self.align.process(frames)
+        else:
+            # Filters run on the raw depth, alignment is done on the numpy image below
+            aligned_frames = frames
         depth_frame = aligned_frames.get_depth_frame()
         color_frame = aligned_frames.get_color_frame()
         
@@ -31,24 +68,19 @@ class RealsenseCamera:
             return False, None, None
         
         # Apply filter to fill the Holes in the depth image
-        spatial = rs.spatial_filter()
-        spatial.set_option(rs.option.holes_fill, 3)
-        filtered_depth = spatial.process(depth_frame)
-
-        hole_filling = rs.hole_filling_filter()
-        filled_depth = hole_filling.process(filtered_depth)
-        
-        # Create colormap to show the depth of the Objects
-        colorizer = rs.colorizer()
-        depth_colormap = np.asanyarray(colorizer.colorize(filled_depth).get_data())
+        filtered_depth = self.spatial.process(depth_frame)
+        filled_depth = self.hole_filling.process(filtered_depth)
         
         # Convert images to numpy arrays
         # distance = depth_frame.get_distance(int(50),int(50))
         # print("distance", distance)
         depth_image = np.asanyarray(filled_depth.get_data())
+        if self.table_align is not None:
+            depth_image = self.table_align.align_depth_to_color(depth_image)
         color_image = np.asanyarray(color_frame.get_data())
+        self.timestamp = color_frame.get_timestamp()
+        self.frame_number = color_frame.get_frame_number()
 
-        # cv2.imshow("Colormap", depth_colormap)
         # cv2.imshow("depth img", depth_image)
 
         return True, color_image, depth_image
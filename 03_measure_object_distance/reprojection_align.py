@@ -0,0 +1,219 @@
+"""
+Depth/color alignment with precomputed reprojection tables.
+
+rs.align deprojects and reprojects every depth pixel on every frame.
+With a static rig the intrinsics and extrinsics never change, so the
+per-pixel rays are computed once per calibration, cached on disk and
+every frame is aligned with vectorized NumPy gather/scatter.
+"""
+
+
+import os
+import hashlib
+import numpy as np
+import pyrealsense2 as rs
+
+
+def _undistort(x, y, intrin):
+    # Vectorized version of the normalization in rs2_deproject_pixel_to_point
+    c = intrin.coeffs
+    if intrin.model == rs.distortion.inverse_brown_conrady:
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        ux = x * f + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+        uy = y * f + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+        return ux, uy
+    if intrin.model == rs.distortion.brown_conrady:
+        # need to loop until convergence, 10 iterations as in librealsense
+        xo, yo = x, y
+        for _ in range(10):
+            r2 = x * x + y * y
+            icdist = 1 / (1 + ((c[4] * r2 + c[1]) * r2 + c[0]) * r2)
+            delta_x = 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+            delta_y = 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+            x = (xo - delta_x) * icdist
+            y = (yo - delta_y) * icdist
+        return x, y
+    if intrin.model == rs.distortion.none:
+        return x, y
+    raise ValueError("Unsupported deprojection distortion model: {}".format(intrin.model))
+
+
+def _distort(x, y, intrin):
+    # Vectorized version of the distortion in rs2_project_point_to_pixel
+    c = intrin.coeffs
+    if intrin.model in (rs.distortion.modified_brown_conrady, rs.distortion.inverse_brown_conrady):
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        x = x * f
+        y = y * f
+        dx = x + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+        dy = y + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+        return dx, dy
+    if intrin.model == rs.distortion.brown_conrady:
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        dx = x * f + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+        dy = y * f + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+        return dx, dy
+    if intrin.model == rs.distortion.none:
+        return x, y
+    raise ValueError("Unsupported projection distortion model: {}".format(intrin.model))
+
+
+def _deproject_rays(intrin, offset):
+    # Unit-depth ray for every pixel, shifted by offset (e.g. -0.5 for the top-left corner)
+    u, v = np.meshgrid(np.arange(intrin.width, dtype=np.float64) + offset,
+                       np.arange(intrin.height, dtype=np.float64) + offset)
+    x = (u - intrin.ppx) / intrin.fx
+    y = (v - intrin.ppy) / intrin.fy
+    x, y = _undistort(x, y, intrin)
+    return np.stack([x.ravel(), y.ravel(), np.ones(x.size)])
+
+
+class ReprojectionAlign:
+    def __init__(self, depth_intrinsics, color_intrinsics, depth_to_color, depth_scale,
+                 cache_path=None):
+        self.depth_intrin = depth_intrinsics
+        self.color_intrin = color_intrinsics
+        self.depth_scale = depth_scale
+
+        # librealsense stores the rotation column-major
+        self.rotation = np.array(depth_to_color.rotation, np.float64).reshape(3, 3).T
+        self.translation = np.array(depth_to_color.translation, np.float64).reshape(3, 1)
+
+        # Load the reprojection tables, or build them and store them for the next run
+        if cache_path is not None and os.path.exists(cache_path):
+            tables = np.load(cache_path)
+            self.rays_center = tables["rays_center"]
+            self.rays_tl = tables["rays_tl"]
+            self.rays_br = tables["rays_br"]
+        else:
+            # Rays are rotated into the color frame once, so each frame only needs z * ray + t
+            self.rays_center = (self.rotation @ _deproject_rays(depth_intrinsics, 0.0)).astype(np.float32)
+            self.rays_tl = (self.rotation @ _deproject_rays(depth_intrinsics, -0.5)).astype(np.float32)
+            self.rays_br = (self.rotation @ _deproject_rays(depth_intrinsics, 0.5)).astype(np.float32)
+            if cache_path is not None:
+                os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+                np.savez(cache_path, rays_center=self.rays_center,
+                         rays_tl=self.rays_tl, rays_br=self.rays_br)
+
+        # Without color distortion the color intrinsics fold into the tables,
+        # so projecting is a single multiply-add and divide per coordinate
+        self.distortion_free = (color_intrinsics.model == rs.distortion.none or not any(color_intrinsics.coeffs))
+        if self.distortion_free:
+            camera_matrix = np.array([[color_intrinsics.fx, 0, color_intrinsics.ppx],
+                                      [0, color_intrinsics.fy, color_intrinsics.ppy],
+                                      [0, 0, 1]], np.float32)
+            self.rays_center = camera_matrix @ self.rays_center
+            self.rays_tl = camera_matrix @ self.rays_tl
+            self.rays_br = camera_matrix @ self.rays_br
+            self.translation = camera_matrix @ self.translation
+        self.translation = self.translation.astype(np.float32)
+        self.depth_shape = (depth_intrinsics.height, depth_intrinsics.width)
+        self.color_shape = (color_intrinsics.height, color_intrinsics.width)
+
+    @classmethod
+    def from_profile(cls, pipeline_profile, cache_dir="align_cache"):
+        # Read calibration from a started pipeline (live camera or .bag playback)
+        device = pipeline_profile.get_device()
+        depth_profile = pipeline_profile.get_stream(rs.stream.depth).as_video_stream_profile()
+        color_profile = pipeline_profile.get_stream(rs.stream.color).as_video_stream_profile()
+        depth_intrin = depth_profile.get_intrinsics()
+        color_intrin = color_profile.get_intrinsics()
+        extrin = depth_profile.get_extrinsics_to(color_profile)
+        depth_scale = device.first_depth_sensor().get_depth_scale()
+
+        cache_path = None
+        if cache_dir is not None:
+            serial = device.get_info(rs.camera_info.serial_number)
+            cache_path = os.path.join(cache_dir, cls.cache_key(serial, depth_intrin, color_intrin, extrin) + ".npz")
+        return cls(depth_intrin, color_intrin, extrin, depth_scale, cache_path)
+
+    @staticmethod
+    def cache_key(serial, depth_intrin, color_intrin, extrin):
+        # Device serial and profiles in clear, calibration values hashed, so that
+        # a recalibrated camera does not reuse stale tables
+        calibration = []
+        for intrin in (depth_intrin, color_intrin):
+            calibration += [intrin.width, intrin.height, intrin.fx, intrin.fy,
+                            intrin.ppx, intrin.ppy, int(intrin.model)] + list(intrin.coeffs)
+        calibration += list(extrin.rotation) + list(extrin.translation)
+        digest = hashlib.sha1(repr(calibration).encode()).hexdigest()[:12]
+        return "{}_d{}x{}_c{}x{}_{}".format(serial, depth_intrin.width, depth_intrin.height,
+                                            color_intrin.width, color_intrin.height, digest)
+
+    def _project(self, rays, z):
+        # Project depth points (in meters) to color pixel coordinates
+        t = self.translation
+        w = rays[2] * z
+        w += t[2]
+        with np.errstate(divide="ignore"):
+            np.reciprocal(w, out=w)
+        x = rays[0] * z
+        x += t[0]
+        x *= w
+        y = rays[1] * z
+        y += t[1]
+        y *= w
+        if self.distortion_free:
+            return x, y
+        x, y = _distort(x, y, self.color_intrin)
+        return x * self.color_intrin.fx + self.color_intrin.ppx, y * self.color_intrin.fy + self.color_intrin.ppy
+
+    def align_depth_to_color(self, depth_image):
+        # Scatter every depth pixel onto the color image, keeping the nearest depth (z-buffer)
+        depth = depth_image.ravel()
+        z = depth.astype(np.float32)
+        z *= self.depth_scale
+
+        # Each depth pixel covers the color rectangle between its projected corners
+        x0, y0 = self._project(self.rays_tl, z)
+        x1, y1 = self._project(self.rays_br, z)
+        x0 = np.rint(x0, out=x0).astype(np.int32)
+        y0 = np.rint(y0, out=y0).astype(np.int32)
+        x1 = np.rint(x1, out=x1).astype(np.int32)
+        y1 = np.rint(y1, out=y1).astype(np.int32)
+
+        height, width = self.color_shape
+        valid = (depth > 0) & (x0 >= 0) & (y0 >= 0) & (x1 < width) & (y1 < height)
+        aligned = np.full(height * width, np.iinfo(np.uint16).max, np.uint16)
+        # Footprints are at most 2x2 color pixels when resolutions are comparable
+        for dy in (0, 1):
+            for dx in (0, 1):
+                mask = valid
+                if dx:
+                    mask = mask & (x0 < x1)
+                if dy:
+                    mask = mask & (y0 < y1)
+                mask = np.flatnonzero(mask)
+                index = (y0[mask] + dy) * width + (x0[mask] + dx)
+                values = depth[mask]
+                # Duplicated indices keep an arbitrary writer: repeat with the
+                # ones that are still closer until every pixel holds its minimum
+                while index.size:
+                    aligned[index] = np.minimum(aligned[index], values)
+                    closer = values < aligned[index]
+                    index = index[closer]
+                    values = values[closer]
+
+        aligned[aligned == np.iinfo(np.uint16).max] = 0
+        return aligned.reshape(self.color_shape)
+
+    def align_color_to_depth(self, color_image, depth_image):
+        # Gather the color pixel under each depth pixel, no z-buffer needed
+        depth = depth_image.ravel()
+        z = depth.astype(np.float32)
+        z *= self.depth_scale
+
+        x, y = self._project(self.rays_center, z)
+        x = np.rint(x, out=x).astype(np.int32)
+        y = np.rint(y, out=y).astype(np.int32)
+
+        height, width = self.color_shape
+        valid = np.flatnonzero((depth > 0) & (x >= 0) & (y >= 0) & (x < width) & (y < height))
+
+        aligned = np.zeros((depth.size,) + color_image.shape[2:], color_image.dtype)
+        flat_color = color_image.reshape((height * width,) + color_image.shape[2:])
+        aligned[valid] = flat_color[y[valid] * width + x[valid]]
+        return aligned.reshape(self.depth_shape + color_image.shape[2:])
@@ -0,0 +1,73 @@
+"""
+Columnar writer for per-object results. Rows are buffered and written
+in bulk: CSV is appended chunk by chunk, Parquet gets one row group
+per chunk (needs pyarrow) and NPZ is written once at the end, one
+array per column.
+"""
+
+
+import os
+import csv
+import numpy as np
+
+
+class ResultsWriter:
+    def __init__(self, path, columns, chunk_rows=4096):
+        self.path = path
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.format = os.path.splitext(path)[1].lower()
+        if self.format not in (".csv", ".parquet", ".npz"):
+            raise ValueError("Unsupported results format {}, use .csv, .parquet or .npz".format(self.format))
+        self.rows = []
+        self.written = 0
+
+        self.file = None
+        self.parquet_writer = None
+        # NPZ chunks waiting for close(), column name -> list of arrays
+        self.chunks = {name: [] for name in columns}
+        if self.format == ".csv":
+            self.file = open(path, 'w', newline='')
+            self.csv_writer = csv.writer(self.file)
+            self.csv_writer.writerow(columns)
+        elif self.format == ".parquet":
+            import pyarrow
+            import pyarrow.parquet
+            self.pyarrow = pyarrow
+            self.parquet = pyarrow.parquet
+
+    def append(self, row):
+        # row is a tuple in the order of the columns
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.format == ".csv":
+            self.csv_writer.writerows(self.rows)
+            self.file.flush()
+        else:
+            columns = [np.asarray(values) for values in zip(*self.rows)]
+            if self.format == ".parquet":
+                table = self.pyarrow.table(columns, names=self.columns)
+                if self.parquet_writer is None:
+                    self.parquet_writer = self.parquet.ParquetWriter(self.path, table.schema)
+                self.parquet_writer.write_table(table)
+            else:
+                for name, values in zip(self.columns, columns):
+                    self.chunks[name].append(values)
+        self.written += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.format == ".csv":
+            self.file.close()
+        elif self.format == ".parquet":
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
+        else:
+            np.savez(self.path, **{name: np.concatenate(chunks) if chunks else np.array([])
+                                   for name, chunks in self.chunks.items()})
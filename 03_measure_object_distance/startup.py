@@ -0,0 +1,63 @@
+"""
+Time-to-first-frame reporting and background start-up tasks.
+"""
+
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupReport:
+    def __init__(self, origin=None):
+        # origin is the perf_counter value taken at the very top of the script,
+        # so that the imports are part of the report
+        self.origin = time.perf_counter() if origin is None else origin
+        self.phases = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter() - self.origin
+        try:
+            yield
+        finally:
+            end = time.perf_counter() - self.origin
+            with self.lock:
+                self.phases.append((name, start, end, threading.current_thread().name))
+
+    def mark(self, name):
+        # Zero-length phase, for milestones like "first detection"
+        now = time.perf_counter() - self.origin
+        with self.lock:
+            self.phases.append((name, now, now, threading.current_thread().name))
+
+    def print(self):
+        print("Startup breakdown (seconds since launch):")
+        for name, start, end, thread in sorted(self.phases, key=lambda phase: phase[2]):
+            if end > start:
+                print("  {:<18} {:7.3f} -> {:7.3f}  ({:.3f} s, {})".format(name, start, end, end - start, thread))
+            else:
+                print("  {:<18} {:7.3f}".format(name, end))
+
+
+class BackgroundTask:
+    # Run a function on its own thread, result() waits for it and re-raises its errors
+    def __init__(self, target, name=None):
+        self.target = target
+        self.value = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.value = self.target()
+        except BaseException as error:
+            self.error = error
+
+    def result(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
@@ -0,0 +1,117 @@
+"""
+Compare the reprojection table alignment against rs.align
+on a recorded .bag with depth and color streams.
+"""
+
+
+import pyrealsense2 as rs
+import numpy as np
+import os
+import time
+import argparse
+from reprojection_align import ReprojectionAlign
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default='record.bag', type=str, help="Path to the bag file")
+    parser.add_argument(
+        '--frames', default=300, type=int, help="Number of framesets to compare")
+    parser.add_argument(
+        '--tolerance', default=10, type=int, help="Depth agreement tolerance in mm")
+    parser.add_argument(
+        '--cache_dir', default='align_cache', type=str, help="Folder of the reprojection tables")
+    return parser
+
+
+def get_args(parser):
+    # Parse the command line arguments to an object
+    args = parser.parse_args()
+    # Check if the given file have bag extension
+    if os.path.splitext(args.input)[1] != ".bag":
+        print("The given file is not of correct file format.")
+        print("Only .bag files are accepted")
+        exit()
+    return args
+
+
+def main(args):
+    # Create pipeline reading from the recorded device
+    pipeline = rs.pipeline()
+    config = rs.config()
+    # All the recorded streams are played back, both depth and color are needed
+    config.enable_device_from_file(args.input, repeat_playback=False)
+    profile = pipeline.start(config)
+    profile.get_device().as_playback().set_real_time(False)
+
+    start = time.perf_counter()
+    table_align = ReprojectionAlign.from_profile(profile, args.cache_dir)
+    print("Reprojection tables ready in {:.3f} s".format(time.perf_counter() - start))
+    depth_scale_mm = table_align.depth_scale * 1000
+
+    align_to_color = rs.align(rs.stream.color)
+    align_to_depth = rs.align(rs.stream.depth)
+
+    times = {"rs.align depth->color": [], "table depth->color": [],
+             "rs.align color->depth": [], "table color->depth": []}
+    agreement = []
+    coverage = []
+    color_diff = []
+
+    try:
+        for _ in range(args.frames):
+            try:
+                frames = pipeline.wait_for_frames()
+            except RuntimeError:
+                print("End of recording reached")
+                break
+            depth_image = np.asanyarray(frames.get_depth_frame().get_data())
+            color_image = np.asanyarray(frames.get_color_frame().get_data())
+
+            # DEPTH -> COLOR
+            start = time.perf_counter()
+            reference = align_to_color.process(frames).get_depth_frame()
+            reference = np.asanyarray(reference.get_data())
+            times["rs.align depth->color"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            aligned = table_align.align_depth_to_color(depth_image)
+            times["table depth->color"].append(time.perf_counter() - start)
+
+            both = (reference > 0) & (aligned > 0)
+            either = (reference > 0) | (aligned > 0)
+            error_mm = np.abs(reference[both].astype(np.int32) - aligned[both]) * depth_scale_mm
+            agreement.append(np.mean(error_mm <= args.tolerance) if both.any() else 1.0)
+            coverage.append(both.sum() / max(either.sum(), 1))
+
+            # COLOR -> DEPTH
+            start = time.perf_counter()
+            reference = align_to_depth.process(frames).get_color_frame()
+            reference = np.asanyarray(reference.get_data())
+            times["rs.align color->depth"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            aligned = table_align.align_color_to_depth(color_image, depth_image)
+            times["table color->depth"].append(time.perf_counter() - start)
+
+            valid = depth_image > 0
+            color_diff.append(np.abs(reference[valid].astype(np.int16) - aligned[valid]).mean())
+    finally:
+        pipeline.stop()
+
+    print("Compared framesets:", len(agreement))
+    for name, values in times.items():
+        if values:
+            print("{:<24} {:7.2f} ms/frame".format(name, 1000 * np.mean(values)))
+    if agreement:
+        print("Depth pixels within {} mm of rs.align: {:.2%}".format(args.tolerance, np.mean(agreement)))
+        print("Valid pixel overlap with rs.align: {:.2%}".format(np.mean(coverage)))
+        print("Mean color difference on valid depth: {:.2f}".format(np.mean(color_diff)))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = get_args(parser)
+    print(args)
+    main(args)
@@ -0,0 +1,34 @@
+import numpy as np
+import pyrealsense2 as rs
+
+
+class BagCapture:
+    # cv2.VideoCapture-like reader of the color stream of a .bag, every frame in order.
+    # After read(), depth holds the z16 frame aligned to the color image.
+    def __init__(self, path):
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        config.enable_device_from_file(path, repeat_playback=False)
+        profile = self.pipeline.start(config)
+        profile.get_device().as_playback().set_real_time(False)
+        self.align = rs.align(rs.stream.color)
+        self.depth = None
+        self.depth_units = profile.get_device().first_depth_sensor().get_depth_scale()
+
+    def read(self):
+        while True:
+            ret, frames = self.pipeline.try_wait_for_frames(5000)
+            if not ret:
+                # end of the recording
+                return False, None
+            frames = self.align.process(frames)
+            depth_frame = frames.get_depth_frame()
+            color_frame = frames.get_color_frame()
+            if depth_frame and color_frame:
+                break
+        # copies, the frames go back to librealsense
+        self.depth = np.asanyarray(depth_frame.get_data()).copy()
+        return True, np.asanyarray(color_frame.get_data()).copy()
+
+    def release(self):
+        self.pipeline.stop()
@@ -0,0 +1,70 @@
+"""
+MOG2 on the color stream against DepthBackgroundSubtractor on the
+aligned depth stream of the same .bag recording, in ms per frame, and
+how much their foreground masks agree.
+"""
+
+
+import time
+import argparse
+import cv2
+import numpy as np
+from bag_capture import BagCapture
+from depth_background import DepthBackgroundSubtractor
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default='record.bag', type=str, help="Bag file with color and depth")
+    parser.add_argument(
+        '--frames', default=300, type=int, help="At most this many frames")
+    parser.add_argument(
+        '--statistic', default='median', type=str, choices=['median', 'min'])
+    return parser
+
+
+def main(args):
+    # decoded once, only the background models are timed
+    cap = BagCapture(args.input)
+    colors, depths = [], []
+    while len(colors) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        colors.append(frame)
+        depths.append(cap.depth)
+    cap.release()
+    height, width = depths[0].shape
+    print("{} frames {}x{}".format(len(colors), width, height))
+
+    mog2 = cv2.createBackgroundSubtractorMOG2(history=100, varThreshold=40)
+    depth_subtractor = DepthBackgroundSubtractor(statistic=args.statistic, depth_units=cap.depth_units)
+    mog2_time = depth_time = 0.0
+    agreement = []
+    for i, (color, depth) in enumerate(zip(colors, depths)):
+        start = time.perf_counter()
+        mog2_mask = mog2.apply(color)
+        mog2_time += time.perf_counter() - start
+        start = time.perf_counter()
+        depth_mask = depth_subtractor.apply(depth)
+        depth_time += time.perf_counter() - start
+        if i >= depth_subtractor.warmup:
+            # as main.py, MOG2 shadows (127) are not foreground
+            mog2_foreground = mog2_mask == 255
+            depth_foreground = depth_mask == 255
+            union = np.count_nonzero(mog2_foreground | depth_foreground)
+            if union:
+                agreement.append(np.count_nonzero(mog2_foreground & depth_foreground) / union)
+
+    print("MOG2   {:7.2f} ms/frame".format(1000 * mog2_time / len(colors)))
+    print("depth  {:7.2f} ms/frame".format(1000 * depth_time / len(colors)))
+    if agreement:
+        print("foreground intersection over union {:.2f}".format(np.mean(agreement)))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,93 @@
+"""
+EuclideanDistTracker against KalmanTracker on synthetic scenes with
+hundreds of objects moving at constant speed, with noisy and missed
+detections and a depth image. Reports the time per frame and the ID
+switches (a detected object getting another id than the last time).
+"""
+
+
+import io
+import time
+import argparse
+import contextlib
+import numpy as np
+from tracker import EuclideanDistTracker
+from kalman_tracker import KalmanTracker
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--objects', default=[10, 100, 300, 500], type=int, nargs='+', help="Concurrent objects of each scene")
+    parser.add_argument(
+        '--frames', default=100, type=int)
+    parser.add_argument(
+        '--max_speed', default=15.0, type=float, help="Pixels per frame")
+    parser.add_argument(
+        '--noise', default=2.0, type=float, help="Detection noise in pixels")
+    parser.add_argument(
+        '--miss_rate', default=0.05, type=float, help="Probability of an object not being detected")
+    return parser
+
+
+def make_scene(count, args, width=4000, height=4000, seed=0):
+    # frames of (boxes, object numbers, depth image), objects keep bouncing within the image
+    rng = np.random.RandomState(seed)
+    position = rng.uniform(100, [width - 100, height - 100], (count, 2))
+    velocity = rng.uniform(-args.max_speed, args.max_speed, (count, 2))
+    depth = rng.uniform(2500, 5000, count)
+    depth_velocity = rng.uniform(-20, 20, count)
+    size = rng.uniform(20, 40, (count, 2))
+    frames = []
+    for i in range(args.frames):
+        position += velocity
+        depth += depth_velocity
+        bounce = (position < 50) | (position > [width - 50, height - 50])
+        velocity[bounce] *= -1
+        seen = np.flatnonzero(rng.rand(count) >= args.miss_rate)
+        centers = position[seen] + rng.normal(0, args.noise, (len(seen), 2))
+        boxes = np.column_stack([centers - size[seen] / 2, size[seen]]).astype(int)
+        depth_image = np.zeros((height, width), np.uint16)
+        for (x, y, w, h), z in zip(boxes, depth[seen]):
+            depth_image[max(y, 0):y + h, max(x, 0):x + w] = z
+        frames.append((boxes.tolist(), seen, depth_image))
+    return frames
+
+
+def run(tracker, frames, use_depth):
+    last_id = {}
+    switches = 0
+    elapsed = 0.0
+    for boxes, objects, depth_image in frames:
+        start = time.perf_counter()
+        # EuclideanDistTracker prints its state at every match
+        with contextlib.redirect_stdout(io.StringIO()):
+            if use_depth:
+                boxes_ids = tracker.update(boxes, depth_image)
+            else:
+                boxes_ids = tracker.update(boxes)
+        elapsed += time.perf_counter() - start
+        for number, box_id in zip(objects, boxes_ids):
+            if number in last_id and last_id[number] != box_id[4]:
+                switches += 1
+            last_id[number] = box_id[4]
+    return elapsed / len(frames), switches
+
+
+def main(args):
+    for count in args.objects:
+        frames = make_scene(count, args)
+        detections = sum(len(boxes) for boxes, _, _ in frames)
+        for name, tracker, use_depth in [("euclidean", EuclideanDistTracker(), False),
+                                         ("kalman 2D", KalmanTracker(), False),
+                                         ("kalman 3D", KalmanTracker(), True)]:
+            frame_time, switches = run(tracker, frames, use_depth)
+            print("{:4d} objects  {:<10} {:8.2f} ms/frame  {:6d} id switches ({:.2%} of the detections)".format(
+                count, name, 1000 * frame_time, switches, switches / detections))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
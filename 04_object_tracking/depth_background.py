@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class DepthBackgroundSubtractor:
+    # Drop-in for cv2.createBackgroundSubtractorMOG2 on z16 depth frames: apply(depth_image)
+    # returns a uint8 mask, 255 on the foreground and 0 elsewhere.
+    #
+    # The background depth of each pixel is learnt over the first warmup frames (median or
+    # minimum of its valid depths), then follows slow changes of the scene: each background
+    # pixel moves its background depth one step towards its current depth (a running median).
+    # A pixel is foreground when it is closer than its background by more than threshold mm,
+    # or by relative times its background depth if that is more, as the noise of the
+    # stereo depth grows with the distance. Shadows and lighting changes do not change the depth.
+    def __init__(self, warmup=30, threshold=100, relative=0.03, statistic="median", step=1, depth_units=0.001):
+        if statistic not in ("median", "min"):
+            raise ValueError("statistic is 'median' or 'min'")
+        self.warmup = warmup
+        self.threshold = threshold / (depth_units * 1000)
+        self.relative = relative
+        self.statistic = statistic
+        self.step = step
+        self.frames = 0
+        self.shape = None
+
+    def _allocate(self, shape):
+        # every buffer is allocated once, from the size of the first frame
+        self.shape = shape
+        self.history = np.zeros((self.warmup,) + shape, np.uint16)
+        self.background = np.zeros(shape, np.uint16)
+        self.limit = np.zeros(shape, np.int32)
+        self.difference = np.zeros(shape, np.int32)
+        self.foreground = np.zeros(shape, bool)
+        self.update = np.zeros(shape, bool)
+        self.mask = np.zeros(shape, np.uint8)
+
+    def apply(self, depth_image):
+        if self.shape != depth_image.shape:
+            self._allocate(depth_image.shape)
+            self.frames = 0
+        if self.frames < self.warmup:
+            # learning, nothing is foreground yet
+            self.history[self.frames] = depth_image
+            self.frames += 1
+            if self.frames == self.warmup:
+                self._learn()
+            self.mask[:] = 0
+            return self.mask
+
+        background = self.background
+        # background - depth, positive when the pixel is closer than its background
+        np.subtract(background, depth_image, out=self.difference, dtype=np.int32)
+        np.multiply(background, self.relative, out=self.limit, casting='unsafe')
+        np.maximum(self.limit, self.threshold, out=self.limit, casting='unsafe')
+        np.greater(self.difference, self.limit, out=self.foreground)
+        # no depth: not foreground (no background known yet gives a negative difference)
+        np.greater(depth_image, 0, out=self.update)
+        self.foreground &= self.update
+        np.multiply(self.foreground, 255, out=self.mask, casting='unsafe')
+
+        # running update of the valid background pixels, towards their depth by at most step
+        # (median) or down to their depth when closer (minimum), in the preallocated buffers
+        self.update &= ~self.foreground
+        if self.statistic == "median":
+            np.clip(self.difference, -self.step, self.step, out=self.difference)
+        else:
+            np.maximum(self.difference, 0, out=self.difference)
+        np.multiply(self.difference, self.update, out=self.difference)
+        np.subtract(background, self.difference, out=self.limit)
+        np.copyto(background, self.limit, casting='unsafe')
+        # pixels without a background take their first valid depth
+        np.copyto(background, depth_image, where=background == 0)
+        self.frames += 1
+        return self.mask
+
+    def _learn(self):
+        # per pixel median (or minimum) of the valid depths of the warm-up frames
+        history = self.history
+        valid = np.count_nonzero(history, axis=0)
+        # invalid (zero) depths sorted last
+        history[history == 0] = np.iinfo(np.uint16).max
+        history.sort(axis=0)
+        if self.statistic == "median":
+            index = np.maximum(valid - 1, 0) // 2
+        else:
+            index = np.zeros_like(valid)
+        background = np.take_along_axis(history, index[None], axis=0)[0]
+        self.background[:] = np.where(valid > 0, background, 0)
+
+    def getBackgroundImage(self):
+        # same name as the OpenCV subtractors
+        return self.background
@@ -0,0 +1,155 @@
+import numpy as np
+
+
+# State of a track: center x, center y (pixels), depth z (depth units, mm
+# for the D400 cameras) and their velocities per frame, constant velocity model
+F = np.eye(6)
+F[[0, 1, 2], [3, 4, 5]] = 1
+# Covariance of a random acceleration of 1 over a frame, per axis pair (position, velocity)
+ACCELERATION = np.array([[0.25, 0.5], [0.5, 1.0]])
+# Variance given to an unknown depth
+UNKNOWN = 1e12
+
+
+class KalmanTracker:
+    # Same update(objects_rect) as EuclideanDistTracker, with a Kalman filter per track.
+    # All tracks are kept in arrays (struct of arrays) and predicted, associated and
+    # updated together with batched matrix operations.
+    def __init__(self, max_misses=5, gate=9.21, depth_gate=9.0, position_noise=4.0, depth_noise=30.0,
+                 acceleration=2.0, depth_acceleration=50.0):
+        # gates are on squared Mahalanobis distances: gate on the image position (9.21 is the 99%
+        # of a chi-square with 2 degrees of freedom), depth_gate on the depth alone
+        self.max_misses = max_misses
+        self.gate = gate
+        self.depth_gate = depth_gate
+        self.R = np.diag([position_noise ** 2, position_noise ** 2, depth_noise ** 2])
+        self.Q = np.zeros((6, 6))
+        for axis, sigma in enumerate([acceleration, acceleration, depth_acceleration]):
+            self.Q[np.ix_([axis, axis + 3], [axis, axis + 3])] = ACCELERATION * sigma ** 2
+        # one row per track
+        self.x = np.zeros((0, 6))
+        self.P = np.zeros((0, 6, 6))
+        self.ids = np.zeros(0, np.int64)
+        self.misses = np.zeros(0, np.int64)
+        self.id_count = 0
+
+    def update(self, objects_rect, depth_image=None):
+        # objects_rect are x, y, w, h boxes, depth_image the z16 frame aligned to the image
+        # they were detected in. Returns the boxes with their ids, as x, y, w, h, id.
+        rects = np.asarray(objects_rect, np.float64).reshape(-1, 4)
+        centers = rects[:, :2] + rects[:, 2:] / 2
+        depths = box_depths(rects, depth_image)
+
+        self.predict()
+        track_index, object_index = self.associate(centers, depths)
+        self.correct(track_index, centers[object_index], depths[object_index])
+
+        # tracks not seen for too long are dropped
+        missed = np.ones(len(self.ids), bool)
+        missed[track_index] = False
+        self.misses[missed] += 1
+        self.misses[track_index] = 0
+        object_ids = np.full(len(rects), -1, np.int64)
+        object_ids[object_index] = self.ids[track_index]
+        keep = self.misses <= self.max_misses
+        self.x, self.P, self.ids, self.misses = self.x[keep], self.P[keep], self.ids[keep], self.misses[keep]
+
+        # new tracks for the objects no track was close to
+        new = np.flatnonzero(object_ids < 0)
+        object_ids[new] = self.start(centers[new], depths[new])
+
+        return [[int(x), int(y), int(w), int(h), int(object_id)]
+                for (x, y, w, h), object_id in zip(np.asarray(objects_rect).reshape(-1, 4), object_ids)]
+
+    def predict(self):
+        self.x = self.x @ F.T
+        self.P = F @ self.P @ F.T + self.Q
+
+    def associate(self, centers, depths):
+        # Pairs (track, object) within the gate, greedily by Mahalanobis distance
+        if len(self.ids) == 0 or len(centers) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        # image distance with the 2x2 innovation covariance of each track
+        difference = centers[None, :, :] - self.x[:, None, :2]
+        inverse = np.linalg.inv(self.P[:, :2, :2] + self.R[:2, :2])
+        cost = np.einsum('toi,tij,toj->to', difference, inverse, difference)
+        outside = cost > self.gate
+        # plus the depth difference, where the object has a depth. It ranks the candidates
+        # but is capped: an occluded object measures the depth of what is in front of it
+        depth_difference = depths[None, :] - self.x[:, None, 2]
+        depth_cost = depth_difference ** 2 / (self.P[:, 2, 2] + self.R[2, 2])[:, None]
+        cost += np.minimum(np.where(np.isnan(depth_cost), 0.0, depth_cost), self.depth_gate)
+        cost[outside] = np.inf
+
+        # pairs that are each other's best match, then again without them
+        track_index, object_index = [], []
+        tracks = np.arange(len(self.ids))
+        while True:
+            best_object = np.argmin(cost, axis=1)
+            best_track = np.argmin(cost, axis=0)
+            mutual = (best_track[best_object] == tracks) & np.isfinite(cost[tracks, best_object])
+            if not mutual.any():
+                break
+            track_index.append(tracks[mutual])
+            object_index.append(best_object[mutual])
+            cost[tracks[mutual], :] = np.inf
+            cost[:, best_object[mutual]] = np.inf
+        if not track_index:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return np.concatenate(track_index), np.concatenate(object_index)
+
+    def correct(self, track_index, centers, depths):
+        if len(track_index) == 0:
+            return
+        x, P = self.x[track_index], self.P[track_index]
+        # an unknown depth, or one too far from the prediction, is measured as the
+        # predicted one with an infinite variance
+        with np.errstate(invalid='ignore'):
+            unknown = ~((depths - x[:, 2]) ** 2 <= self.depth_gate * (P[:, 2, 2] + self.R[2, 2]))
+        z = np.column_stack([centers, np.where(unknown, x[:, 2], depths)])
+        R = np.repeat(self.R[None], len(track_index), axis=0)
+        R[unknown, 2, 2] = UNKNOWN
+        # the measurement is the first three components of the state
+        S = P[:, :3, :3] + R
+        K = P[:, :, :3] @ np.linalg.inv(S)
+        self.x[track_index] = x + (K @ (z - x[:, :3])[:, :, None])[:, :, 0]
+        self.P[track_index] = P - K @ P[:, :3, :]
+
+    def start(self, centers, depths):
+        count = len(centers)
+        ids = np.arange(self.id_count, self.id_count + count)
+        self.id_count += count
+        unknown = np.isnan(depths)
+        x = np.zeros((count, 6))
+        x[:, :2] = centers
+        x[:, 2] = np.where(unknown, 0.0, depths)
+        # the velocity is unknown until the second detection
+        P = np.repeat(np.diag([self.R[0, 0], self.R[1, 1], self.R[2, 2], 100.0, 100.0, 1e4])[None], count, axis=0)
+        P[unknown, 2, 2] = UNKNOWN
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, P])
+        self.ids = np.concatenate([self.ids, ids])
+        self.misses = np.concatenate([self.misses, np.zeros(count, np.int64)])
+        return ids
+
+    def tracks(self):
+        # ids and states (cx, cy, z, vx, vy, vz) of the current tracks
+        return self.ids.copy(), self.x.copy()
+
+
+def box_depths(rects, depth_image, samples=5):
+    # Median of the valid depth on a grid of samples x samples points in the middle half
+    # of each box, NaN when there is no depth image or no valid depth in the box
+    if depth_image is None or len(rects) == 0:
+        return np.full(len(rects), np.nan)
+    height, width = depth_image.shape
+    fractions = np.linspace(0.25, 0.75, samples)
+    xs = np.clip((rects[:, 0:1] + rects[:, 2:3] * fractions).astype(np.int64), 0, width - 1)
+    ys = np.clip((rects[:, 1:2] + rects[:, 3:4] * fractions).astype(np.int64), 0, height - 1)
+    values = depth_image[ys[:, :, None], xs[:, None, :]].reshape(len(rects), -1).astype(np.float64)
+    valid = np.count_nonzero(values, axis=1)
+    # invalid (zero) depths sorted last, the median is taken among the valid ones
+    values[values == 0] = np.inf
+    values.sort(axis=1)
+    median = values[np.arange(len(rects)), np.maximum(valid - 1, 0) // 2]
+    return np.where(valid > 0, median, np.nan)
@@ -1,31 +1,93 @@
 import cv2
+import time
+import argparse
 from tracker import EuclideanDistTracker
-
+from kalman_tracker import KalmanTracker
+from depth_background import DepthBackgroundSubtractor
+from preview import Preview
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--input', '-i', default='highway.mp4', type=str, help="Video, or .bag recording with depth")
+parser.add_argument(
+    '--roi', default=[500, 450, 320, 270], type=int, nargs=4, help="Region of interest x, y, w, h")
+parser.add_argument(
+    '--background', default='mog2', type=str, choices=['mog2', 'depth'], help="Color (MOG2) or depth background model, depth needs a .bag")
+parser.add_argument(
+    '--tracker', default='euclidean', type=str, choices=['euclidean', 'kalman'], help="Nearest center or Kalman filter tracks")
+parser.add_argument(
+    '--preview_fps', default=30, type=float, help="Rate of the preview windows")
+parser.add_argument(
+    '--preview_scale', default=0.5, type=float, help="Size of the preview of the whole frame")
+parser.add_argument(
+    '--no_preview', action='store_true', help="Track without any preview window")
+parser.add_argument(
+    '--prefetch', default=0, type=int, help="Decode this many frames ahead on a background thread, 0 to decode in the loop")
+parser.add_argument(
+    '--benchmark', action='store_true', help="No preview and no printing, report the decode and processing time per frame")
+args = parser.parse_args()
+if args.background == 'depth' and not args.input.endswith('.bag'):
+    parser.error("--background depth needs a .bag input")
 
 # Create capture object
-cap = cv2.VideoCapture("highway.mp4")
+if args.input.endswith('.bag'):
+    from bag_capture import BagCapture
+    cap = BagCapture(args.input)
+else:
+    cap = cv2.VideoCapture(args.input)
+roi_x, roi_y, roi_w, roi_h = args.roi
+if args.prefetch > 0:
+    from prefetch_capture import PrefetchCapture
+    # the full frame is only needed for its preview
+    cap = PrefetchCapture(cap, args.roi if args.benchmark else None, args.prefetch)
+cropped = args.prefetch > 0 and args.benchmark
 
 # Create tracker object
-tracker = EuclideanDistTracker()
+if args.tracker == 'kalman':
+    tracker = KalmanTracker()
+else:
+    tracker = EuclideanDistTracker()
 
 # Object detection from Stable camera
-object_detector = cv2.createBackgroundSubtractorMOG2(history=100, varThreshold=40)
+if args.background == 'depth':
+    # closer than the learnt background depth, blind to shadows and lighting
+    object_detector = DepthBackgroundSubtractor(depth_units=cap.depth_units)
+else:
+    object_detector = cv2.createBackgroundSubtractorMOG2(history=100, varThreshold=40)
+
+# Preview windows on their own thread, tracking runs as fast as the video decodes
+preview = Preview(args.preview_fps, args.preview_scale, enabled=not (args.no_preview or args.benchmark))
 
+# time per frame spent in cap.read() (decoding, or waiting for the prefetch) and after it
+frame_count = 0
+read_time = 0.0
+process_time = 0.0
+start_time = time.perf_counter()
 
 while True:
+    read_start = time.perf_counter()
     ret, frame = cap.read()
+    process_start = time.perf_counter()
+    read_time += process_start - read_start
 
     if frame is None:
         print("Video is finished")
         break
 
-    height, width, _ = frame.shape
-
-    # Extract Region of interest
-    roi = frame[450: 720, 500: 820]
+    # Extract Region of interest, the prefetch may deliver it cropped already
+    if cropped:
+        roi = frame
+        depth_roi = cap.depth
+    else:
+        roi = frame[roi_y: roi_y + roi_h, roi_x: roi_x + roi_w]
+        depth_roi = cap.depth[roi_y: roi_y + roi_h, roi_x: roi_x + roi_w] if args.input.endswith('.bag') else None
 
     # 1. Object Detection
-    mask = object_detector.apply(roi)
+    if args.background == 'depth':
+        mask = object_detector.apply(depth_roi)
+    else:
+        mask = object_detector.apply(roi)
     _, mask = cv2.threshold(mask, 254, 255, cv2.THRESH_BINARY)
     contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
@@ -41,23 +103,44 @@ while True:
             detections.append([x, y, w, h])
 
     # 2. Object Tracking
-    boxes_ids = tracker.update(detections)
+    if args.tracker == 'kalman' and args.input.endswith('.bag'):
+        boxes_ids = tracker.update(detections, depth_roi)
+    else:
+        boxes_ids = tracker.update(detections)
     for box_id in boxes_ids:
         x, y, w, h, id = box_id
         cv2.putText(roi, str(id), (x, y - 15), cv2.FONT_HERSHEY_PLAIN, 2, (255, 0, 0), 2)
         cv2.rectangle(roi, (x, y), (x + w, y + h), (0, 255, 0), 3)
 
+    frame_count += 1
+    if args.benchmark:
+        process_time += time.perf_counter() - process_start
+        continue
+
     print(boxes_ids)
-    cv2.imshow("Frame", frame)
-    cv2.imshow("ROI", roi)
-    cv2.imshow("Mask", mask)
+    preview.show("Frame", frame)
+    # the ROI is small already
+    preview.show("ROI", roi, scale=1.0)
+    preview.show("Mask", mask, scale=1.0)
+    process_time += time.perf_counter() - process_start
 
-    key = cv2.waitKey(30)
+    key = preview.key()
     if key == 27:
         break
 
+elapsed = time.perf_counter() - start_time
 cap.release()
-cv2.destroyAllWindows()
+preview.close()
+
+if frame_count:
+    print("{} frames in {:.1f} s, {:.1f} frames/s".format(frame_count, elapsed, frame_count / elapsed))
+    if args.prefetch > 0:
+        print("decode {:.2f} ms/frame on the prefetch thread, waiting {:.2f} ms/frame, processing {:.2f} ms/frame".format(
+            cap.decode_time * 1000 / max(cap.decoded, 1), read_time * 1000 / frame_count,
+            process_time * 1000 / frame_count))
+    else:
+        print("decode {:.2f} ms/frame, processing {:.2f} ms/frame".format(
+            read_time * 1000 / frame_count, process_time * 1000 / frame_count))
 
 print("Done.")
 
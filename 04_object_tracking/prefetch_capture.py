@@ -0,0 +1,105 @@
+"""
+Prefetching capture: frames are decoded on a background thread while
+the main thread processes the previous ones.
+
+The decoded frames go to a bounded ring of preallocated buffers, the
+decoder waits when all of them are in use and no frame is ever
+allocated in the loop. With roi set only the crop is kept (and the
+crop of the depth of a BagCapture), the buffers and copies are then
+a fraction of the frame.
+"""
+
+
+import time
+import queue
+import threading
+import cv2
+import numpy as np
+
+
+class PrefetchCapture:
+    # Wraps a cv2.VideoCapture (or a BagCapture) with the same read()/release(). A frame
+    # returned by read() stays valid until the next read(), its buffer is reused after.
+    def __init__(self, capture, roi=None, queue_size=4):
+        self.capture = capture
+        self.roi = roi
+        self.queue_size = queue_size
+        self.depth = None
+        self.depth_units = getattr(capture, "depth_units", None)
+        self.frames = None
+        self.depths = None
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        self.current = None
+        # seconds spent decoding (background) and waiting for a frame (caller)
+        self.decode_time = 0.0
+        self.wait_time = 0.0
+        self.decoded = 0
+        # cv2.VideoCapture decodes into the frame it is given
+        self.reuse = isinstance(capture, cv2.VideoCapture)
+        self.running = True
+        self.thread = threading.Thread(target=self._decode, name="prefetch", daemon=True)
+        self.thread.start()
+
+    def _crop(self, image):
+        if self.roi is None:
+            return image
+        x, y, w, h = self.roi
+        return image[y:y + h, x:x + w]
+
+    def _allocate(self, frame):
+        # the ring is sized on the first frame, one more buffer than the queue for the caller
+        depth = getattr(self.capture, "depth", None)
+        crop = self._crop(frame)
+        self.frames = [np.empty_like(crop) for _ in range(self.queue_size + 1)]
+        if depth is not None:
+            self.depths = [np.empty_like(self._crop(depth)) for _ in range(self.queue_size + 1)]
+        for index in range(self.queue_size + 1):
+            self.free.put(index)
+
+    def _decode(self):
+        frame = None
+        try:
+            while self.running:
+                start = time.perf_counter()
+                # the decoder writes into the same full frame every time when it can
+                ret, frame = self.capture.read(frame) if self.reuse and frame is not None else self.capture.read()
+                self.decode_time += time.perf_counter() - start
+                if not ret or frame is None:
+                    break
+                if self.frames is None:
+                    self._allocate(frame)
+                index = self.free.get()
+                if index is None:
+                    break
+                np.copyto(self.frames[index], self._crop(frame))
+                if self.depths is not None:
+                    np.copyto(self.depths[index], self._crop(self.capture.depth))
+                self.decoded += 1
+                self.filled.put(index)
+        finally:
+            # end of the video
+            self.filled.put(None)
+
+    def read(self):
+        if self.current is not None:
+            self.free.put(self.current)
+            self.current = None
+        start = time.perf_counter()
+        index = self.filled.get()
+        self.wait_time += time.perf_counter() - start
+        if index is None:
+            # stays at the end
+            self.filled.put(None)
+            return False, None
+        self.current = index
+        if self.depths is not None:
+            self.depth = self.depths[index]
+        return True, self.frames[index]
+
+    def release(self):
+        self.running = False
+        # unblock the decoder if it waits for a buffer
+        self.free.put(None)
+        self.thread.join()
+        self.capture.release()
@@ -0,0 +1,98 @@
+"""
+Preview windows on their own thread, so that capturing and encoding
+never wait for the GUI.
+
+The capture loop hands its images to show(), which returns at once:
+images that come faster than the preview rate are dropped, the others
+are downscaled and replace whatever the thread has not shown yet. The
+thread draws the newest image of each window at the preview rate and
+polls the keyboard, the keys are read back with key().
+
+With enabled=False nothing is shown, no window is created and show()
+does no work at all.
+
+All the cv2 GUI calls happen on the preview thread. This works with
+the GTK and Qt backends of OpenCV, not on macOS, where windows must
+belong to the main thread.
+"""
+
+
+import cv2
+import time
+import threading
+import collections
+
+
+class Preview:
+    def __init__(self, fps=15, scale=0.5, enabled=True):
+        self.enabled = enabled
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.scale = scale
+        self.pending = {}
+        self.keys = collections.deque(maxlen=16)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.last_accepted = {}
+        self.shown = 0
+        self.dropped = 0
+        self.thread = None
+        if enabled:
+            self.thread = threading.Thread(target=self._run, name="preview", daemon=True)
+            self.thread.start()
+
+    def show(self, name, image, scale=None):
+        # Non-blocking: keep a downscaled copy of the image for the window if it is due,
+        # scale overrides the preview scale for this window
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if now - self.last_accepted.get(name, -1e9) < self.period:
+            self.dropped += 1
+            return
+        self.last_accepted[name] = now
+        scale = self.scale if scale is None else scale
+        if scale != 1.0:
+            # resize makes a new image, the caller may reuse its buffer right away
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            image = image.copy()
+        with self.lock:
+            if name in self.pending:
+                # never shown, replaced by the newer one
+                self.dropped += 1
+            self.pending[name] = image
+        self.wake.set()
+
+    def key(self):
+        # Oldest key pressed in a preview window since the last call, -1 if none
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            return -1
+
+    def _run(self):
+        windows = set()
+        while not self.stopped.is_set():
+            # wake up for new images, or at least now and then to keep the windows responsive
+            self.wake.wait(0.1)
+            self.wake.clear()
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            for name, image in pending.items():
+                cv2.imshow(name, image)
+                windows.add(name)
+                self.shown += 1
+            if windows:
+                key = cv2.waitKey(1)
+                if key != -1:
+                    self.keys.append(key & 0xFF)
+        if windows:
+            cv2.destroyAllWindows()
+
+    def close(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,248 @@
+"""
+Bytes per second, CPU usage and dropped frames of the recording
+options on the same frames: a .bag written by librealsense with and
+without compression (rs.recorder on a software device, as
+--format bag does through the pipeline), the two .mp4 of save_video.py
+(color and colorized depth), raw z16 depth (.rvl, lossless) with the
+color .mp4, and raw dumps of both streams.
+
+The frames of a .bag, or synthetic ones, are loaded first and then
+played at the frame rate: a frame is dropped when the recording falls
+more than --queue frames behind the camera.
+"""
+
+
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+import pyrealsense2 as rs
+from rvl_codec import BackgroundRvlWriter
+
+
+OPTIONS = ["bag", "bag_uncompressed", "mp4", "rvl", "raw"]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default=None, type=str, help="Bag file with depth and color, synthetic frames when not given")
+    parser.add_argument(
+        '--frames', default=150, type=int, help="At most this many frames")
+    parser.add_argument(
+        '--width', default=1280, type=int, help="Width of the synthetic frames")
+    parser.add_argument(
+        '--height', default=720, type=int, help="Height of the synthetic frames")
+    parser.add_argument(
+        '--FPS', '-fps', default=30, type=int, help="Rate at which the frames are played")
+    parser.add_argument(
+        '--queue', default=1, type=int, help="Frames the camera keeps while the recording is busy")
+    parser.add_argument(
+        '--options', default=OPTIONS, type=str, nargs='+', choices=OPTIONS)
+    parser.add_argument(
+        '--folder', default='bench_recording', type=str, help="Where the recordings are written")
+    return parser
+
+
+def bag_frames(path, count):
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(path, repeat_playback=False)
+    profile = pipeline.start(config)
+    profile.get_device().as_playback().set_real_time(False)
+    align = rs.align(rs.stream.color)
+    frames = []
+    while len(frames) < count:
+        ret, frameset = pipeline.try_wait_for_frames(1000)
+        if not ret:
+            break
+        frameset = align.process(frameset)
+        depth_frame, color_frame = frameset.get_depth_frame(), frameset.get_color_frame()
+        if depth_frame and color_frame:
+            frames.append((np.asanyarray(depth_frame.get_data()).copy(), np.asanyarray(color_frame.get_data()).copy()))
+    pipeline.stop()
+    return frames
+
+
+def synthetic_frames(width, height, count):
+    # a slanted wall with a box moving in front of it, noisy depth with holes, textured color
+    rng = np.random.RandomState(0)
+    u = np.arange(width, dtype=np.float32)
+    wall = np.broadcast_to(1500 + 1500 * u / width, (height, width))
+    texture = rng.randint(0, 40, (height, width, 3)).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        x = (i * 16) % (width - width // 4)
+        z = wall.copy()
+        z[height // 3:2 * height // 3, x:x + width // 4] = 900
+        z += rng.normal(0, 1, z.shape).astype(np.float32) * (z / 1000) ** 2 * 2
+        depth = z.astype(np.uint16)
+        depth[rng.random_sample(z.shape) < 0.02] = 0
+        color = cv2.applyColorMap(cv2.convertScaleAbs(depth, alpha=0.08), cv2.COLORMAP_BONE) + texture
+        frames.append((depth, color))
+    return frames
+
+
+def colorize(depth):
+    return cv2.applyColorMap(cv2.convertScaleAbs(depth, alpha=0.03), cv2.COLORMAP_JET)
+
+
+class BagSink:
+    # the frames go through an rs.software_device into an rs.recorder
+    def __init__(self, path, width, height, fps, compression):
+        self.paths = [path]
+        self.device = rs.software_device()
+        self.sensors = []
+        for uid, (stream, fmt, bpp) in enumerate([(rs.stream.depth, rs.format.z16, 2),
+                                                 (rs.stream.color, rs.format.bgr8, 3)]):
+            sensor = self.device.add_sensor("Stereo Module" if stream == rs.stream.depth else "RGB Camera")
+            intrinsics = rs.intrinsics()
+            intrinsics.width, intrinsics.height = width, height
+            intrinsics.fx = intrinsics.fy = width / 2 / np.tan(np.radians(87) / 2)
+            intrinsics.ppx, intrinsics.ppy = width / 2, height / 2
+            video = rs.video_stream()
+            video.type, video.fmt, video.bpp = stream, fmt, bpp
+            video.index, video.uid = 0, uid
+            video.width, video.height, video.fps = width, height, fps
+            video.intrinsics = intrinsics
+            profile = sensor.add_video_stream(video)
+            if stream == rs.stream.depth:
+                sensor.add_read_only_option(rs.option.depth_units, 0.001)
+            self.sensors.append((sensor, profile, bpp))
+        self.recorder = rs.recorder(path, self.device, compression)
+        for sensor, profile, bpp in self.sensors:
+            sensor.open(profile)
+            sensor.start(lambda frame: None)
+        self.fps = fps
+
+    def write(self, index, depth, color):
+        for (sensor, profile, bpp), image in zip(self.sensors, (depth, color)):
+            frame = rs.software_video_frame()
+            frame.pixels = image
+            frame.bpp = bpp
+            frame.stride = image.shape[1] * bpp
+            frame.timestamp = index * 1000.0 / self.fps
+            frame.domain = rs.timestamp_domain.hardware_clock
+            frame.frame_number = index
+            frame.profile = profile.as_video_stream_profile()
+            sensor.on_video_frame(frame)
+
+    def close(self):
+        for sensor, profile, bpp in self.sensors:
+            sensor.stop()
+            sensor.close()
+        # the bag is complete when the recorder is gone
+        del self.recorder
+
+
+class VideoSink:
+    # save_video.py: color and colorized depth in two .mp4
+    def __init__(self, path, width, height, fps):
+        self.paths = [path + '_rgb.mp4', path + '_depth.mp4']
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.writers = [cv2.VideoWriter(p, fourcc, fps, (width, height), 1) for p in self.paths]
+
+    def write(self, index, depth, color):
+        self.writers[0].write(color)
+        self.writers[1].write(colorize(depth))
+
+    def close(self):
+        for writer in self.writers:
+            writer.release()
+
+
+class RvlSink:
+    # --depth_rvl without the depth video: lossless depth and the color .mp4
+    def __init__(self, path, width, height, fps):
+        self.paths = [path + '_rgb.mp4', path + '_depth.rvl']
+        self.video = cv2.VideoWriter(self.paths[0], cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height), 1)
+        self.rvl = BackgroundRvlWriter(self.paths[1], width, height)
+        self.fps = fps
+
+    def write(self, index, depth, color):
+        self.video.write(color)
+        self.rvl.write(depth, index * 1000.0 / self.fps)
+
+    def close(self):
+        self.video.release()
+        self.rvl.close()
+
+
+class RawSink:
+    def __init__(self, path, width, height, fps):
+        self.paths = [path + '_depth.raw', path + '_rgb.raw']
+        self.files = [open(p, 'wb') for p in self.paths]
+
+    def write(self, index, depth, color):
+        depth.tofile(self.files[0])
+        color.tofile(self.files[1])
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+def make_sink(option, path, width, height, fps):
+    if option == "bag":
+        return BagSink(path + '.bag', width, height, fps, True)
+    if option == "bag_uncompressed":
+        return BagSink(path + '.bag', width, height, fps, False)
+    if option == "mp4":
+        return VideoSink(path, width, height, fps)
+    if option == "rvl":
+        return RvlSink(path, width, height, fps)
+    return RawSink(path, width, height, fps)
+
+
+def record(sink, frames, fps, queue):
+    # plays the frames at fps, returns the recorded and the dropped frames, the wall and CPU time
+    interval = 1.0 / fps
+    recorded = dropped = 0
+    next_frame = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    while next_frame < len(frames):
+        arrival = start + next_frame * interval
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        depth, color = frames[next_frame]
+        sink.write(next_frame, depth, color)
+        recorded += 1
+        next_frame += 1
+        # frames the camera delivered meanwhile, it keeps only the last queue of them
+        arrived = min(int((time.perf_counter() - start) / interval) + 1, len(frames))
+        if arrived - next_frame > queue:
+            dropped += arrived - next_frame - queue
+            next_frame = arrived - queue
+    sink.close()
+    return recorded, dropped, time.perf_counter() - start, time.process_time() - cpu_start
+
+
+def main(args):
+    frames = bag_frames(args.input, args.frames) if args.input else \
+        synthetic_frames(args.width, args.height, args.frames)
+    height, width = frames[0][0].shape
+    duration = len(frames) / float(args.FPS)
+    raw_rate = sum(depth.nbytes + color.nbytes for depth, color in frames) / duration
+    print("{} frames {}x{} at {} fps, {:.1f} MB/s of raw depth and color".format(
+        len(frames), width, height, args.FPS, raw_rate / 1e6))
+    os.makedirs(args.folder, exist_ok=True)
+
+    print("{:<17} {:>9} {:>7} {:>6} {:>8}".format("option", "MB/s", "ratio", "CPU", "dropped"))
+    for option in args.options:
+        sink = make_sink(option, os.path.join(args.folder, option), width, height, args.FPS)
+        recorded, dropped, elapsed, cpu = record(sink, frames, args.FPS, args.queue)
+        size = sum(os.path.getsize(path) for path in sink.paths)
+        # the same duration for all, the ratio is over the frames that were recorded
+        print("{:<17} {:9.2f} {:7.1f} {:5.0f}% {:8d}".format(
+            option, size / duration / 1e6, raw_rate * duration * recorded / len(frames) / max(size, 1),
+            100 * cpu / elapsed, dropped))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
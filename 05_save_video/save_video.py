@@ -2,6 +2,9 @@ import pyrealsense2 as rs
 import numpy as np
 import cv2
 import argparse
+from preview import Preview
+from rvl_codec import BackgroundRvlWriter
+from segment_writer import SegmentedRecorder
 
 
 def get_parser():
@@ -9,7 +12,10 @@ def get_parser():
     parser.add_argument(
         '--name', '-n', default='record', type=str)
     parser.add_argument(
-        '--format', '-f', default='mp4', type=str, choices=['mp4', 'avi'])
+        '--format', '-f', default='mp4', type=str, choices=['mp4', 'avi', 'bag'],
+        help="bag records the raw streams with librealsense (compressed) instead of the videos")
+    parser.add_argument(
+        '--record_bag', action='store_true', help="Also record name.bag next to the videos")
     parser.add_argument(
         '--width', default=1280, type=int, choices=[1280, 848, 640])
     parser.add_argument(
@@ -19,6 +25,20 @@ def get_parser():
     parser.add_argument(
         '--visual_preset', default="High Density", type=str, 
         choices=["Custom", "Default", "Hand", "High Accuracy", "High Density"])
+    parser.add_argument(
+        '--preview_fps', default=15, type=float, help="Rate of the preview windows")
+    parser.add_argument(
+        '--preview_scale', default=0.5, type=float, help="Size of the preview images relative to the recorded ones")
+    parser.add_argument(
+        '--no_preview', action='store_true', help="Record without any preview window")
+    parser.add_argument(
+        '--depth_rvl', action='store_true', help="Also record the raw depth, lossless, to name_depth.rvl")
+    parser.add_argument(
+        '--rvl_delta', action='store_true', help="Code the .rvl depth frames against the previous frame")
+    parser.add_argument(
+        '--segment_seconds', default=0, type=float, help="Start new files every this many seconds, 0 for one file per stream")
+    parser.add_argument(
+        '--segment_mb', default=0, type=float, help="Start new files when a segment reaches this many MB, 0 for no limit")
     return parser
 
 
@@ -29,20 +49,48 @@ def main(args):
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     elif args.format == 'avi':
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    else:
+        fourcc = None
     # set output video names
     color_path = args.name + '_rgb.' + args.format
     depth_path = args.name + '_depth.' + args.format
-    # set output video writers
-    colorwriter = cv2.VideoWriter(color_path, fourcc, args.FPS, (args.width, args.height), 1)
-    depthwriter = cv2.VideoWriter(depth_path, fourcc, args.FPS, (args.width, args.height), 1)
+    # set output video writers, the segmented recorder opens its own
+    segmented = args.segment_seconds > 0 or args.segment_mb > 0
+    if segmented and args.format == 'bag':
+        print("Segments are made of videos, use --format mp4 or avi with --record_bag")
+        exit()
+    colorwriter = depthwriter = None
+    if not segmented and args.format != 'bag':
+        colorwriter = cv2.VideoWriter(color_path, fourcc, args.FPS, (args.width, args.height), 1)
+        depthwriter = cv2.VideoWriter(depth_path, fourcc, args.FPS, (args.width, args.height), 1)
 
     # define pipeline and its config
     pipeline = rs.pipeline()
     config = rs.config()
     config.enable_stream(rs.stream.depth, args.width, args.height, rs.format.z16, args.FPS)
     config.enable_stream(rs.stream.color, args.width, args.height, rs.format.bgr8, args.FPS)
+    # librealsense writes the frames to the .bag itself, compressed on D400 cameras
+    if args.format == 'bag' or args.record_bag:
+        config.enable_record_to_file(args.name + '.bag')
 
     pipe_profile = pipeline.start(config)
+
+    # raw z16 depth, lossless, next to the colorized video (see rvl_codec.py), coded on its own thread
+    rvl_writer = None
+    rvl = None
+    if args.depth_rvl:
+        depth_units = pipe_profile.get_device().first_depth_sensor().get_option(rs.option.depth_units)
+        rvl = dict(width=args.width, height=args.height, depth_units=depth_units, delta=args.rvl_delta)
+        if not segmented:
+            rvl_writer = BackgroundRvlWriter(args.name + '_depth.rvl', **rvl)
+
+    # SEGMENTS
+    # files rotated every few seconds or MB, closed on a background thread, listed in name_manifest.json
+    recorder = None
+    if segmented:
+        recorder = SegmentedRecorder(args.name, args.format, fourcc, args.FPS, (args.width, args.height), args.segment_seconds,
+                                     args.segment_mb, rvl)
+
     depth_sensor = pipe_profile.get_device().first_depth_sensor()
 
     # set visual preset
@@ -56,6 +104,9 @@ def main(args):
     current_visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, current_preset)
     print("Visual preset", current_visual_preset)
 
+    # preview windows are drawn on their own thread, recording never waits for them
+    preview = Preview(args.preview_fps, args.preview_scale, enabled=not args.no_preview)
+
     try:
         # Streaming loop
         while True:
@@ -84,20 +135,31 @@ def main(args):
             color_image = np.asanyarray(color_frame.get_data())
 
             # Save to disk
-            colorwriter.write(color_image)
-            depthwriter.write(depth_colormap)
+            if recorder is not None:
+                recorder.write(color_image, depth_colormap, color_frame.get_timestamp(), color_frame.get_frame_number(),
+                               np.asanyarray(depth_frame.get_data()) if rvl is not None else None)
+            elif colorwriter is not None:
+                colorwriter.write(color_image)
+                depthwriter.write(depth_colormap)
+            if rvl_writer is not None:
+                rvl_writer.write(np.asanyarray(depth_frame.get_data()), depth_frame.get_timestamp())
             
             # Show to screen
-            cv2.imshow('RGB', color_image)
-            cv2.imshow('Depth', depth_colormap)
+            preview.show('RGB', color_image)
+            preview.show('Depth', depth_colormap)
             
             # if pressed escape exit program
-            if cv2.waitKey(1) in [27, ord("q")]:
+            if preview.key() in [27, ord("q")]:
                 break
     finally:
-        cv2.destroyAllWindows()
-        colorwriter.release()
-        depthwriter.release()
+        preview.close()
+        if recorder is not None:
+            recorder.close()
+        elif colorwriter is not None:
+            colorwriter.release()
+            depthwriter.release()
+        if rvl_writer is not None:
+            rvl_writer.close()
         pipeline.stop()
 
 
@@ -0,0 +1,203 @@
+"""
+Segmented recording: the color video, the colorized depth video, the
+timestamps (.csv) and optionally the raw depth (.rvl) are cut into
+segments of segment_seconds of recording or segment_mb on disk.
+
+A crash only loses the segment being written (an .mp4 is unreadable
+until it is closed), and segments are easier to ship than multi-hour
+files. The finished segments are released and fsynced, and the manifest
+is written, on a background thread: the capture loop only opens the
+next files at a boundary.
+
+name_manifest.json lists the segments with their files, frame ranges
+and timestamps; it is rewritten atomically whenever a segment opens or
+closes. find_segment() looks a frame or a timestamp up in it.
+"""
+
+
+import os
+import csv
+import json
+import time
+import queue
+import bisect
+import threading
+import cv2
+from rvl_codec import BackgroundRvlWriter
+
+
+def _fsync(path):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_segment(manifest, frame=None, timestamp=None):
+    # segment holding a recording frame index or a timestamp (ms): the last one starting at
+    # or before it, None before the first segment or after the end of the last one
+    first, last, key = ("first_frame", "last_frame", frame) if frame is not None else \
+        ("first_timestamp", "last_timestamp", timestamp)
+    # a segment that was just opened has no frame yet
+    segments = [segment for segment in manifest["segments"] if segment[first] is not None]
+    index = bisect.bisect_right([segment[first] for segment in segments], key) - 1
+    if index < 0:
+        return None
+    if index == len(segments) - 1 and segments[index][last] is not None and key > segments[index][last]:
+        return None
+    return segments[index]
+
+
+class Segment:
+    def __init__(self, index, prefix, extension, fourcc, fps, frame_size, rvl):
+        self.index = index
+        self.files = {"color": prefix + "_rgb." + extension, "depth": prefix + "_depth." + extension,
+                      "timestamps": prefix + "_timestamps.csv"}
+        self.colorwriter = cv2.VideoWriter(self.files["color"], fourcc, fps, frame_size, 1)
+        self.depthwriter = cv2.VideoWriter(self.files["depth"], fourcc, fps, frame_size, 1)
+        self.timestamps = open(self.files["timestamps"], "w", newline="")
+        self.csv_writer = csv.writer(self.timestamps)
+        self.csv_writer.writerow(["frame", "frame_number", "timestamp"])
+        self.rvl_writer = None
+        if rvl is not None:
+            self.files["depth_raw"] = prefix + "_depth.rvl"
+            self.rvl_writer = BackgroundRvlWriter(self.files["depth_raw"], **rvl)
+        self.first_frame = self.last_frame = None
+        self.first_timestamp = self.last_timestamp = None
+        self.frames = 0
+
+    def write(self, frame, frame_number, timestamp, color_image, depth_colormap, depth_image):
+        self.colorwriter.write(color_image)
+        self.depthwriter.write(depth_colormap)
+        if self.rvl_writer is not None:
+            self.rvl_writer.write(depth_image, timestamp)
+        self.csv_writer.writerow([frame, frame_number, timestamp])
+        if self.first_frame is None:
+            self.first_frame, self.first_timestamp = frame, timestamp
+        self.last_frame, self.last_timestamp = frame, timestamp
+        self.frames += 1
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.files.values() if os.path.exists(path))
+
+    def close(self):
+        self.colorwriter.release()
+        self.depthwriter.release()
+        self.timestamps.close()
+        if self.rvl_writer is not None:
+            self.rvl_writer.close()
+        for path in self.files.values():
+            _fsync(path)
+
+    def entry(self, complete):
+        return {"index": self.index, "files": {kind: os.path.basename(path) for kind, path in self.files.items()},
+                "frames": self.frames, "first_frame": self.first_frame, "last_frame": self.last_frame,
+                "first_timestamp": self.first_timestamp, "last_timestamp": self.last_timestamp,
+                "bytes": self.size() if complete else None, "complete": complete}
+
+
+class SegmentedRecorder:
+    # rvl is None, or the BackgroundRvlWriter options (width, height, depth_units, delta) of the raw
+    # depth. At least one of segment_seconds (frame timestamps) and segment_mb is set.
+    def __init__(self, name, extension, fourcc, fps, frame_size, segment_seconds=0.0, segment_mb=0.0, rvl=None,
+                 check_interval=1.0):
+        self.name = name
+        self.extension = extension
+        self.fourcc = fourcc
+        self.fps = fps
+        self.frame_size = frame_size
+        self.segment_seconds = segment_seconds
+        self.segment_mb = segment_mb
+        self.rvl = rvl
+        self.check_interval = check_interval
+        self.manifest_path = name + "_manifest.json"
+        # manifest entries, only touched by the closer thread
+        self.entries = []
+        self.segment_count = 0
+        self.segment = None
+        self.frames = 0
+        self.last_check = time.perf_counter()
+        self.error = None
+        # manifest changes and finished segments, written, released and fsynced in order
+        # on the closer thread
+        self.closing = queue.Queue()
+        self.closer = threading.Thread(target=self._close_segments, name="segment-closer", daemon=True)
+        self.closer.start()
+
+    def write(self, color_image, depth_colormap, timestamp, frame_number=0, depth_image=None):
+        if self.error is not None:
+            raise self.error
+        if self.segment is None or self._full(timestamp):
+            self._rotate()
+        self.segment.write(self.frames, frame_number, timestamp, color_image, depth_colormap, depth_image)
+        self.frames += 1
+
+    def _full(self, timestamp):
+        segment = self.segment
+        if self.segment_seconds > 0 and segment.frames and \
+                (timestamp - segment.first_timestamp) / 1000 >= self.segment_seconds:
+            return True
+        now = time.perf_counter()
+        if now - self.last_check < self.check_interval:
+            return False
+        # the size is looked at once per check_interval, the timestamps go to disk at the same time
+        self.last_check = now
+        segment.timestamps.flush()
+        return self.segment_mb > 0 and segment.size() >= self.segment_mb * 1e6
+
+    def _rotate(self):
+        index = self.segment_count
+        self.segment_count += 1
+        finished = self.segment
+        self.segment = Segment(index, "{}_{:05d}".format(self.name, index), self.extension, self.fourcc, self.fps,
+                               self.frame_size, self.rvl)
+        entries = [self.segment.entry(complete=False)]
+        if finished is not None:
+            # frame range known now, bytes and complete once closed
+            entries.append(finished.entry(complete=False))
+        self.closing.put(("manifest", entries))
+        if finished is not None:
+            self.closing.put(("close", finished))
+
+    def _close_segments(self):
+        while True:
+            item = self.closing.get()
+            if item is None:
+                return
+            kind, value = item
+            try:
+                if kind == "close":
+                    value.close()
+                    entries = [value.entry(complete=True)]
+                else:
+                    entries = value
+                for entry in entries:
+                    if entry["index"] == len(self.entries):
+                        self.entries.append(entry)
+                    else:
+                        self.entries[entry["index"]] = entry
+                self._write_manifest()
+            except Exception as error:
+                # raised in the capture loop at the next write, or by close()
+                self.error = error
+
+    def _write_manifest(self):
+        # atomic: a crash leaves the previous manifest, never half of one
+        temporary = self.manifest_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"fps": self.fps, "frame_size": list(self.frame_size), "segments": self.entries}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.manifest_path)
+
+    def close(self):
+        if self.segment is not None:
+            self.closing.put(("close", self.segment))
+            self.segment = None
+        self.closing.put(None)
+        self.closer.join()
+        if self.error is not None:
+            raise self.error
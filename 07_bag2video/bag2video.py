@@ -1,6 +1,10 @@
 """
 Load a recorded .bag streams, and save 
 the depth stream as a video file.
+
+--start/--end/--stride extract a part of the recording, seeking over
+what is not kept, and --thumbnails saves evenly spaced frames and a
+contact sheet of them instead of the video.
 """
 
 
@@ -10,6 +14,7 @@ import cv2
 import os
 import json
 import argparse
+from bag_range import PlaybackRange, Progress
 
 
 def get_parser():
@@ -26,6 +31,16 @@ def get_parser():
         '--height', default=720, type=int, choices=[720, 480, 360])
     parser.add_argument(
         '--FPS', '-fps', default=30, type=int, choices=[15, 25, 30, 60, 90])
+    parser.add_argument(
+        '--start', default=0.0, type=float, help="Start of the extract, seconds from the beginning of the recording")
+    parser.add_argument(
+        '--end', default=0.0, type=float, help="End of the extract in seconds, 0 for the end of the recording")
+    parser.add_argument(
+        '--stride', default=0.0, type=float, help="Keep one frame every this many seconds, 0 for every frame")
+    parser.add_argument(
+        '--thumbnails', default=0, type=int, help="Save this many evenly spaced frames and a contact sheet, no video")
+    parser.add_argument(
+        '--thumbnail_width', default=320, type=int, help="Width of the thumbnails in pixels")
     return parser
 
 
@@ -42,9 +57,30 @@ def get_args(parser):
         print("The given file is not of correct file format.")
         print("Only .bag files are accepted")
         exit()
+    if args.start < 0 or args.stride < 0 or (args.end and args.end <= args.start):
+        print("The extract needs 0 <= start < end and a positive stride")
+        exit()
     return args
 
 
+def save_thumbnails(thumbnails, name, columns=4):
+    # the thumbnails one per file, and all of them in a grid
+    folder = name + '_thumbnails'
+    os.makedirs(folder, exist_ok=True)
+    for position, image in thumbnails:
+        cv2.imwrite(os.path.join(folder, "{:010.3f}.png".format(position)), image)
+    height, width = thumbnails[0][1].shape[:2]
+    rows = (len(thumbnails) + columns - 1) // columns
+    sheet = np.zeros((rows * height, min(columns, len(thumbnails)) * width, 3), np.uint8)
+    for i, (position, image) in enumerate(thumbnails):
+        y, x = (i // columns) * height, (i % columns) * width
+        sheet[y:y + height, x:x + width] = image
+        cv2.putText(sheet, "{:.1f} s".format(position), (x + 5, y + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (255, 255, 255), 1)
+    cv2.imwrite(name + '_contact_sheet.png', sheet)
+    print(len(thumbnails), "thumbnails in", folder)
+
+
 def main(args):
     # set output video encoding
     if args.format == 'mp4':
@@ -53,8 +89,10 @@ def main(args):
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
     # set output video names
     depth_path = args.name + '_depth.' + args.format
-    # set output video writers
-    depthwriter = cv2.VideoWriter(depth_path, fourcc, args.FPS, (args.width, args.height), 1)
+    # set output video writers, none for thumbnails
+    depthwriter = None
+    if not args.thumbnails:
+        depthwriter = cv2.VideoWriter(depth_path, fourcc, args.FPS, (args.width, args.height), 1)
 
     # Create pipeline
     pipeline = rs.pipeline()
@@ -73,18 +111,22 @@ def main(args):
     # Playback is used to find duration of recorded video
     playback = device.as_playback()
     playback.set_real_time(False)
-    # duration in nano seconds
-    duration = playback.get_duration().total_seconds() * 1e9
+
+    # the frames to keep, the others are skipped or seeked over
+    stride = args.stride
+    if args.thumbnails:
+        end = args.end or playback.get_duration().total_seconds()
+        stride = (end - args.start) / args.thumbnails
+    extract = PlaybackRange(pipeline, playback, args.start, args.end, stride)
+    progress = Progress(extract)
+    thumbnails = []
 
     try:
         # Create colorizer object
         colorizer = rs.colorizer()
 
         # Streaming loop
-        while True:
-            # Get frameset
-            frames = pipeline.wait_for_frames()
-            curr_pos = playback.get_position()
+        for frames in extract:
             
             # DEPTH
             depth_frame = frames.get_depth_frame()
@@ -95,22 +137,31 @@ def main(args):
             depth_color_frame = colorizer.colorize(depth_frame)
             # Convert depth_frame to numpy array to render image in opencv
             depth_color_image = np.asanyarray(depth_color_frame.get_data())
-            # Save to disk
-            depthwriter.write(depth_color_image)
+            if args.thumbnails:
+                scale = args.thumbnail_width / depth_color_image.shape[1]
+                thumbnails.append((extract.last_position, cv2.resize(depth_color_image, None, fx=scale, fy=scale,
+                                                                  interpolation=cv2.INTER_AREA)))
+                if len(thumbnails) == args.thumbnails:
+                    break
+            else:
+                # Save to disk
+                depthwriter.write(depth_color_image)
             # Render image in opencv window
             cv2.imshow('Depth', depth_color_image)
 
-            print("Progress:", f"{curr_pos}/{duration}")
-            if curr_pos >= duration:
-                print("End of recording reached")
-                break
+            progress.update()
 
             # if pressed escape exit program
             if cv2.waitKey(1) in [27, ord("q")]:
                 break
+        progress.update(force=True)
+        print("End of the extract reached, {} frames read from the bag, {} seeks".format(extract.read, extract.seeks))
+        if thumbnails:
+            save_thumbnails(thumbnails, args.name)
     finally:
         cv2.destroyAllWindows()
-        depthwriter.release()
+        if depthwriter is not None:
+            depthwriter.release()
         pipeline.stop()
         print("Done.")
 
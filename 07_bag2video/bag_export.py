@@ -0,0 +1,171 @@
+"""
+Export a recorded .bag to several outputs at once. Each frameset is
+decoded once and handed to every output, each on its own thread:
+colorized depth video, color video, raw depth and depth aligned to
+color (.npy, readable as a memmap), lossless compressed depth (.rvl,
+see rvl_codec.py), timestamps (.csv) and point clouds (.ply).
+"""
+
+
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+import pyrealsense2 as rs
+from export_sinks import (FrameSet, ColorVideoSink, DepthVideoSink, NpySink, RvlSink, TimestampSink,
+                          PointCloudSink)
+
+
+OUTPUTS = ["depth_video", "color_video", "depth_raw", "aligned_depth", "depth_rvl", "timestamps", "pointcloud"]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default='record.bag', type=str, help="Path to the bag file")
+    parser.add_argument(
+        '--name', '-n', default='record', type=str, help="Prefix of the output files")
+    parser.add_argument(
+        '--outputs', '-o', default=["depth_video"], type=str, nargs='+', choices=OUTPUTS + ["all"])
+    parser.add_argument(
+        '--format', '-f', default='mp4', type=str, choices=['mp4', 'avi'])
+    parser.add_argument(
+        '--max_distance', default=6.0, type=float, help="Depth at the end of the colormap of the depth video, meters")
+    parser.add_argument(
+        '--pointcloud_every', default=30, type=int, help="One point cloud every this many frames")
+    parser.add_argument(
+        '--rvl_delta', action='store_true', help="Code the .rvl depth frames against the previous frame")
+    parser.add_argument(
+        '--keyframe_interval', default=30, type=int, help="One .rvl frame out of this many is coded alone")
+    parser.add_argument(
+        '--queue', default=32, type=int, help="Framesets buffered per output")
+    return parser
+
+
+def get_args(parser):
+    args = parser.parse_args()
+    if os.path.splitext(args.input)[1] != ".bag":
+        print("The given file is not of correct file format.")
+        print("Only .bag files are accepted")
+        exit()
+    if "all" in args.outputs:
+        args.outputs = OUTPUTS
+    return args
+
+
+def make_sinks(args, depth_profile, color_profile, depth_units):
+    fourcc = cv2.VideoWriter_fourcc(*('mp4v' if args.format == 'mp4' else 'XVID'))
+    fps = (depth_profile or color_profile).fps()
+    sinks = []
+    for output in args.outputs:
+        sink = None
+        if output in ("depth_video", "depth_raw", "depth_rvl", "pointcloud") and depth_profile is None:
+            print("No depth stream in the bag, no", output)
+        elif output in ("color_video", "aligned_depth") and color_profile is None:
+            print("No color stream in the bag, no", output)
+        elif output == "aligned_depth" and depth_profile is None:
+            print("No depth stream in the bag, no", output)
+        elif output == "depth_video":
+            sink = DepthVideoSink(args.name + '_depth.' + args.format, fps, fourcc, depth_units,
+                                  args.max_distance, args.queue)
+        elif output == "color_video":
+            sink = ColorVideoSink(args.name + '_rgb.' + args.format, fps, fourcc, args.queue)
+        elif output == "depth_raw":
+            sink = NpySink(args.name + '_depth.npy', "depth", args.queue)
+        elif output == "aligned_depth":
+            sink = NpySink(args.name + '_aligned_depth.npy', "aligned_depth", args.queue)
+        elif output == "depth_rvl":
+            sink = RvlSink(args.name + '_depth.rvl', "depth", depth_units, args.rvl_delta, args.keyframe_interval,
+                           args.queue)
+        elif output == "timestamps":
+            sink = TimestampSink(args.name + '_timestamps.csv', args.queue)
+        elif output == "pointcloud":
+            sink = PointCloudSink(args.name + '_pointclouds', depth_profile.get_intrinsics(), depth_units,
+                                  args.pointcloud_every, args.queue)
+        if sink is not None:
+            # threads named after their output, in the report
+            sink.name = output
+            sinks.append(sink)
+    return sinks
+
+
+def main(args):
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(args.input, repeat_playback=False)
+    profile = pipeline.start(config)
+    playback = profile.get_device().as_playback()
+    # as fast as the outputs take the frames, none dropped
+    playback.set_real_time(False)
+
+    streams = {stream.stream_type(): stream.as_video_stream_profile() for stream in profile.get_streams()
+               if stream.is_video_stream_profile()}
+    depth_profile = streams.get(rs.stream.depth)
+    color_profile = streams.get(rs.stream.color)
+    depth_units = profile.get_device().first_depth_sensor().get_depth_scale() if depth_profile else 0.001
+    sinks = make_sinks(args, depth_profile, color_profile, depth_units)
+    if not sinks:
+        pipeline.stop()
+        return
+    needs = set(stream for sink in sinks for stream in sink.needs)
+    align = rs.align(rs.stream.color) if "aligned_depth" in needs else None
+    for sink in sinks:
+        sink.start()
+
+    index = 0
+    decode_time = 0.0
+    start_time = last_report = time.perf_counter()
+    try:
+        while True:
+            decode_start = time.perf_counter()
+            ret, frames = pipeline.try_wait_for_frames(5000)
+            if not ret:
+                print("End of recording reached")
+                break
+            depth_frame = frames.get_depth_frame()
+            color_frame = frames.get_color_frame()
+            # one copy per stream, shared by the outputs, the frames go back to librealsense
+            depth = np.asanyarray(depth_frame.get_data()).copy() if depth_frame and "depth" in needs else None
+            color = np.asanyarray(color_frame.get_data()).copy() if color_frame and "color" in needs else None
+            aligned_depth = None
+            if align is not None and depth_frame and color_frame:
+                aligned_depth = np.asanyarray(align.process(frames).get_depth_frame().get_data()).copy()
+            frameset = FrameSet(
+                index, frames.get_timestamp(), depth, color, aligned_depth,
+                (depth_frame.get_frame_number(), depth_frame.get_timestamp()) if depth_frame else None,
+                (color_frame.get_frame_number(), color_frame.get_timestamp()) if color_frame else None)
+            decode_time += time.perf_counter() - decode_start
+
+            for sink in sinks:
+                # a frameset missing a stream the output needs is skipped by that output
+                if all(getattr(frameset, stream) is not None for stream in sink.needs):
+                    sink.put(frameset)
+            index += 1
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print("{} framesets, {:.1f}/s".format(index, index / (now - start_time)))
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        for sink in sinks:
+            sink.finish()
+
+    elapsed = time.perf_counter() - start_time
+    print("{} framesets in {:.1f} s, {:.1f}/s, decoding {:.1f}/s".format(
+        index, elapsed, index / max(elapsed, 1e-6), index / max(decode_time, 1e-6)))
+    # an output is the bottleneck when its own rate is the lowest and the decoder waited for it
+    for sink in sinks:
+        status = "FAILED: {}".format(sink.error) if sink.error is not None else ""
+        print("{:<16} {:6d} frames  {:8.1f} frames/s  decoder blocked {:5.1f} s  {} {}".format(
+            sink.name, sink.frames, sink.frames / max(sink.busy, 1e-6), sink.blocked, sink.path, status))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = get_args(parser)
+    print(args)
+    main(args)
@@ -0,0 +1,165 @@
+"""
+Read only a part of a recorded .bag: the framesets from start to end
+(seconds from the first frame), one every stride seconds. The start and
+the gaps between the kept framesets are skipped with playback seek
+when they are long enough, so the frames in them are never read and
+the cost follows the length of the extract, not of the file.
+"""
+
+
+import time
+import datetime
+import pyrealsense2 as rs
+
+
+# framesets whose frames are further apart than this (ms) pair a frame from before a seek with one after it
+COHERENCE_MS = 500
+# seeks aim this much (seconds) before their target, the rest is decoded through
+SEEK_MARGIN = 0.2
+# seeks towards one target, each one corrects the next
+MAX_SEEKS = 4
+
+
+class PlaybackRange:
+    # The times are seconds from the first frame, on the clock of the frames. The playback
+    # position cannot be used: it is where the reader thread is, ahead of the framesets
+    # taken from the pipeline when they are processed slower than they are read. Seeks use
+    # the time of the recording, interpolated between the points where the previous seeks
+    # landed: the two clocks can have an offset and run at slightly different rates.
+    def __init__(self, pipeline, playback, start=0.0, end=0.0, stride=0.0, seek_threshold=1.0, timeout=100):
+        # end 0 is the end of the recording, stride 0 keeps every frameset. The playback
+        # should not be real time, or frames are dropped while they are processed.
+        self.pipeline = pipeline
+        self.playback = playback
+        self.duration = playback.get_duration().total_seconds()
+        self.start = start
+        self.end = end if end > 0 else float("inf")
+        self.stride = stride
+        self.seek_threshold = seek_threshold
+        self.timeout = timeout
+        self.first_timestamp = None
+        # (recording time, frame time) where the seeks landed, and the recording time
+        # of the seek not landed yet
+        self.landings = [(0.0, 0.0)]
+        self.seeking = None
+        # stream -> last frame number read
+        self.numbers = {}
+        # time of the last frameset kept
+        self.last_position = start
+        self.read = 0
+        self.kept = 0
+        self.seeks = 0
+
+    def seek(self, seconds):
+        # seconds on the clock of the frames
+        target = min(max(self.recording_time(seconds - SEEK_MARGIN), 0.0), self.duration)
+        # Without real time, the reader waits for room in the pipeline queue and the seek
+        # waits for the reader (10 s): the framesets read ahead are dropped first
+        while True:
+            frames = self.pipeline.poll_for_frames()
+            if not frames:
+                break
+            self.read += 1
+            self._continues(frames)
+        self.playback.seek(datetime.timedelta(seconds=target))
+        self.seeking = target
+        self.seeks += 1
+
+    def recording_time(self, seconds):
+        # linear through the two landings around seconds (or closest to it), frame time -> recording time
+        landings = self.landings
+        if len(landings) == 1:
+            return seconds - landings[0][1] + landings[0][0]
+        i = 1
+        while i < len(landings) - 1 and landings[i][1] < seconds:
+            i += 1
+        (time0, frame0), (time1, frame1) = landings[i - 1], landings[i]
+        if frame1 - frame0 < 1e-3:
+            return seconds - frame1 + time1
+        return time0 + (seconds - frame0) * (time1 - time0) / (frame1 - frame0)
+
+    def _continues(self, frames):
+        # True when a frame of the set follows the last one read of its stream
+        continues = False
+        for frame in frames:
+            stream = frame.get_profile().stream_type()
+            number = frame.get_frame_number()
+            continues |= number == self.numbers.get(stream, -2) + 1
+            self.numbers[stream] = number
+        return continues
+
+    def _next(self):
+        # next frameset whose frames belong together, None at the end of the recording
+        while True:
+            success, frames = self.pipeline.try_wait_for_frames(self.timeout)
+            if not success:
+                if self.playback.current_status() == rs.playback_status.stopped:
+                    return None
+                continue
+            self.read += 1
+            timestamps = [frame.get_timestamp() for frame in frames]
+            # after a seek the syncer can pair a new frame of a stream with an old one of another
+            if max(timestamps) - min(timestamps) < COHERENCE_MS:
+                return frames
+
+    def __iter__(self):
+        target = self.start
+        target_seeks = 0
+        while True:
+            frames = self._next()
+            if frames is None:
+                return
+            if self.first_timestamp is None:
+                self.first_timestamp = frames.get_timestamp()
+            position = (frames.get_timestamp() - self.first_timestamp) / 1000
+            continues = self._continues(frames)
+            landed = False
+            if self.seeking is not None:
+                if continues:
+                    # queued before the seek
+                    continue
+                self.landings = sorted(set(self.landings + [(self.seeking, position)]), key=lambda landing: landing[1])
+                self.seeking = None
+                landed = True
+
+            overshot = landed and position > target + SEEK_MARGIN
+            if (overshot or target - position >= self.seek_threshold) and target_seeks < MAX_SEEKS:
+                self.seek(target)
+                target_seeks += 1
+                continue
+            if position > self.end:
+                return
+            if position < target:
+                # in the gap before the next kept frameset, too short to seek over
+                continue
+            self.last_position = position
+            yield frames
+            self.kept += 1
+            if self.stride <= 0:
+                continue
+            while target <= position:
+                target += self.stride
+            target_seeks = 0
+            if target > self.end:
+                return
+
+
+class Progress:
+    # Progress through the range, printed at most every interval seconds
+    def __init__(self, playback_range, interval=2.0):
+        self.range = playback_range
+        self.interval = interval
+        self.start_time = time.perf_counter()
+        self.last_print = self.start_time
+
+    def update(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_print < self.interval:
+            return
+        self.last_print = now
+        extract = self.range
+        end = min(extract.end, extract.duration)
+        done = min(max(extract.last_position - extract.start, 0.0) / max(end - extract.start, 1e-9), 1.0)
+        print("Progress: {:.1f}/{:.1f} s ({:.0%}), {} frames kept, {} read, {:.1f} frames/s".format(
+            extract.last_position, end, done, extract.kept, extract.read,
+            extract.kept / max(now - self.start_time, 1e-6)))
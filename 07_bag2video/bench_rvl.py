@@ -0,0 +1,120 @@
+"""
+Compression ratio and encode/decode rates of the RVL depth codec
+(rvl_codec.py), with and without delta frames, against zlib and 16 bit
+PNG, on the depth frames of a .bag or on synthetic 1280x720 frames.
+Every codec is checked to give back the exact frames.
+"""
+
+
+import time
+import zlib
+import argparse
+import cv2
+import numpy as np
+import rvl_codec
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default=None, type=str, help="Bag file, synthetic frames when not given")
+    parser.add_argument(
+        '--frames', default=60, type=int, help="At most this many frames")
+    parser.add_argument(
+        '--width', default=1280, type=int, help="Width of the synthetic frames")
+    parser.add_argument(
+        '--height', default=720, type=int, help="Height of the synthetic frames")
+    parser.add_argument(
+        '--keyframe_interval', default=30, type=int)
+    return parser
+
+
+def bag_frames(path, count):
+    import pyrealsense2 as rs
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(path, repeat_playback=False)
+    config.enable_stream(rs.stream.depth)
+    profile = pipeline.start(config)
+    profile.get_device().as_playback().set_real_time(False)
+    frames = []
+    while len(frames) < count:
+        ret, frameset = pipeline.try_wait_for_frames(1000)
+        if not ret:
+            break
+        frames.append(np.asanyarray(frameset.get_depth_frame().get_data()).copy())
+    pipeline.stop()
+    return frames
+
+
+def synthetic_frames(width, height, count):
+    # a slanted wall and a box moving in front of it, noise growing with the distance, holes
+    rng = np.random.RandomState(0)
+    u = np.arange(width, dtype=np.float32)
+    wall = np.broadcast_to(1500 + 1500 * u / width, (height, width))
+    frames = []
+    for i in range(count):
+        z = wall.copy()
+        x = (i * 16) % (width - width // 4)
+        z[height // 3:2 * height // 3, x:x + width // 4] = 900
+        z += rng.normal(0, 1, z.shape).astype(np.float32) * (z / 1000) ** 2 * 2
+        depth = z.astype(np.uint16)
+        depth[rng.random_sample(z.shape) < 0.02] = 0
+        depth[:, :width // 40] = 0
+        frames.append(depth)
+    return frames
+
+
+def bench(name, frames, encode, decode):
+    start = time.perf_counter()
+    payloads = encode(frames)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = decode(payloads)
+    decode_time = time.perf_counter() - start
+    if not all(np.array_equal(a, b) for a, b in zip(frames, decoded)):
+        raise AssertionError(name + " is not lossless")
+    raw = sum(frame.nbytes for frame in frames)
+    print("{:<12} ratio {:5.2f}  {:7.1f} MB  encode {:6.1f} fps  decode {:6.1f} fps".format(
+        name, raw / sum(len(payload) for payload in payloads), sum(len(payload) for payload in payloads) / 1e6,
+        len(frames) / encode_time, len(frames) / decode_time))
+
+
+def main(args):
+    frames = bag_frames(args.input, args.frames) if args.input else \
+        synthetic_frames(args.width, args.height, args.frames)
+    height, width = frames[0].shape
+    print("{} frames {}x{}, {:.1f} MB raw".format(len(frames), width, height, sum(f.nbytes for f in frames) / 1e6))
+    shape = frames[0].shape
+    # the buffers of a stream are reused from frame to frame, as in RvlWriter
+    scratch = rvl_codec.Scratch()
+
+    def rvl_delta_encode(frames):
+        payloads = []
+        for i, frame in enumerate(frames):
+            key = i % args.keyframe_interval == 0
+            payloads.append(rvl_codec.encode(frame, None if key else frames[i - 1], scratch))
+        return payloads
+
+    def rvl_delta_decode(payloads):
+        decoded = []
+        for i, payload in enumerate(payloads):
+            key = i % args.keyframe_interval == 0
+            decoded.append(rvl_codec.decode(payload, shape, None if key else decoded[-1]))
+        return decoded
+
+    bench("zlib", frames, lambda frames: [zlib.compress(frame.tobytes(), 1) for frame in frames],
+          lambda payloads: [np.frombuffer(zlib.decompress(payload), np.uint16).reshape(shape) for payload in payloads])
+    bench("png", frames, lambda frames: [cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+                                         for frame in frames],
+          lambda payloads: [cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED) for payload in payloads])
+    bench("rvl", frames, lambda frames: [rvl_codec.encode(frame, scratch=scratch) for frame in frames],
+          lambda payloads: [rvl_codec.decode(payload, shape) for payload in payloads])
+    bench("rvl delta", frames, rvl_delta_encode, rvl_delta_decode)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,223 @@
+"""
+Outputs of bag_export.py. Each sink runs on its own thread and takes
+the decoded framesets from its own bounded queue, so a slow encoder
+only delays its own output (until its queue is full). The framesets
+are shared by all the sinks and must not be modified.
+"""
+
+
+import os
+import time
+import queue
+import threading
+import cv2
+import numpy as np
+from rvl_codec import RvlWriter
+
+
+class FrameSet:
+    def __init__(self, index, timestamp, depth, color, aligned_depth, depth_info, color_info):
+        # depth_info and color_info are (frame number, timestamp) of each stream, or None
+        self.index = index
+        self.timestamp = timestamp
+        self.depth = depth
+        self.color = color
+        self.aligned_depth = aligned_depth
+        self.depth_info = depth_info
+        self.color_info = color_info
+
+
+class Sink(threading.Thread):
+    # streams the sink reads: "depth", "color" and/or "aligned_depth"
+    needs = ()
+
+    def __init__(self, path, queue_size=32):
+        super().__init__(name=type(self).__name__, daemon=True)
+        self.path = path
+        self.queue = queue.Queue(queue_size)
+        self.frames = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.error = None
+
+    def put(self, frameset):
+        # called by the decoder, the time it waits for room in the queue is counted
+        if self.error is not None:
+            return
+        start = time.perf_counter()
+        self.queue.put(frameset)
+        self.blocked += time.perf_counter() - start
+
+    def finish(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        try:
+            while True:
+                frameset = self.queue.get()
+                if frameset is None:
+                    break
+                start = time.perf_counter()
+                self.write(frameset)
+                self.busy += time.perf_counter() - start
+                self.frames += 1
+        except Exception as error:
+            self.error = error
+            # keep emptying the queue, the decoder must not block on a failed sink
+            while self.queue.get() is not None:
+                pass
+        finally:
+            self.close()
+
+    def write(self, frameset):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class VideoSink(Sink):
+    def __init__(self, path, fps, fourcc, queue_size=32):
+        super().__init__(path, queue_size)
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+
+    def image(self, frameset):
+        raise NotImplementedError
+
+    def write(self, frameset):
+        image = self.image(frameset)
+        if self.writer is None:
+            height, width = image.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, (width, height), 1)
+        self.writer.write(image)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class ColorVideoSink(VideoSink):
+    needs = ("color",)
+
+    def image(self, frameset):
+        return frameset.color
+
+
+class DepthVideoSink(VideoSink):
+    # jet colormap over a fixed range, the same colors for every frame
+    needs = ("depth",)
+
+    def __init__(self, path, fps, fourcc, depth_units, max_distance=6.0, queue_size=32):
+        super().__init__(path, fps, fourcc, queue_size)
+        self.alpha = 255 / (max_distance / depth_units)
+
+    def image(self, frameset):
+        return cv2.applyColorMap(cv2.convertScaleAbs(frameset.depth, alpha=self.alpha), cv2.COLORMAP_JET)
+
+
+class NpySink(Sink):
+    # Every frame of a stream in one .npy file, np.load(path, mmap_mode='r') reads it back.
+    # The number of frames is unknown until the end: the header is written with room for
+    # any count and rewritten when the file is closed.
+    HEADER_SIZE = 128
+
+    def __init__(self, path, stream, queue_size=32):
+        super().__init__(path, queue_size)
+        self.needs = (stream,)
+        self.stream = stream
+        self.file = None
+        self.shape = None
+        self.dtype = None
+
+    def header(self, count):
+        text = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}, {}, {}), }}".format(
+            self.dtype.str, count, *self.shape)
+        text = text.ljust(self.HEADER_SIZE - 10 - 1) + "\n"
+        return b"\x93NUMPY\x01\x00" + np.uint16(len(text)).tobytes() + text.encode("latin1")
+
+    def write(self, frameset):
+        image = getattr(frameset, self.stream)
+        if self.file is None:
+            self.shape, self.dtype = image.shape, image.dtype
+            self.file = open(self.path, "wb")
+            self.file.write(self.header(0))
+        self.file.write(np.ascontiguousarray(image).data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.write(self.header(self.frames))
+            self.file.close()
+
+
+class RvlSink(Sink):
+    # Lossless depth (or aligned depth) in an .rvl file, see rvl_codec.py
+    def __init__(self, path, stream, depth_units, delta=False, keyframe_interval=30, queue_size=32):
+        super().__init__(path, queue_size)
+        self.needs = (stream,)
+        self.stream = stream
+        self.depth_units = depth_units
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.writer = None
+
+    def write(self, frameset):
+        depth = getattr(frameset, self.stream)
+        if self.writer is None:
+            height, width = depth.shape
+            self.writer = RvlWriter(self.path, width, height, self.depth_units, self.delta, self.keyframe_interval)
+        self.writer.write(depth, frameset.timestamp)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class TimestampSink(Sink):
+    needs = ()
+
+    def __init__(self, path, queue_size=32):
+        super().__init__(path, queue_size)
+        self.file = open(path, "w")
+        self.file.write("index,timestamp,depth_frame,depth_timestamp,color_frame,color_timestamp\n")
+
+    def write(self, frameset):
+        fields = [frameset.index, frameset.timestamp]
+        for info in (frameset.depth_info, frameset.color_info):
+            fields += info if info is not None else ["", ""]
+        self.file.write(",".join(str(field) for field in fields) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class PointCloudSink(Sink):
+    # One binary PLY of the depth points (meters, camera coordinates) every n frames
+    needs = ("depth",)
+
+    def __init__(self, folder, intrinsics, depth_units, every=30, queue_size=32):
+        super().__init__(folder, queue_size)
+        os.makedirs(folder, exist_ok=True)
+        self.every = every
+        self.depth_units = depth_units
+        # the rays of the pixels, the depth stream has no distortion
+        u = np.arange(intrinsics.width, dtype=np.float32)
+        v = np.arange(intrinsics.height, dtype=np.float32)
+        self.ray_x = np.tile((u - intrinsics.ppx) / intrinsics.fx, len(v))
+        self.ray_y = np.repeat((v - intrinsics.ppy) / intrinsics.fy, len(u))
+
+    def write(self, frameset):
+        if frameset.index % self.every:
+            return
+        depth = frameset.depth.ravel()
+        valid = depth > 0
+        z = depth[valid].astype(np.float32) * np.float32(self.depth_units)
+        points = np.column_stack([self.ray_x[valid] * z, self.ray_y[valid] * z, z])
+        path = os.path.join(self.path, "{:06d}.ply".format(frameset.index))
+        with open(path, "wb") as f:
+            f.write(("ply\nformat binary_little_endian 1.0\nelement vertex {}\n"
+                     "property float x\nproperty float y\nproperty float z\nend_header\n").format(len(points)).encode())
+            f.write(points.astype("<f4").tobytes())
@@ -0,0 +1,272 @@
+"""
+Lossless codec for z16 depth frames, of the RVL family (run-length and
+variable-length coding, A. Wilson, "Fast lossless depth image
+compression", 2017), written with NumPy array operations only.
+
+A frame is split into runs of holes (0) and runs of valid depths. The
+valid depths are replaced by their difference with the previous valid
+depth, zigzag mapped to unsigned integers, and the run lengths and the
+differences are written in two streams of variable-length nibbles
+(3 bits of value, 1 bit "more nibbles follow"). Two streams instead of
+RVL's single interleaved one let the decoder find every run at once.
+Within a stream the nibbles are stored by level: the first nibble of
+every value, then the second nibble of the values that have one, and
+so on. Coding and decoding are then a few whole-array operations per
+level, most values have one or two nibbles.
+
+In delta mode the frame is coded against the previous one: the runs
+are runs of unchanged pixels and the values are the changes, with a
+key frame every keyframe_interval frames.
+
+File: header (magic, version, mode, width, height, depth units), then
+per frame its payload size, type (key or delta), timestamp and payload.
+"""
+
+
+import time
+import queue
+import struct
+import threading
+import numpy as np
+
+
+MAGIC = b"RVLD"
+VERSION = 2
+FILE_HEADER = struct.Struct("<4sBBHHd")
+FRAME_HEADER = struct.Struct("<IBd")
+PAYLOAD_HEADER = struct.Struct("<III")
+KEY_FRAME, DELTA_FRAME = 0, 1
+
+
+class Scratch:
+    # Arrays kept from one frame to the next. Arrays made fresh for every frame go back
+    # to the system when the frame is done and are paged in again for the next one,
+    # which costs as much as the coding itself.
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype):
+        size = int(np.prod(shape))
+        array = self.arrays.get(name)
+        if array is None or array.size < size or array.dtype != dtype:
+            # some room to spare, the number of values changes from frame to frame
+            array = self.arrays[name] = np.empty(size + size // 4, dtype)
+        return array[:size].reshape(shape)
+
+
+def _vle_encode(values, scratch):
+    # unsigned integers -> nibbles by level, two per byte (low nibble first)
+    values = values.astype(np.uint32, copy=False)
+    levels = []
+    while len(values):
+        count = len(values)
+        more = np.greater_equal(values, 8, out=scratch.get("more", count, bool))
+        nibbles = scratch.get("nibbles", count + (count & 1), np.uint8)
+        np.copyto(nibbles[:count], values, casting="unsafe")
+        nibbles[count:] = 0
+        nibbles &= 7
+        nibbles[:count] |= np.left_shift(more.view(np.uint8), 3, out=scratch.get("flags", count, np.uint8))
+        packed = np.left_shift(nibbles[1::2], 4, out=scratch.get("packed", len(nibbles) // 2, np.uint8))
+        packed |= nibbles[0::2]
+        levels.append(packed.tobytes())
+        # the rest of the values that have more nibbles, for the next level
+        values = np.compress(more, values, out=scratch.get("level{}".format(len(levels) & 1),
+                                                            np.count_nonzero(more), np.uint32))
+        values >>= 3
+    return b"".join(levels)
+
+
+def _vle_decode(data, count):
+    # nibbles by level -> count unsigned integers
+    packed = np.frombuffer(data, np.uint8)
+    values = np.zeros(count, np.uint32)
+    # values that have a nibble in the level, all of them in the first
+    index = None
+    offset = shift = 0
+    while count:
+        size = (count + 1) // 2
+        level = packed[offset:offset + size]
+        offset += size
+        nibbles = np.empty(2 * size, np.uint8)
+        nibbles[0::2] = level & 15
+        nibbles[1::2] = level >> 4
+        nibbles = nibbles[:count]
+        if index is None:
+            values[:] = nibbles & 7
+            index = np.flatnonzero(nibbles >= 8)
+        else:
+            values[index] |= (nibbles & 7).astype(np.uint32) << shift
+            index = index[nibbles >= 8]
+        shift += 3
+        count = len(index)
+    return values
+
+
+def _zigzag(values, scratch):
+    # in place
+    sign = np.right_shift(values, 31, out=scratch.get("sign", len(values), np.int32))
+    values <<= 1
+    values ^= sign
+    return values.view(np.uint32)
+
+
+def _unzigzag(values):
+    return (values >> 1).view(np.int32) ^ -(values & 1).view(np.int32)
+
+
+def encode(depth, previous=None, scratch=None):
+    # z16 frame -> payload, coded against the previous frame when it is given; scratch
+    # is kept by the caller that codes a stream of frames
+    scratch = scratch or Scratch()
+    flat = depth.ravel()
+    if previous is None:
+        selected = np.not_equal(flat, 0, out=scratch.get("selected", len(flat), bool))
+        depths = np.compress(selected, flat, out=scratch.get("depths", np.count_nonzero(selected), np.uint16))
+        # difference with the previous valid depth
+        values = scratch.get("values", len(depths), np.int32)
+        values[:1] = depths[:1]
+        np.subtract(depths[1:], depths[:-1], out=values[1:], dtype=np.int32)
+    else:
+        changes = np.subtract(flat, previous.ravel(), out=scratch.get("changes", len(flat), np.int32),
+                              dtype=np.int32)
+        selected = np.not_equal(changes, 0, out=scratch.get("selected", len(flat), bool))
+        values = np.compress(selected, changes, out=scratch.get("values", np.count_nonzero(selected), np.int32))
+    # lengths of the runs, alternating not selected / selected, starting with not selected
+    edges = np.not_equal(selected[1:], selected[:-1], out=scratch.get("edges", max(len(flat) - 1, 0), bool))
+    boundaries = np.flatnonzero(edges) + 1
+    lengths = np.diff(np.concatenate(([0], boundaries, [len(flat)])))
+    if len(flat) and selected[0]:
+        lengths = np.concatenate(([0], lengths))
+    runs = _vle_encode(lengths, scratch)
+    return PAYLOAD_HEADER.pack(len(lengths), len(values), len(runs)) + runs + \
+        _vle_encode(_zigzag(values, scratch), scratch)
+
+
+def decode(payload, shape, previous=None):
+    # payload -> z16 frame of the given shape
+    run_count, value_count, run_bytes = PAYLOAD_HEADER.unpack_from(payload)
+    offset = PAYLOAD_HEADER.size
+    lengths = _vle_decode(payload[offset:offset + run_bytes], run_count)
+    values = _unzigzag(_vle_decode(payload[offset + run_bytes:], value_count))
+    selected = np.repeat(np.arange(run_count) & 1 == 1, lengths)
+    if previous is None:
+        depth = np.zeros(selected.size, np.uint16)
+        depth[selected] = np.cumsum(values, dtype=np.int32)
+    else:
+        depth = previous.ravel().copy()
+        depth[selected] += values.astype(np.uint16)
+    return depth.reshape(shape)
+
+
+class RvlWriter:
+    # Depth frames of one stream to an .rvl file, delta mode codes most frames against
+    # the previous one
+    def __init__(self, path, width, height, depth_units=0.001, delta=False, keyframe_interval=30):
+        self.path = path
+        self.shape = (height, width)
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.scratch = Scratch()
+        self.frames = 0
+        self.raw_bytes = 0
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, int(delta), width, height, depth_units))
+
+    def write(self, depth, timestamp=0.0):
+        if depth.shape != self.shape:
+            raise ValueError("frame of {} in a {} stream".format(depth.shape, self.shape))
+        key = not self.delta or self.frames % self.keyframe_interval == 0
+        payload = encode(depth, None if key else self.previous, self.scratch)
+        self.file.write(FRAME_HEADER.pack(len(payload), KEY_FRAME if key else DELTA_FRAME, timestamp))
+        self.file.write(payload)
+        if self.delta:
+            if self.previous is None:
+                self.previous = np.empty_like(depth)
+            np.copyto(self.previous, depth)
+        self.frames += 1
+        self.raw_bytes += depth.nbytes
+
+    def close(self):
+        self.file.close()
+
+
+class BackgroundRvlWriter:
+    # RvlWriter on its own thread, for capture loops: write() copies the frame into one
+    # of queue_size buffers and returns, it only waits when all of them are still
+    # waiting to be coded (the time it waits is counted in blocked)
+    def __init__(self, path, width, height, depth_units=0.001, delta=False, keyframe_interval=30, queue_size=8):
+        self.writer = RvlWriter(path, width, height, depth_units, delta, keyframe_interval)
+        self.path = path
+        self.buffers = [np.empty((height, width), np.uint16) for _ in range(queue_size)]
+        self.free = queue.Queue()
+        for index in range(queue_size):
+            self.free.put(index)
+        self.filled = queue.Queue()
+        self.blocked = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._write, name="rvl-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, depth, timestamp=0.0):
+        if self.error is not None:
+            raise self.error
+        if depth.shape != self.writer.shape:
+            raise ValueError("frame of {} in a {} stream".format(depth.shape, self.writer.shape))
+        start = time.perf_counter()
+        index = self.free.get()
+        self.blocked += time.perf_counter() - start
+        np.copyto(self.buffers[index], depth)
+        self.filled.put((index, timestamp))
+
+    def _write(self):
+        while True:
+            item = self.filled.get()
+            if item is None:
+                return
+            index, timestamp = item
+            try:
+                if self.error is None:
+                    self.writer.write(self.buffers[index], timestamp)
+            except Exception as error:
+                # raised by the next write() or by close(), the frames after it are dropped
+                self.error = error
+            self.free.put(index)
+
+    def close(self):
+        self.filled.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+
+class RvlReader:
+    # Iterates (timestamp, depth) over the frames of an .rvl file
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic, version, delta, width, height, self.depth_units = FILE_HEADER.unpack(
+            self.file.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not an .rvl depth file (version {})".format(path, VERSION))
+        self.delta = bool(delta)
+        self.width, self.height = width, height
+
+    def __iter__(self):
+        previous = None
+        while True:
+            header = self.file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            size, kind, timestamp = FRAME_HEADER.unpack(header)
+            payload = self.file.read(size)
+            if len(payload) < size:
+                # cut short, the recording was interrupted
+                return
+            if kind == DELTA_FRAME and previous is None:
+                raise ValueError("delta frame without a key frame before it")
+            previous = decode(payload, (self.height, self.width), None if kind == KEY_FRAME else previous)
+            yield timestamp, previous
+
+    def close(self):
+        self.file.close()
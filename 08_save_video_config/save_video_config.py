@@ -4,18 +4,55 @@ import cv2
 import argparse
 import json
 import time
+from adaptive_quality import AdaptiveQualityController
+from tiled_spatial import TiledSpatialFilter
+from preview import Preview
+from rvl_codec import BackgroundRvlWriter
+from segment_writer import SegmentedRecorder
+from soak_monitor import SoakMonitor
 
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '--name', '-n', default='record', type=str)
     parser.add_argument(
-        '--format', '-f', default='mp4', type=str, choices=['mp4', 'avi'])
+        '--format', '-f', default='mp4', type=str, choices=['mp4', 'avi', 'bag'],
+        help="bag records the raw streams with librealsense (compressed) instead of the videos")
+    parser.add_argument(
+        '--record_bag', action='store_true', help="Also record name.bag next to the videos")
     parser.add_argument(
         '--json', '-j', default='config.json', type=str, help="Path to the json config file")
     parser.add_argument(
         '--visual_preset', default="High Accuracy", type=str, 
         choices=["Custom", "Default", "Hand", "High Accuracy", "High Density"])
+    parser.add_argument(
+        '--target_fps', default=0, type=float, help="Degrade filters and preview to hold this processing rate, 0 to disable")
+    parser.add_argument(
+        '--spatial_threads', default=0, type=int, help="Run the spatial filter in row bands on this many threads (needs numba), 0 for rs.spatial_filter")
+    parser.add_argument(
+        '--preview_fps', default=15, type=float, help="Rate of the preview windows")
+    parser.add_argument(
+        '--preview_scale', default=0.5, type=float, help="Size of the preview images relative to the recorded ones")
+    parser.add_argument(
+        '--no_preview', action='store_true', help="Record without any preview window")
+    parser.add_argument(
+        '--depth_rvl', action='store_true', help="Also record the raw depth, lossless, to name_depth.rvl")
+    parser.add_argument(
+        '--rvl_delta', action='store_true', help="Code the .rvl depth frames against the previous frame")
+    parser.add_argument(
+        '--segment_seconds', default=0, type=float, help="Start new files every this many seconds, 0 for one file per stream")
+    parser.add_argument(
+        '--segment_mb', default=0, type=float, help="Start new files when a segment reaches this many MB, 0 for no limit")
+    parser.add_argument(
+        '--soak', default=0, type=int, help="Soak mode: sample memory, files and threads every this many frames, 0 to disable")
+    parser.add_argument(
+        '--soak_frames', default=0, type=int, help="Stop after this many frames, 0 to record until q")
+    parser.add_argument(
+        '--soak_warmup', default=1000, type=int, help="Frames before the baseline sample of the soak")
+    parser.add_argument(
+        '--soak_max_rss', default=100.0, type=float, help="Fail the soak when the resident memory grows by this many MB")
+    parser.add_argument(
+        '--soak_max_files', default=8, type=int, help="Fail the soak when this many more files are open")
 
     return parser
 
@@ -34,20 +71,47 @@ def main(args):
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     elif args.format == 'avi':
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    else:
+        fourcc = None
     # set output video names
     color_path = args.name + '_rgb.' + args.format
     depth_path = args.name + '_depth.' + args.format
-    # set output video writers
-    colorwriter = cv2.VideoWriter(color_path, fourcc, FPS, (width, height), 1)
-    depthwriter = cv2.VideoWriter(depth_path, fourcc, FPS, (width, height), 1)
+    # set output video writers, the segmented recorder opens its own
+    segmented = args.segment_seconds > 0 or args.segment_mb > 0
+    if segmented and args.format == 'bag':
+        print("Segments are made of videos, use --format mp4 or avi with --record_bag")
+        exit()
+    colorwriter = depthwriter = None
+    if not segmented and args.format != 'bag':
+        colorwriter = cv2.VideoWriter(color_path, fourcc, FPS, (width, height), 1)
+        depthwriter = cv2.VideoWriter(depth_path, fourcc, FPS, (width, height), 1)
 
     # define pipeline and its config
     pipeline = rs.pipeline()
     config = rs.config()
     config.enable_stream(rs.stream.depth, width, height, rs.format.z16, FPS)
     config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, FPS)
+    # librealsense writes the frames to the .bag itself, compressed on D400 cameras
+    if args.format == 'bag' or args.record_bag:
+        config.enable_record_to_file(args.name + '.bag')
 
     pipe_profile = pipeline.start(config)
+
+    # raw z16 depth, lossless, next to the colorized video (see rvl_codec.py), coded on its own thread
+    rvl_writer = None
+    rvl = None
+    if args.depth_rvl:
+        depth_units = pipe_profile.get_device().first_depth_sensor().get_option(rs.option.depth_units)
+        rvl = dict(width=width, height=height, depth_units=depth_units, delta=args.rvl_delta)
+        if not segmented:
+            rvl_writer = BackgroundRvlWriter(args.name + '_depth.rvl', **rvl)
+
+    # SEGMENTS
+    # files rotated every few seconds or MB, closed on a background thread, listed in name_manifest.json
+    recorder = None
+    if segmented:
+        recorder = SegmentedRecorder(args.name, args.format, fourcc, FPS, (width, height), args.segment_seconds,
+                                     args.segment_mb, rvl)
     device = pipe_profile.get_device()
 
     # Load advanced controls settings
@@ -73,6 +137,25 @@ def main(args):
     depth_sensor.set_option(rs.option.emitter_enabled, 1)  # 1=Laser is the default
     # depth_sensor.set_option(rs.option.hdr_enabled, True)  # DO NOT USE, it makes the image flash
 
+    # ADAPTIVE QUALITY
+    # steps through filter/preview degradations when processing falls behind the target fps
+    quality = None
+    if args.target_fps > 0:
+        quality = AdaptiveQualityController(args.target_fps, log_path=args.name + '_quality.csv')
+
+    # PREVIEW
+    # drawn on its own thread at its own rate, the loop below never waits for the screen
+    preview = Preview(args.preview_fps, args.preview_scale, enabled=not args.no_preview)
+
+    # SOAK
+    # leak tracking over long runs, fails when the process keeps growing
+    soak = None
+    if args.soak > 0:
+        soak = SoakMonitor(args.soak, args.soak_warmup, max_rss=args.soak_max_rss, max_files=args.soak_max_files,
+                           log_path=args.name + '_soak.csv')
+
+    # created in the try, closed in the finally
+    tiled_spatial_filter = None
     try:
         # COLORMAPS
         # these are the depth visualization parameters
@@ -101,11 +184,21 @@ def main(args):
         # current frame, and delta defines thethreshold for edge 
         # classification and preserving.
         disparity_to_depth_filter = rs.disparity_transform(transform_to_disparity=False)  # Converts from depth representation to disparity representation and vice
+        if args.spatial_threads > 0:
+            # Same spatial filter on several cores, it converts to and from disparity itself
+            tiled_spatial_filter = TiledSpatialFilter.from_device(
+                device, smooth_alpha=0.5, smooth_delta=20, magnitude=2, hole_fill=2, threads=args.spatial_threads)
+
+        frame_count = 0
+        preview_every = 1
+        use_spatial = True
 
         # Streaming loop
         while True:
             
             frames = pipeline.wait_for_frames()
+            # processing time is measured from here, waiting for the camera is not part of it
+            start_time = time.perf_counter()
             depth_frame = frames.get_depth_frame()
             color_frame = frames.get_color_frame()
             
@@ -118,31 +211,70 @@ def main(args):
             filtered_depth = depth_frame
             filtered_depth = decimation_filter.process(filtered_depth)
             filtered_depth = threshold_filter.process(filtered_depth)
-            filtered_depth = depth_to_disparity_filter.process(filtered_depth)
-            filtered_depth = spatial_filter.process(filtered_depth)
-            # filtered_depth = temporal_filter.process(filtered_depth)
-            filtered_depth = disparity_to_depth_filter.process(filtered_depth)
+            if tiled_spatial_filter is not None:
+                if use_spatial:
+                    filtered_depth = tiled_spatial_filter.process_frame(filtered_depth)
+            else:
+                filtered_depth = depth_to_disparity_filter.process(filtered_depth)
+                if use_spatial:
+                    filtered_depth = spatial_filter.process(filtered_depth)
+                # filtered_depth = temporal_filter.process(filtered_depth)
+                filtered_depth = disparity_to_depth_filter.process(filtered_depth)
 
             # Apply colormap to show the depth of the Objects
             depth_colormap = np.asanyarray(colorizer.colorize(filtered_depth).get_data())
+            # Decimated depth is scaled back, the video writer only accepts its own frame size
+            if depth_colormap.shape[:2] != (height, width):
+                depth_colormap = cv2.resize(depth_colormap, (width, height), interpolation=cv2.INTER_NEAREST)
             # Convert images to numpy arrays
             color_image = np.asanyarray(color_frame.get_data())
 
             # Save to disk
-            colorwriter.write(color_image)
-            depthwriter.write(depth_colormap)
+            if recorder is not None:
+                recorder.write(color_image, depth_colormap, color_frame.get_timestamp(), color_frame.get_frame_number(),
+                               np.asanyarray(depth_frame.get_data()) if rvl is not None else None)
+            elif colorwriter is not None:
+                colorwriter.write(color_image)
+                depthwriter.write(depth_colormap)
+            if rvl_writer is not None:
+                rvl_writer.write(np.asanyarray(depth_frame.get_data()), depth_frame.get_timestamp())
+            frame_count += 1
              
             # Show to screen
-            cv2.imshow('RGB', color_image)
-            cv2.imshow('Depth', depth_colormap)
-            
+            if frame_count % preview_every == 0:
+                preview.show('RGB', color_image)
+                preview.show('Depth', depth_colormap)
+
             # if pressed escape exit program
-            if cv2.waitKey(1) in [27, ord("q")]:
+            if preview.key() in [27, ord("q")]:
+                break
+
+            # Apply the new settings when the controller changes level
+            if quality is not None and quality.update(time.perf_counter() - start_time):
+                decimation_filter.set_option(rs.option.filter_magnitude, quality.settings["decimation"])
+                use_spatial = quality.settings["spatial"]
+                preview_every = quality.settings["preview_every"]
+
+            if soak is not None:
+                soak.track(frames, depth_frame, color_frame, filtered_depth)
+                soak.step()
+            if args.soak_frames and frame_count >= args.soak_frames:
                 break
     finally:
-        cv2.destroyAllWindows()
-        colorwriter.release()
-        depthwriter.release()
+        if soak is not None:
+            soak.close()
+        if quality is not None:
+            quality.close()
+        if tiled_spatial_filter is not None:
+            tiled_spatial_filter.close()
+        preview.close()
+        if recorder is not None:
+            recorder.close()
+        elif colorwriter is not None:
+            colorwriter.release()
+            depthwriter.release()
+        if rvl_writer is not None:
+            rvl_writer.close()
         pipeline.stop()
 
 if __name__ == '__main__':
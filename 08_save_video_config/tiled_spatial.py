@@ -0,0 +1,155 @@
+"""
+Spatial filter of the live chain split over a thread pool.
+
+rs.spatial_filter runs on a single core and holds the GIL while it
+works. Here the frame is cut into bands of rows, each band extended
+by a halo of rows above and below it, and every band is filtered by
+a numba kernel compiled with nogil=True, so that the bands really
+run in parallel. The horizontal passes and the hole filling only see
+their own row, the halo makes the vertical passes across the seams
+match whole-frame processing (a seam error decays by 1 - alpha per
+halo row).
+
+The kernel follows the librealsense implementation: depth to
+disparity, `magnitude` horizontal and vertical recursive passes,
+hole filling, back to depth. Requires numba.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyrealsense2 as rs
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def disparity_factor(baseline_mm, focal_px, depth_units):
+    # Same constant as rs.disparity_transform: disparity keeps 5 fractional bits
+    return baseline_mm * 0.001 * focal_px * 32 / depth_units
+
+
+def _filter_rows(depth, out, first, last, halo, factor, alpha, delta, iterations, hole_radius):
+    # Filters rows [first, last) of depth into out, the vertical passes
+    # run over [first - halo, last + halo)
+    height, width = depth.shape
+    top = max(first - halo, 0)
+    bottom = min(last + halo, height)
+    factor = np.float32(factor)
+    alpha = np.float32(alpha)
+    beta = np.float32(1) - alpha
+    delta = np.float32(delta)
+
+    image = np.zeros((bottom - top, width), np.float32)
+    for v in range(top, bottom):
+        for u in range(width):
+            if depth[v, u] != 0:
+                image[v - top, u] = factor / np.float32(depth[v, u])
+
+    for _ in range(iterations):
+        # horizontal, left to right then right to left: only valid pixels next to a
+        # valid and close input pixel are smoothed, the state follows every valid pixel
+        for v in range(bottom - top):
+            row = image[v]
+            state = row[0]
+            previous = row[0]
+            for u in range(1, width):
+                value = row[u]
+                if value > 0 and previous > 0 and abs(previous - value) < delta:
+                    row[u] = value * alpha + state * beta
+                if value > 0:
+                    state = row[u]
+                previous = value
+            state = row[width - 1]
+            previous = row[width - 1]
+            for u in range(width - 2, -1, -1):
+                value = row[u]
+                if value > 0 and previous > 0 and abs(previous - value) < delta:
+                    row[u] = value * alpha + state * beta
+                if value > 0:
+                    state = row[u]
+                previous = value
+        # vertical, top to bottom then bottom to top, on the difference only
+        for v in range(1, bottom - top):
+            for u in range(width):
+                if abs(image[v - 1, u] - image[v, u]) < delta:
+                    image[v, u] = image[v, u] * alpha + image[v - 1, u] * beta
+        for v in range(bottom - top - 2, -1, -1):
+            for u in range(width):
+                if abs(image[v, u] - image[v + 1, u]) < delta:
+                    image[v, u] = image[v, u] * alpha + image[v + 1, u] * beta
+
+    for v in range(first, last):
+        row = image[v - top]
+        # each run of empty pixels copies the value on its left, up to the radius
+        filled_from = -1
+        for u in range(width):
+            if row[u] != 0:
+                filled_from = u
+            elif hole_radius and filled_from >= 0 and u - filled_from < hole_radius:
+                row[u] = row[filled_from]
+        for u in range(width):
+            if row[u] != 0:
+                out[v, u] = np.uint16(factor / row[u] + np.float32(0.5))
+            else:
+                out[v, u] = 0
+
+
+if numba is not None:
+    _filter_rows = numba.njit(nogil=True, cache=True)(_filter_rows)
+
+
+class TiledSpatialFilter:
+    def __init__(self, baseline_mm, smooth_alpha=0.5, smooth_delta=20, magnitude=2, hole_fill=0,
+                 threads=4, halo=32):
+        # Same parameters as rs.spatial_filter, baseline_mm is the stereo baseline of the camera
+        if numba is None:
+            raise ImportError("The tiled spatial filter requires numba (pip install numba)")
+        self.baseline_mm = baseline_mm
+        self.alpha = smooth_alpha
+        self.delta = smooth_delta
+        self.iterations = magnitude
+        self.hole_radius = 0 if hole_fill == 0 else (1 << 16 if hole_fill >= 5 else 1 << hole_fill)
+        self.threads = threads
+        self.halo = halo
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.input = None
+        # Compile now rather than on the first live frame
+        self.process(np.zeros((4, 4), np.uint16), 1.0)
+
+    @classmethod
+    def from_device(cls, device, **kwargs):
+        baseline_mm = device.first_depth_sensor().get_option(rs.option.stereo_baseline)
+        return cls(baseline_mm, **kwargs)
+
+    def process(self, depth, factor, out=None):
+        # depth is a (H, W) uint16 image, out may be depth itself
+        height = depth.shape[0]
+        if out is None:
+            out = np.empty_like(depth)
+        if self.input is None or self.input.shape != depth.shape:
+            self.input = np.empty_like(depth)
+        # the bands read their halo from the input while the others write their rows
+        np.copyto(self.input, depth)
+        band = -(-height // self.threads)
+        tasks = [self.executor.submit(_filter_rows, self.input, out, first, min(first + band, height), self.halo,
+                                      factor, self.alpha, self.delta, self.iterations, self.hole_radius)
+                 for first in range(0, height, band)]
+        for task in tasks:
+            task.result()
+        return out
+
+    def process_frame(self, depth_frame):
+        # Filters a librealsense depth frame in place and returns it, in place of
+        # the depth to disparity -> spatial -> disparity to depth filters
+        depth_frame = depth_frame.as_depth_frame()
+        focal_px = depth_frame.profile.as_video_stream_profile().get_intrinsics().fx
+        factor = disparity_factor(self.baseline_mm, focal_px, depth_frame.get_units())
+        depth = np.asanyarray(depth_frame.get_data())
+        self.process(depth, factor, out=depth)
+        return depth_frame
+
+    def close(self):
+        self.executor.shutdown()
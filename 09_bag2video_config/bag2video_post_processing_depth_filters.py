@@ -1,6 +1,9 @@
 """
 Load a recorded .bag streams, and save 
 the depth stream as a video file.
+
+--start/--end/--stride convert a part of the recording, seeking over
+what is not kept (see bag_range.py).
 """
 
 
@@ -10,6 +13,7 @@ import cv2
 import os
 import json
 import argparse
+from bag_range import PlaybackRange, Progress
 
 
 def get_parser():
@@ -25,6 +29,12 @@ def get_parser():
     parser.add_argument(
         '--visual_preset', default="High Accuracy", type=str, 
         choices=["Custom", "Default", "Hand", "High Accuracy", "High Density"])
+    parser.add_argument(
+        '--start', default=0.0, type=float, help="Start of the extract, seconds from the beginning of the recording")
+    parser.add_argument(
+        '--end', default=0.0, type=float, help="End of the extract in seconds, 0 for the end of the recording")
+    parser.add_argument(
+        '--stride', default=0.0, type=float, help="Keep one frame every this many seconds, 0 for every frame")
 
     return parser
 
@@ -43,6 +53,9 @@ def get_args(parser):
         print("The given file is not of correct file format.")
         print("Only .bag files are accepted")
         exit()
+    if args.start < 0 or args.stride < 0 or (args.end and args.end <= args.start):
+        print("The extract needs 0 <= start < end and a positive stride")
+        exit()
     return args
 
 
@@ -80,11 +93,11 @@ def main(args):
     profile = pipeline.start(config)
     device = profile.get_device()
 
-    # Playback is used to find duration of recorded video
+    # Playback is used to seek in the recorded video
     playback = device.as_playback()
     playback.set_real_time(False)
-    # duration in nano seconds
-    duration = playback.get_duration().total_seconds() * 1e9
+    extract = PlaybackRange(pipeline, playback, args.start, args.end, args.stride)
+    progress = Progress(extract)
 
     # Load advanced controls settings
     # advnc_mode = rs.rs400_advanced_mode(device)
@@ -140,10 +153,7 @@ def main(args):
 
 
         # Streaming loop
-        while True:
-            # Get frameset
-            frames = pipeline.wait_for_frames()
-            curr_pos = playback.get_position()
+        for frames in extract:
             
             # DEPTH
             depth_frame = frames.get_depth_frame()
@@ -169,14 +179,13 @@ def main(args):
             # Render image in opencv window
             cv2.imshow('Depth', depth_color_image)
 
-            print("Progress:", f"{curr_pos}/{duration}")
-            if curr_pos >= duration:
-                print("End of recording reached")
-                break
+            progress.update()
 
             # if pressed escape exit program
             if cv2.waitKey(1) in [27, ord("q")]:
                 break
+        progress.update(force=True)
+        print("End of the extract reached")
     finally:
         cv2.destroyAllWindows()
         depthwriter.release()
@@ -1,6 +1,13 @@
 """
 Load a recorded .bag streams, and save 
 the depth stream as a video file.
+
+Conversions are recorded in a manifest (see conversion_cache.py):
+bags already converted with the same settings are skipped, and
+interrupted conversions resume after their last written segment.
+
+--start/--end/--stride convert a part of each bag, seeking over what
+is not kept (see bag_range.py).
 """
 
 
@@ -9,7 +16,24 @@ import numpy as np
 import cv2
 import os
 import json
+import shutil
 import argparse
+import subprocess
+from conversion_cache import ConversionCache, bag_fingerprint, conversion_key
+from bag_range import PlaybackRange, Progress
+from soak_monitor import SoakMonitor
+
+
+# POST PROCESSING FILTERS and COLORMAPS settings, part of the cache key
+FILTERS = {
+    "decimation": {"magnitude": 1},
+    "threshold": {"min_dist": 0, "max_dist": 5.2},
+    "spatial": {"smooth_alpha": 0.5, "smooth_delta": 20, "magnitude": 2, "hole_fill": 2},
+    "temporal": {"smooth_alpha": 0.4, "smooth_delta": 20, "persistence_control": 3},
+}
+COLORIZER = {"color_scheme": 0, "min_distance": 0, "max_distance": 6, "histogram_equalization_enabled": True}
+# Frames filtered before the resume point, so the temporal filter has its history back
+PREROLL = 1.0
 
 
 def get_parser():
@@ -20,6 +44,30 @@ def get_parser():
         '--format', '-f', default='mp4', type=str, choices=['mp4', 'avi'])
     parser.add_argument(
         '--json', '-j', default='../config.json', type=str, help="Path to the json config file")
+    parser.add_argument(
+        '--output', '-o', default='.', type=str, help="Folder of the videos and of the conversion manifest")
+    parser.add_argument(
+        '--segment_frames', default=900, type=int, help="Frames per segment, the unit of resumption")
+    parser.add_argument(
+        '--start', default=0.0, type=float, help="Start of the extract, seconds from the beginning of each bag")
+    parser.add_argument(
+        '--end', default=0.0, type=float, help="End of the extract in seconds, 0 for the end of the bag")
+    parser.add_argument(
+        '--stride', default=0.0, type=float, help="Keep one frame every this many seconds, 0 for every frame")
+    parser.add_argument(
+        '--force', action='store_true', help="Convert every bag again, ignoring the manifest")
+    parser.add_argument(
+        '--dry_run', action='store_true', help="Only report what would be converted and why")
+    parser.add_argument(
+        '--soak', default=0, type=int, help="Soak mode: sample memory, files and threads every this many frames, 0 to disable")
+    parser.add_argument(
+        '--soak_passes', default=1, type=int, help="Convert the folder this many times, every bag again each time")
+    parser.add_argument(
+        '--soak_warmup', default=1000, type=int, help="Frames before the baseline sample of the soak")
+    parser.add_argument(
+        '--soak_max_rss', default=100.0, type=float, help="Fail the soak when the resident memory grows by this many MB")
+    parser.add_argument(
+        '--soak_max_files', default=8, type=int, help="Fail the soak when this many more files are open")
     # parser.add_argument(
     #     '--visual_preset', default="High Accuracy", type=str, 
     #     choices=["Custom", "Default", "Hand", "High Accuracy", "High Density"])
@@ -36,9 +84,199 @@ def get_args(parser):
         print("No path paramater have been given.")
         print("For help type --help")
         exit()
+    if args.start < 0 or args.stride < 0 or (args.end and args.end <= args.start):
+        print("The extract needs 0 <= start < end and a positive stride")
+        exit()
     return args
 
 
+def join_segments(paths, output_path):
+    # Segments are joined without re-encoding when ffmpeg is available,
+    # else they are the output
+    if not paths:
+        return []
+    if len(paths) == 1:
+        os.replace(paths[0], output_path)
+        return [output_path]
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found, the output stays in", len(paths), "segments")
+        return paths
+    list_path = output_path + ".txt"
+    with open(list_path, 'w') as f:
+        for path in paths:
+            f.write("file '{}'\n".format(os.path.abspath(path)))
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+                    "-c", "copy", output_path], check=True)
+    os.remove(list_path)
+    for path in paths:
+        os.remove(path)
+    return [output_path]
+
+
+def convert(bag_path, output_name, key, cache, args, width, height, FPS, fourcc, soak=None):
+    entry = cache.entries[key]
+    segments = entry["segments"]
+
+    # Create pipeline
+    pipeline = rs.pipeline()
+    # Create a config object
+    config = rs.config()
+    # Tell config that we will use a recorded device from file to be used by the pipeline through playback.
+    config.enable_device_from_file(bag_path, repeat_playback=False)
+    # Configure the pipeline to stream the depth stream
+    # REMEMBER that width, height and FPS should be the same of the recorded stream
+    config.enable_stream(rs.stream.depth, width, height, rs.format.z16, FPS)
+
+    # Start streaming from file
+    profile = pipeline.start(config)
+    device = profile.get_device()
+
+    # Playback is used to seek in the recorded video
+    playback = device.as_playback()
+    playback.set_real_time(False)
+
+    # Load advanced controls settings
+    # advnc_mode = rs.rs400_advanced_mode(device)
+    # advnc_mode.load_json(json_string)
+
+    # DEPTH SENSOR CONFIGURATION
+    # these are the stereo module main parameters
+    depth_sensor = device.first_depth_sensor()
+
+    # # set visual preset -- 0=Custom, 1=Default, 2=Hand, 3=High Accuracy, 4=High Density
+    # preset_range = depth_sensor.get_option_range(rs.option.visual_preset)
+    # for i in range(int(preset_range.max)):
+    #     visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, i)
+    #     if visual_preset == args.visual_preset:
+    #         depth_sensor.set_option(rs.option.visual_preset, i)
+
+    # current_preset = depth_sensor.get_option(rs.option.visual_preset)
+    # current_visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, current_preset)
+    # print("Depth visual preset:", current_visual_preset)
+
+    # depth_sensor.set_option(rs.option.enable_auto_exposure, True)
+    # depth_sensor.set_option(rs.option.emitter_enabled, 1)  # 1=Laser is the default
+    # depth_sensor.set_option(rs.option.hdr_enabled, True)  # DO NOT USE, it makes the image flash
+
+    # Resume after the last committed segment, from the pre-roll on the same stride
+    last_timestamp = None
+    start = args.start
+    if segments:
+        last_timestamp = segments[-1]["last_timestamp"]
+        resume = segments[-1]["end_position"] / 1e9
+        print("Resuming after segment", len(segments), "at", resume, "s")
+        if args.stride > 0:
+            start += max((resume - PREROLL - start) // args.stride, 0) * args.stride
+        else:
+            start = max(resume - PREROLL, start)
+    extract = PlaybackRange(pipeline, playback, start, args.end, args.stride)
+    progress = Progress(extract)
+
+    depthwriter = None
+    segment_path = None
+    segment_frames = 0
+    timestamp = position = None
+    try:
+        # COLORMAPS
+        # these are the depth visualization parameters
+        colorizer = rs.colorizer()
+        colorizer.set_option(rs.option.color_scheme, COLORIZER["color_scheme"])  # 0 is Jet
+        # colorizer.set_option(rs.option.visual_preset, 1)  # 0=Dynamic, 1=Fixed, 2=Near, 3=Far
+        colorizer.set_option(rs.option.min_distance, COLORIZER["min_distance"])
+        colorizer.set_option(rs.option.max_distance, COLORIZER["max_distance"])
+        colorizer.set_option(rs.option.histogram_equalization_enabled, COLORIZER["histogram_equalization_enabled"])
+
+        # POST PROCESSING FILTERS
+        decimation_filter = rs.decimation_filter(**FILTERS["decimation"])  # Performs downsampling by using the median with specific kernel size
+        threshold_filter = rs.threshold_filter(**FILTERS["threshold"])  # filter out depth values that are either too large or too small, as a software post-processing step
+        depth_to_disparity_filter = rs.disparity_transform(transform_to_disparity=True)  # Converts from depth representation to disparity representation and vice
+        spatial_filter = rs.spatial_filter(**FILTERS["spatial"])
+        # Spatial filter smooths the image by calculating frame with 
+        # alpha and delta settings. Alpha defines the weight of the current 
+        # pixel for smoothing, and is bounded within [25..100]%. Delta 
+        # defines the depth gradient below which the smoothing will occur 
+        # as number of depth levels.
+        temporal_filter = rs.temporal_filter(**FILTERS["temporal"])  # persistence_control=3 - Valid in 2 / last 4 - Activated if the pixel was valid in two out of the last 4 frames
+        # Temporal filter smooths the image by calculating multiple frames 
+        # with alpha and delta settings. Alpha defines the weight of 
+        # current frame, and delta defines thethreshold for edge 
+        # classification and preserving.
+        disparity_to_depth_filter = rs.disparity_transform(transform_to_disparity=False)  # Converts from depth representation to disparity representation and vice
+
+
+        # Streaming loop
+        for frames in extract:
+            position = extract.last_position * 1e9
+            
+            # DEPTH
+            depth_frame = frames.get_depth_frame()
+            if not depth_frame:
+                print("No depth_frame")
+                continue
+            timestamp = depth_frame.get_timestamp()
+            
+            # Apply filters to the depth channel
+            filtered_depth = depth_frame
+            filtered_depth = decimation_filter.process(filtered_depth)
+            filtered_depth = threshold_filter.process(filtered_depth)
+            filtered_depth = depth_to_disparity_filter.process(filtered_depth)
+            filtered_depth = spatial_filter.process(filtered_depth)
+            filtered_depth = temporal_filter.process(filtered_depth)
+            filtered_depth = disparity_to_depth_filter.process(filtered_depth)
+            if last_timestamp is not None and timestamp <= last_timestamp:
+                # pre-roll, already in a committed segment
+                continue
+
+            # Colorize depth frame to jet colormap
+            depth_color_frame = colorizer.colorize(filtered_depth)
+            # Convert depth_frame to numpy array to render image in opencv
+            depth_color_image = np.asanyarray(depth_color_frame.get_data())
+            # Save to disk, one segment after the other
+            if depthwriter is None:
+                segment_path = os.path.join(args.output, "{}_depth.part{:03d}.{}".format(
+                    output_name, len(segments), args.format))
+                depthwriter = cv2.VideoWriter(segment_path, fourcc, FPS, (width, height), 1)
+            depthwriter.write(depth_color_image)
+            segment_frames += 1
+            if segment_frames == args.segment_frames:
+                depthwriter.release()
+                depthwriter = None
+                cache.commit_segment(key, segment_path, segment_frames, timestamp, position)
+                segment_frames = 0
+            # Render image in opencv window
+            cv2.imshow('Depth', depth_color_image)
+
+            progress.update()
+            if soak is not None:
+                soak.track(frames, depth_frame, filtered_depth, depth_color_frame)
+                soak.step()
+
+            # if pressed escape exit program
+            if cv2.waitKey(1) in [27, ord("q")]:
+                # the segment being written is not committed, it is redone next time
+                return False
+        progress.update(force=True)
+        print("End of the extract reached")
+        if depthwriter is not None:
+            depthwriter.release()
+            depthwriter = None
+            cache.commit_segment(key, segment_path, segment_frames, timestamp, position)
+        if not segments:
+            # nothing to join, the extract had no frames
+            print("No frames in the extract, no output")
+            cache.complete(key, [], empty=True)
+            return True
+        outputs = join_segments([segment["path"] for segment in segments],
+                                os.path.join(args.output, output_name + '_depth.' + args.format))
+        cache.complete(key, outputs)
+        return True
+    finally:
+        cv2.destroyAllWindows()
+        if depthwriter is not None:
+            depthwriter.release()
+        pipeline.stop()
+
+
 def main(args):
     
     # json config
@@ -51,11 +289,41 @@ def main(args):
 
     # set output video encoding
     if args.format == 'mp4':
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        fourcc_code = 'mp4v'
     elif args.format == 'avi':
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    
-    for filename in os.listdir(args.path):
+        fourcc_code = 'XVID'
+    fourcc = cv2.VideoWriter_fourcc(*fourcc_code)
+
+    # everything that changes the videos, a change converts the bags again
+    settings = {
+        "filters": FILTERS,
+        "colorizer": COLORIZER,
+        "encoder": {"format": args.format, "fourcc": fourcc_code, "width": width, "height": height, "fps": FPS},
+        "range": {"start": args.start, "end": args.end, "stride": args.stride},
+    }
+    os.makedirs(args.output, exist_ok=True)
+    cache = ConversionCache(os.path.join(args.output, "conversion_manifest.json"))
+
+    # SOAK
+    # leak tracking over many frames and files, fails when the process keeps growing
+    soak = None
+    if args.soak > 0:
+        soak = SoakMonitor(args.soak, args.soak_warmup, max_rss=args.soak_max_rss, max_files=args.soak_max_files,
+                           log_path=os.path.join(args.output, "soak.csv"))
+    try:
+        for soak_pass in range(max(args.soak_passes, 1)):
+            if args.soak_passes > 1:
+                print("Pass", soak_pass + 1, "of", args.soak_passes)
+            if not convert_folder(args, cache, settings, width, height, FPS, fourcc, soak, force=args.force or soak_pass > 0):
+                break
+    finally:
+        if soak is not None:
+            soak.close()
+
+
+def convert_folder(args, cache, settings, width, height, FPS, fourcc, soak, force):
+    # False when interrupted
+    for filename in sorted(os.listdir(args.path)):
         
         output_name = os.path.splitext(filename)[0]
         # Check if the file has bag extension
@@ -63,128 +331,26 @@ def main(args):
             print("The given file is not of correct file format.")
             print("Only .bag files are accepted")
             exit()
-        
-        # set output video names
-        depth_path = output_name + '_depth.' + args.format
-        # set output video writers
-        depthwriter = cv2.VideoWriter(depth_path, fourcc, FPS, (width, height), 1)
-
-        # Create pipeline
-        pipeline = rs.pipeline()
-        # Create a config object
-        config = rs.config()
-        # Tell config that we will use a recorded device from file to be used by the pipeline through playback.
-        config.enable_device_from_file(os.path.join(args.path, filename), repeat_playback=False)
-        # Configure the pipeline to stream the depth stream
-        # REMEMBER that width, height and FPS should be the same of the recorded stream
-        config.enable_stream(rs.stream.depth, width, height, rs.format.z16, FPS)
-
-        # Start streaming from file
-        profile = pipeline.start(config)
-        device = profile.get_device()
-
-        # Playback is used to find duration of recorded video
-        playback = device.as_playback()
-        playback.set_real_time(False)
-        # duration in nano seconds
-        duration = playback.get_duration().total_seconds() * 1e9
-
-        # Load advanced controls settings
-        # advnc_mode = rs.rs400_advanced_mode(device)
-        # advnc_mode.load_json(json_string)
-
-        # DEPTH SENSOR CONFIGURATION
-        # these are the stereo module main parameters
-        depth_sensor = device.first_depth_sensor()
-
-        # # set visual preset -- 0=Custom, 1=Default, 2=Hand, 3=High Accuracy, 4=High Density
-        # preset_range = depth_sensor.get_option_range(rs.option.visual_preset)
-        # for i in range(int(preset_range.max)):
-        #     visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, i)
-        #     if visual_preset == args.visual_preset:
-        #         depth_sensor.set_option(rs.option.visual_preset, i)
-
-        # current_preset = depth_sensor.get_option(rs.option.visual_preset)
-        # current_visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, current_preset)
-        # print("Depth visual preset:", current_visual_preset)
-
-        # depth_sensor.set_option(rs.option.enable_auto_exposure, True)
-        # depth_sensor.set_option(rs.option.emitter_enabled, 1)  # 1=Laser is the default
-        # depth_sensor.set_option(rs.option.hdr_enabled, True)  # DO NOT USE, it makes the image flash
-
-        try:
-            # COLORMAPS
-            # these are the depth visualization parameters
-            colorizer = rs.colorizer()
-            colorizer.set_option(rs.option.color_scheme, 0)  # 0 is Jet
-            # colorizer.set_option(rs.option.visual_preset, 1)  # 0=Dynamic, 1=Fixed, 2=Near, 3=Far
-            value_min = 0
-            value_max = 6
-            colorizer.set_option(rs.option.min_distance, value_min)
-            colorizer.set_option(rs.option.max_distance, value_max)
-            colorizer.set_option(rs.option.histogram_equalization_enabled, True)
-
-            # POST PROCESSING FILTERS
-            decimation_filter = rs.decimation_filter(magnitude=1)  # Performs downsampling by using the median with specific kernel size
-            threshold_filter = rs.threshold_filter(min_dist=0, max_dist=5.2)  # filter out depth values that are either too large or too small, as a software post-processing step
-            depth_to_disparity_filter = rs.disparity_transform(transform_to_disparity=True)  # Converts from depth representation to disparity representation and vice
-            spatial_filter = rs.spatial_filter(smooth_alpha=0.5, smooth_delta=20, magnitude=2, hole_fill=2)
-            # Spatial filter smooths the image by calculating frame with 
-            # alpha and delta settings. Alpha defines the weight of the current 
-            # pixel for smoothing, and is bounded within [25..100]%. Delta 
-            # defines the depth gradient below which the smoothing will occur 
-            # as number of depth levels.
-            temporal_filter = rs.temporal_filter(smooth_alpha=0.4, smooth_delta=20, persistence_control=3)  # persistence_control=3 - Valid in 2 / last 4 - Activated if the pixel was valid in two out of the last 4 frames
-            # Temporal filter smooths the image by calculating multiple frames 
-            # with alpha and delta settings. Alpha defines the weight of 
-            # current frame, and delta defines thethreshold for edge 
-            # classification and preserving.
-            disparity_to_depth_filter = rs.disparity_transform(transform_to_disparity=False)  # Converts from depth representation to disparity representation and vice
-
-
-            # Streaming loop
-            while True:
-                # Get frameset
-                frames = pipeline.wait_for_frames()
-                curr_pos = playback.get_position()
-                
-                # DEPTH
-                depth_frame = frames.get_depth_frame()
-                if not depth_frame:
-                    print("No depth_frame")
-                    continue
-                
-                # Apply filters to the depth channel
-                filtered_depth = depth_frame
-                filtered_depth = decimation_filter.process(filtered_depth)
-                filtered_depth = threshold_filter.process(filtered_depth)
-                filtered_depth = depth_to_disparity_filter.process(filtered_depth)
-                filtered_depth = spatial_filter.process(filtered_depth)
-                filtered_depth = temporal_filter.process(filtered_depth)
-                filtered_depth = disparity_to_depth_filter.process(filtered_depth)
-
-                # Colorize depth frame to jet colormap
-                depth_color_frame = colorizer.colorize(filtered_depth)
-                # Convert depth_frame to numpy array to render image in opencv
-                depth_color_image = np.asanyarray(depth_color_frame.get_data())
-                # Save to disk
-                depthwriter.write(depth_color_image)
-                # Render image in opencv window
-                cv2.imshow('Depth', depth_color_image)
-
-                print("Progress:", f"{curr_pos}/{duration}")
-                if curr_pos >= duration:
-                    print("End of recording reached")
-                    break
-
-                # if pressed escape exit program
-                if cv2.waitKey(1) in [27, ord("q")]:
-                    break
-        finally:
-            cv2.destroyAllWindows()
-            depthwriter.release()
-            pipeline.stop()
-            print(filename + " done!")
+
+        bag_path = os.path.join(args.path, filename)
+        fingerprint = bag_fingerprint(bag_path)
+        key = conversion_key(fingerprint, settings)
+        reason = "forced" if force else cache.reason(key, output_name, fingerprint, settings)
+        if args.dry_run:
+            print("{:<40} {}".format(filename, reason))
+            continue
+        if reason == "up to date":
+            print(filename + " up to date, skipped")
+            continue
+
+        print(filename + ":", reason)
+        cache.begin(key, bag_path, output_name, fingerprint, settings, force=force,
+                    overwritten=[os.path.join(args.output, output_name + '_depth.' + args.format)])
+        if not convert(bag_path, output_name, key, cache, args, width, height, FPS, fourcc, soak):
+            print(filename + " interrupted")
+            return False
+        print(filename + " done!")
+    return True
 
 
 if __name__ == '__main__':
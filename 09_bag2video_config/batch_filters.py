@@ -0,0 +1,337 @@
+"""
+NumPy implementation of the librealsense post-processing chain
+(decimation, threshold, disparity, spatial, temporal) for offline
+conversion. Every filter works on (T, H, W) stacks of frames, e.g.
+slices of a memory-mapped recording, instead of one frame at a time.
+
+The algorithms follow the librealsense sources so that the results
+match rs.*_filter; see check_batch_filters.py for the comparison.
+
+The converters do not use it: on one core it is two to four times
+slower than librealsense (check_batch_filters.py prints both rates),
+the recursive spatial filter being a loop over the columns and rows.
+It is kept as the readable and checked reference of what the
+librealsense chain does, and for stacks of depth frames that are not
+rs.frame objects (memory-mapped raw depth, .rvl files), which the
+librealsense filters cannot take.
+"""
+
+
+import numpy as np
+
+
+def disparity_factor(baseline_mm, focal_px, depth_units):
+    # Same constant as rs.disparity_transform: disparity keeps 5 fractional bits
+    return baseline_mm * 0.001 * focal_px * 32 / depth_units
+
+
+def _reuse(buffer, shape, dtype):
+    # Working buffer of at least shape[0] frames of shape[1:], kept while it is big
+    # enough, the caller slices it to the batch
+    if buffer is None or buffer.dtype != dtype or buffer.shape[1:] != tuple(shape[1:]) or len(buffer) < shape[0]:
+        return np.empty(shape, dtype)
+    return buffer
+
+
+class DecimationFilter:
+    def __init__(self, magnitude=2):
+        self.magnitude = magnitude
+        # working buffers reused between batches
+        self.patches = None
+        self.nonzero = None
+        self.valid = None
+        self.index = None
+        self.selected = None
+        self.total = None
+
+    def process(self, depth, out=None):
+        # Median of the valid (non-zero) pixels of each patch for magnitude 2-3,
+        # their mean for larger patches. The output crops to whole patches.
+        m = self.magnitude
+        if m == 1:
+            return depth
+        frames, height, width = depth.shape
+        shape = (frames, height // m, width // m)
+        if out is None:
+            out = np.empty(shape, depth.dtype)
+        self.patches = _reuse(self.patches, shape + (m * m,), depth.dtype)
+        patches = self.patches[:frames]
+        tiles = depth[:, :height // m * m, :width // m * m].reshape(frames, height // m, m, width // m, m)
+        np.copyto(patches.reshape(shape + (m, m)), tiles.transpose(0, 1, 3, 2, 4))
+        self.nonzero = _reuse(self.nonzero, patches.shape, bool)
+        self.valid = _reuse(self.valid, shape, np.uint32)
+        valid = np.sum(np.not_equal(patches, 0, out=self.nonzero[:frames]), axis=-1, out=self.valid[:frames])
+        if m <= 3:
+            # zeros sort first, the upper median of the valid values follows them; a patch
+            # without valid pixels is all zeros
+            patches.sort(axis=-1)
+            self.index = _reuse(self.index, shape, np.uint32)
+            index = np.floor_divide(valid, 2, out=self.index[:frames])
+            index += m * m
+            index -= valid
+            np.minimum(index, m * m - 1, out=index)
+            self.selected = _reuse(self.selected, shape, bool)
+            selected = self.selected[:frames]
+            for k in range(m * m // 2, m * m):
+                np.copyto(out, patches[..., k], where=np.equal(index, k, out=selected))
+        else:
+            self.total = _reuse(self.total, shape, np.uint32)
+            total = np.sum(patches, axis=-1, dtype=np.uint32, out=self.total[:frames])
+            # sum 0 over 0 valid pixels stays 0
+            np.floor_divide(total, np.maximum(valid, 1, out=valid), out=total)
+            np.copyto(out, total, casting="unsafe")
+        return out
+
+
+class ThresholdFilter:
+    def __init__(self, min_dist=0.15, max_dist=4.0, depth_units=0.001):
+        self.min_value = min_dist / depth_units
+        self.max_value = max_dist / depth_units
+
+    def process(self, depth):
+        # In place: depth values outside [min_dist, max_dist] become invalid
+        depth[(depth < self.min_value) | (depth > self.max_value)] = 0
+        return depth
+
+
+class DisparityTransform:
+    def __init__(self, transform_to_disparity=True, factor=None):
+        if factor is None:
+            raise ValueError("The disparity factor is needed, see disparity_factor()")
+        self.transform_to_disparity = transform_to_disparity
+        self.factor = np.float32(factor)
+        # working buffers reused between batches
+        self.valid = None
+        self.converted = None
+
+    def process(self, frames, out=None):
+        # depth (uint16) <-> disparity (float32), zero stays zero in both directions
+        self.valid = _reuse(self.valid, frames.shape, bool)
+        valid = np.not_equal(frames, 0, out=self.valid[:len(frames)])
+        if self.transform_to_disparity:
+            if out is None:
+                out = np.zeros(frames.shape, np.float32)
+            else:
+                out.fill(0)
+            np.divide(self.factor, frames, out=out, where=valid)
+            return out
+        if out is None:
+            out = np.empty(frames.shape, np.uint16)
+        self.converted = _reuse(self.converted, frames.shape, np.float32)
+        converted = self.converted[:len(frames)]
+        converted.fill(0)
+        np.divide(self.factor, frames, where=valid, out=converted)
+        # rounded, and the invalid pixels, 0.5, truncate to 0
+        converted += np.float32(0.5)
+        np.copyto(out, converted, casting="unsafe")
+        return out
+
+
+class SpatialFilter:
+    def __init__(self, smooth_alpha=0.5, smooth_delta=20, magnitude=2, hole_fill=0):
+        self.alpha = np.float32(smooth_alpha)
+        self.delta = np.float32(smooth_delta)
+        self.iterations = magnitude
+        self.hole_fill = hole_fill
+
+    def process(self, disparity):
+        # In place on a (T, H, W) float32 disparity stack
+        for _ in range(self.iterations):
+            self._horizontal(disparity)
+            self._vertical(disparity)
+        if self.hole_fill:
+            self._fill_holes(disparity)
+        return disparity
+
+    def _horizontal(self, image):
+        # Recursive edge-preserving filter along the rows, left to right then right to left.
+        # The recursion runs over the columns, vectorized over all the rows of all the frames.
+        frames, height, width = image.shape
+        alpha, delta = self.alpha, self.delta
+        rows = np.empty((width, frames * height), np.float32)
+        rows[...] = image.reshape(frames * height, width).T
+
+        state = np.empty(frames * height, np.float32)
+        previous = np.empty_like(state)
+        innovation = np.empty_like(state)
+        filtered = np.empty_like(state)
+        scratch = np.empty_like(state)
+        small = np.empty(frames * height, bool)
+        previous_valid = np.empty_like(small)
+        valid = np.empty_like(small)
+
+        for first, order in ((0, range(1, width)), (width - 1, range(width - 2, -1, -1))):
+            np.copyto(state, rows[first])
+            np.copyto(previous, rows[first])
+            np.greater(previous, 0, out=previous_valid)
+            for u in order:
+                column = rows[u]
+                np.copyto(innovation, column)
+                np.greater(innovation, 0, out=valid)
+                # smoothing only when this and the previous input pixel are valid and close
+                np.subtract(previous, innovation, out=scratch)
+                np.abs(scratch, out=scratch)
+                np.less(scratch, delta, out=small)
+                small &= valid
+                small &= previous_valid
+                np.multiply(innovation, alpha, out=filtered)
+                np.multiply(state, 1 - alpha, out=scratch)
+                filtered += scratch
+                np.copyto(column, filtered, where=small)
+                # the state follows the output of every valid pixel
+                np.copyto(state, column, where=valid)
+                previous, innovation = innovation, previous
+                previous_valid, valid = valid, previous_valid
+
+        image.reshape(frames * height, width)[...] = rows.T
+
+    def _vertical(self, image):
+        # Recursive filter along the columns, top to bottom then bottom to top.
+        # librealsense does not check validity here, only the difference.
+        height = image.shape[1]
+        alpha, delta = self.alpha, self.delta
+        scratch = np.empty_like(image[:, 0])
+        filtered = np.empty_like(scratch)
+        small = np.empty(scratch.shape, bool)
+        for v in range(1, height):
+            above, current = image[:, v - 1], image[:, v]
+            np.subtract(above, current, out=scratch)
+            np.abs(scratch, out=scratch)
+            np.less(scratch, delta, out=small)
+            np.multiply(current, alpha, out=filtered)
+            np.multiply(above, 1 - alpha, out=scratch)
+            filtered += scratch
+            np.copyto(current, filtered, where=small)
+        for v in range(height - 2, -1, -1):
+            current, below = image[:, v], image[:, v + 1]
+            np.subtract(current, below, out=scratch)
+            np.abs(scratch, out=scratch)
+            np.less(scratch, delta, out=small)
+            np.multiply(current, alpha, out=filtered)
+            np.multiply(below, 1 - alpha, out=scratch)
+            filtered += scratch
+            np.copyto(current, filtered, where=small)
+
+    def _fill_holes(self, image):
+        # Each run of empty pixels copies the value on its left, up to the radius
+        width = image.shape[-1]
+        radius = width if self.hole_fill >= 5 else 1 << self.hole_fill
+        empty = image == 0
+        columns = np.arange(width)
+        last_valid = np.where(empty, -1, columns)
+        np.maximum.accumulate(last_valid, axis=-1, out=last_valid)
+        fill = empty & (last_valid >= 0) & (columns - last_valid < radius)
+        source = np.take_along_axis(image, np.maximum(last_valid, 0), axis=-1)
+        np.copyto(image, source, where=fill)
+
+
+class TemporalFilter:
+    def __init__(self, smooth_alpha=0.4, smooth_delta=20, persistence_control=3):
+        self.alpha = np.float32(smooth_alpha)
+        self.delta = np.float32(smooth_delta)
+        self.persistence_map = self._persistence_map(persistence_control)
+        # State carried from one batch to the next
+        self.last_frame = None
+        self.history = None
+        self.index = 0
+
+    @staticmethod
+    def _persistence_map(persistence_control):
+        # For each 8-frame validity history and current position in the circular
+        # history, whether a missing pixel may be filled with the last value
+        rules = {
+            1: lambda bits: sum(bits) >= 8,    # valid in eight of the last eight frames
+            2: lambda bits: sum(bits[:3]) >= 2,  # valid in two of the last three frames
+            3: lambda bits: sum(bits[:4]) >= 2,  # valid in two of the last four frames
+            4: lambda bits: sum(bits) >= 2,    # valid in two of the last eight frames
+            5: lambda bits: sum(bits[:2]) >= 1,  # valid in one of the last two frames
+            6: lambda bits: sum(bits[:5]) >= 1,  # one of the last five, "1/last 4" in the option description
+            7: lambda bits: sum(bits) >= 1,    # valid in one of the last eight frames
+            8: lambda bits: True,              # always
+        }
+        rule = rules.get(persistence_control, lambda bits: False)
+        table = np.zeros((8, 256), bool)
+        for index in range(8):
+            for history in range(256):
+                # newest first, starting from the previous frame
+                bits = [(history >> ((index - 1 - k) % 8)) & 1 for k in range(8)]
+                table[index, history] = rule(bits)
+        return table
+
+    def reset(self):
+        self.last_frame = None
+        self.history = None
+        self.index = 0
+
+    def process(self, frames):
+        # In place on a (T, H, W) float32 stack, frames in time order
+        if self.last_frame is None or self.last_frame.shape != frames.shape[1:]:
+            self.last_frame = np.zeros(frames.shape[1:], frames.dtype)
+            self.history = np.zeros(frames.shape[1:], np.uint8)
+            self.index = 0
+        last, history = self.last_frame, self.history
+        for frame in frames:
+            mask = np.uint8(1 << self.index)
+            current_valid = frame != 0
+            last_valid = last != 0
+
+            # new and old value agree: smooth, and remember the pixel was valid
+            agree = current_valid & last_valid & (np.abs(frame - last) < self.delta)
+            smoothed = frame * self.alpha + last * (1 - self.alpha)
+            np.copyto(frame, smoothed, where=agree)
+            # any new value becomes the last one, history restarts unless they agree
+            np.copyto(last, frame, where=current_valid)
+            restart = current_valid & ~agree
+            history[restart] = mask
+            history[agree] |= mask
+
+            # no new value: use the last one if it has been valid often enough lately
+            missing = ~current_valid
+            persistent = self.persistence_map[self.index][history]
+            np.copyto(frame, last, where=missing & last_valid & persistent)
+            history[missing] &= ~mask
+
+            self.index = (self.index + 1) % 8
+        return frames
+
+
+class FilterChain:
+    # decimation -> threshold -> depth to disparity -> spatial -> temporal -> disparity to depth,
+    # the chain of the 09 converters, with its working buffers reused between batches: they
+    # are sized by the largest batch and a shorter one, the last of a recording, uses their start
+    def __init__(self, factor, depth_units=0.001, decimation=1, min_dist=0, max_dist=5.2,
+                 spatial=None, temporal=None):
+        self.decimation = DecimationFilter(decimation)
+        self.threshold = ThresholdFilter(min_dist, max_dist, depth_units)
+        self.to_disparity = DisparityTransform(True, factor)
+        self.to_depth = DisparityTransform(False, factor)
+        self.spatial = spatial
+        self.temporal = temporal
+        self.depth_buffer = None
+        self.disparity_buffer = None
+        self.out_buffer = None
+
+    def _buffers(self, shape):
+        self.depth_buffer = _reuse(self.depth_buffer, shape, np.uint16)
+        self.disparity_buffer = _reuse(self.disparity_buffer, shape, np.float32)
+        self.out_buffer = _reuse(self.out_buffer, shape, np.uint16)
+        frames = shape[0]
+        return self.depth_buffer[:frames], self.disparity_buffer[:frames], self.out_buffer[:frames]
+
+    def process(self, depth):
+        # depth is a (T, H, W) uint16 stack, left untouched. The result is
+        # a view of an internal buffer, overwritten by the next call.
+        frames, height, width = depth.shape
+        m = self.decimation.magnitude
+        depth_buffer, disparity, out = self._buffers((frames, height // m, width // m))
+        if m == 1:
+            np.copyto(depth_buffer, depth)
+        else:
+            self.decimation.process(depth, out=depth_buffer)
+        self.threshold.process(depth_buffer)
+        self.to_disparity.process(depth_buffer, out=disparity)
+        if self.spatial is not None:
+            self.spatial.process(disparity)
+        if self.temporal is not None:
+            self.temporal.process(disparity)
+        return self.to_depth.process(disparity, out=out)
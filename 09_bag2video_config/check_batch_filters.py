@@ -0,0 +1,148 @@
+"""
+Compare the NumPy filter chain of batch_filters.py with the
+librealsense filters on the depth frames of a recorded .bag, and
+measure the throughput of both.
+"""
+
+
+import pyrealsense2 as rs
+import numpy as np
+import time
+import os
+import argparse
+from batch_filters import ThresholdFilter, DisparityTransform, SpatialFilter, TemporalFilter, FilterChain
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default='record.bag', type=str, help="Path to the bag file")
+    parser.add_argument(
+        '--frames', default=120, type=int, help="Number of depth frames to compare")
+    parser.add_argument(
+        '--batch_sizes', default=[1, 8, 32], type=int, nargs='+', help="Batch sizes of the throughput test")
+    return parser
+
+
+def get_args(parser):
+    args = parser.parse_args()
+    if os.path.splitext(args.input)[1] != ".bag":
+        print("The given file is not of correct file format.")
+        print("Only .bag files are accepted")
+        exit()
+    return args
+
+
+# Parameters of the 09 converters
+THRESHOLD = dict(min_dist=0, max_dist=5.2)
+SPATIAL = dict(smooth_alpha=0.5, smooth_delta=20, magnitude=2, hole_fill=2)
+TEMPORAL = dict(smooth_alpha=0.4, smooth_delta=20, persistence_control=3)
+
+
+def read_bag(path, count):
+    # Librealsense chain frame by frame, keeping the raw depth and the output of every stage
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(path, repeat_playback=False)
+    profile = pipeline.start(config)
+    profile.get_device().as_playback().set_real_time(False)
+    depth_units = profile.get_device().first_depth_sensor().get_option(rs.option.depth_units)
+
+    threshold_filter = rs.threshold_filter(**THRESHOLD)
+    depth_to_disparity_filter = rs.disparity_transform(transform_to_disparity=True)
+    spatial_filter = rs.spatial_filter(**SPATIAL)
+    temporal_filter = rs.temporal_filter(**TEMPORAL)
+    disparity_to_depth_filter = rs.disparity_transform(transform_to_disparity=False)
+
+    stages = {"raw": [], "threshold": [], "disparity": [], "spatial": [], "temporal": [], "depth": []}
+    elapsed = 0.0
+    try:
+        while len(stages["raw"]) < count:
+            success, frames = pipeline.try_wait_for_frames(1000)
+            if not success:
+                break
+            depth_frame = frames.get_depth_frame()
+            if not depth_frame:
+                continue
+            start = time.perf_counter()
+            thresholded = threshold_filter.process(depth_frame)
+            disparity = depth_to_disparity_filter.process(thresholded)
+            spatial = spatial_filter.process(disparity)
+            temporal = temporal_filter.process(spatial)
+            depth = disparity_to_depth_filter.process(temporal)
+            elapsed += time.perf_counter() - start
+            if disparity.profile.format() != rs.format.disparity32:
+                print("The recording has no stereo baseline, librealsense leaves depth as it is.")
+                exit()
+
+            stages["raw"].append(np.asanyarray(depth_frame.get_data()).copy())
+            stages["threshold"].append(np.asanyarray(thresholded.get_data()).copy())
+            for name, frame in (("disparity", disparity), ("spatial", spatial), ("temporal", temporal)):
+                stages[name].append(np.asanyarray(frame.get_data()).view(np.float32).copy())
+            stages["depth"].append(np.asanyarray(depth.get_data()).copy())
+    finally:
+        pipeline.stop()
+    stages = {name: np.stack(images) for name, images in stages.items()}
+
+    # Disparity is factor / depth: the library's constant, from its own output. Bags do not
+    # always keep the stereo baseline, else it is disparity_factor(baseline, fx, depth_units).
+    valid = stages["threshold"] != 0
+    factor = np.median(stages["disparity"][valid].astype(np.float64) * stages["threshold"][valid])
+    return stages, factor, depth_units, elapsed
+
+
+def difference(name, reference, result, tolerance):
+    error = np.abs(reference.astype(np.float64) - result.astype(np.float64))
+    scale = np.maximum(np.abs(reference), 1) if reference.dtype == np.float32 else 1
+    relative = error / scale
+    print("  {:<24} max {:10.3g}  mean {:10.3g}  pixels over {:g}: {}".format(
+        name, relative.max(), relative.mean(), tolerance, np.count_nonzero(relative > tolerance)))
+
+
+def main(args):
+    stages, factor, depth_units, rs_elapsed = read_bag(args.input, args.frames)
+    raw = stages["raw"]
+    count = len(raw)
+    print("Frames {}  {}x{}  disparity factor {:.1f}".format(count, raw.shape[2], raw.shape[1], factor))
+
+    # Stage by stage, each NumPy stage starting from the librealsense output of the previous one,
+    # relative differences for disparity and absolute depth levels for depth
+    print("Differences with librealsense:")
+    thresholded = ThresholdFilter(depth_units=depth_units, **THRESHOLD).process(raw.copy())
+    difference("threshold", stages["threshold"], thresholded, 0)
+    disparity = DisparityTransform(True, factor).process(stages["threshold"])
+    difference("depth to disparity", stages["disparity"], disparity, 1e-5)
+    spatial = SpatialFilter(**SPATIAL).process(stages["disparity"].copy())
+    difference("spatial", stages["spatial"], spatial, 1e-3)
+    unfilled = dict(SPATIAL, hole_fill=0)
+    spatial = SpatialFilter(**unfilled).process(stages["disparity"].copy())
+    difference("spatial without fill", stages["spatial"], spatial, 1e-3)
+    temporal = TemporalFilter(**TEMPORAL).process(stages["spatial"].copy())
+    difference("temporal", stages["temporal"], temporal, 1e-3)
+    depth = DisparityTransform(False, factor).process(stages["temporal"])
+    difference("disparity to depth", stages["depth"], depth, 0)
+    chain = FilterChain(factor, depth_units, spatial=SpatialFilter(**unfilled), temporal=TemporalFilter(**TEMPORAL),
+                        **THRESHOLD)
+    difference("whole chain without fill", stages["depth"], chain.process(raw), 1)
+    # Some librealsense versions ignore the hole_fill option of the spatial filter
+    print("  holes per frame: {:.0f} before spatial, {:.0f} after librealsense, {:.0f} after NumPy".format(
+        np.count_nonzero(stages["disparity"] == 0) / count, np.count_nonzero(stages["spatial"] == 0) / count,
+        np.count_nonzero(SpatialFilter(**SPATIAL).process(stages["disparity"].copy()) == 0) / count))
+
+    print("Throughput:")
+    print("  librealsense, frame by frame  {:7.1f} frames/s".format(count / rs_elapsed))
+    for batch_size in args.batch_sizes:
+        chain = FilterChain(factor, depth_units, spatial=SpatialFilter(**SPATIAL), temporal=TemporalFilter(**TEMPORAL),
+                            **THRESHOLD)
+        start = time.perf_counter()
+        for first in range(0, count, batch_size):
+            chain.process(raw[first:first + batch_size])
+        elapsed = time.perf_counter() - start
+        print("  NumPy, batches of {:<4}       {:7.1f} frames/s".format(batch_size, count / elapsed))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = get_args(parser)
+    print(args)
+    main(args)
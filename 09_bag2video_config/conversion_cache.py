@@ -0,0 +1,111 @@
+"""
+Manifest of the bag conversions already done, so that re-running a
+conversion only redoes the work whose inputs changed.
+
+A conversion is keyed by a fingerprint of the bag (its size and a
+hash of its first and last MiB, which hold the rosbag header and
+index) together with every setting that changes the output: filter
+chain, colorizer and encoder. Outputs are written in segments, and a
+segment is committed to the manifest once its file is closed, so an
+interrupted conversion resumes after its last committed segment.
+"""
+
+
+import os
+import json
+import hashlib
+
+
+def bag_fingerprint(path, chunk=1 << 20):
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(size - chunk, chunk))
+            digest.update(f.read(chunk))
+    return "{}-{}".format(size, digest.hexdigest())
+
+
+def conversion_key(fingerprint, settings):
+    text = json.dumps({"bag": fingerprint, "settings": settings}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class ConversionCache:
+    def __init__(self, path):
+        self.path = path
+        # key -> {"bag", "fingerprint", "output", "settings", "segments", "outputs", "complete"}
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        # Write then rename, a crash never leaves a truncated manifest
+        temporary = self.path + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def status(self, key):
+        # "complete", "partial" or "missing", the files must still be on disk
+        entry = self.entries.get(key)
+        if entry is None:
+            return "missing"
+        if entry["complete"]:
+            return "complete" if all(os.path.exists(path) for path in entry["outputs"]) else "missing"
+        if entry["segments"] and all(os.path.exists(segment["path"]) for segment in entry["segments"]):
+            return "partial"
+        return "missing"
+
+    def reason(self, key, output, fingerprint, settings):
+        # Why a conversion has to run, for the dry-run report
+        status = self.status(key)
+        if status == "complete":
+            return "up to date"
+        if status == "partial":
+            entry = self.entries[key]
+            return "resume after segment {} ({} frames)".format(
+                len(entry["segments"]), sum(segment["frames"] for segment in entry["segments"]))
+        if key in self.entries:
+            return "outputs missing on disk"
+        previous = [entry for entry in self.entries.values() if entry["output"] == output]
+        if not previous:
+            return "never converted"
+        if previous[0]["fingerprint"] != fingerprint:
+            return "bag changed"
+        changed = sorted(name for name in set(settings) | set(previous[0]["settings"])
+                         if settings.get(name) != previous[0]["settings"].get(name))
+        return "settings changed: " + ", ".join(changed)
+
+    def begin(self, key, bag, output, fingerprint, settings, force=False, overwritten=()):
+        # Entry to write the conversion into, restarted unless it can be resumed.
+        # overwritten are the paths the new conversion writes anyway, they are left alone
+        if force or self.status(key) != "partial":
+            # Older conversions to the same output are superseded, all their files go:
+            # without ffmpeg the segments are the outputs
+            for old_key in [old_key for old_key, entry in self.entries.items() if entry["output"] == output]:
+                entry = self.entries[old_key]
+                paths = set(segment["path"] for segment in entry["segments"]) | set(entry["outputs"])
+                for path in paths - set(overwritten):
+                    if os.path.exists(path):
+                        os.remove(path)
+                del self.entries[old_key]
+            self.entries[key] = {"bag": bag, "fingerprint": fingerprint, "output": output, "settings": settings,
+                                 "segments": [], "outputs": [], "complete": False}
+            self.save()
+        return self.entries[key]
+
+    def commit_segment(self, key, path, frames, last_timestamp, end_position):
+        # last_timestamp (ms) and end_position (ns from the first frame) of the last frame written
+        self.entries[key]["segments"].append({"path": path, "frames": frames, "last_timestamp": last_timestamp,
+                                              "end_position": end_position})
+        self.save()
+
+    def complete(self, key, outputs, empty=False):
+        # empty: the extract had no frames, there is no output and nothing to redo
+        self.entries[key]["outputs"] = outputs
+        self.entries[key]["complete"] = True
+        self.entries[key]["empty"] = empty
+        self.save()
@@ -0,0 +1,156 @@
+"""
+Soak monitor: leak tracking for long runs.
+
+Every interval frames (or files) the monitor samples the resident
+memory, the open file descriptors and the threads of the process
+(librealsense runs its own native threads), the librealsense frames
+still referenced from Python and the memory traced by tracemalloc. The first sample after the
+warm-up is the baseline; a run fails with SoakError, and the top
+allocators since the baseline, as soon as a growth goes past its limit.
+The samples are appended to a CSV log.
+"""
+
+
+import os
+import csv
+import time
+import weakref
+import tracemalloc
+
+
+class SoakError(RuntimeError):
+    pass
+
+
+def resident_memory():
+    # MB, from /proc (Linux), else the peak from getrusage
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024)
+
+
+def open_files():
+    for folder in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(folder):
+            return len(os.listdir(folder))
+    return -1
+
+
+def native_threads():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import threading
+    return threading.active_count()
+
+
+class SoakMonitor:
+    # Limits are growths over the baseline: MB of resident and of traced memory, counts of
+    # file descriptors and threads. Frames passed to track() are counted while alive, at most
+    # max_frames at a time. tracemalloc slows every allocation, top=0 leaves it off.
+    def __init__(self, interval=500, warmup=1000, max_rss=100.0, max_traced=50.0, max_files=8, max_threads=4,
+                 max_frames=64, top=10, log_path=None, unit="frames"):
+        self.interval = interval
+        self.warmup = warmup
+        self.limits = {"rss_mb": max_rss, "traced_mb": max_traced, "files": max_files, "threads": max_threads}
+        self.max_frames = max_frames
+        self.top = top
+        self.unit = unit
+        self.count = 0
+        self.frames = weakref.WeakSet()
+        self.baseline = None
+        self.baseline_snapshot = None
+        self.samples = []
+        self.start_time = time.perf_counter()
+        self.failed = False
+        self.tracing = top > 0 and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start(10)
+        self.log = None
+        if log_path is not None:
+            self.log = open(log_path, "w", newline="")
+            self.writer = csv.writer(self.log)
+            self.writer.writerow([unit, "seconds", "rss_mb", "traced_mb", "files", "threads", "frames_alive"])
+
+    def track(self, *frames):
+        # frames, framesets or filtered frames of the current iteration
+        for frame in frames:
+            if frame:
+                self.frames.add(frame)
+
+    def step(self, count=1):
+        # called once per frame (or file), samples every interval
+        previous = self.count
+        self.count += count
+        if self.count // self.interval != previous // self.interval:
+            self.sample()
+
+    def sample(self):
+        sample = {
+            "rss_mb": resident_memory(),
+            "traced_mb": tracemalloc.get_traced_memory()[0] / 2 ** 20 if tracemalloc.is_tracing() else 0.0,
+            "files": open_files(),
+            "threads": native_threads(),
+            "frames_alive": len(self.frames),
+        }
+        self.samples.append(sample)
+        if self.log is not None:
+            self.writer.writerow([self.count, round(time.perf_counter() - self.start_time, 1)] +
+                                 [round(value, 2) for value in sample.values()])
+            self.log.flush()
+        if self.baseline is None:
+            if self.count >= self.warmup:
+                self.baseline = sample
+                if tracemalloc.is_tracing():
+                    self.baseline_snapshot = tracemalloc.take_snapshot()
+                print("Soak baseline after {} {}: {}".format(self.count, self.unit, self.format(sample)))
+            return
+        growth = {name: sample[name] - self.baseline[name] for name in self.limits}
+        print("Soak {} {}: {}, growth {}".format(self.count, self.unit, self.format(sample), self.format(growth)))
+        failures = ["{} +{:.1f} > {}".format(name, growth[name], limit)
+                    for name, limit in self.limits.items() if growth[name] > limit]
+        if sample["frames_alive"] > self.max_frames:
+            failures.append("{} frames alive > {}".format(sample["frames_alive"], self.max_frames))
+        if failures:
+            self.print_top()
+            self.failed = True
+            raise SoakError("Soak failed after {} {}: {}".format(self.count, self.unit, ", ".join(failures)))
+
+    def format(self, sample):
+        return ", ".join("{} {:.1f}".format(name, value) if isinstance(value, float) else "{} {}".format(name, value)
+                         for name, value in sample.items())
+
+    def print_top(self):
+        # allocators that grew the most since the baseline
+        if self.baseline_snapshot is None or not tracemalloc.is_tracing():
+            return
+        statistics = tracemalloc.take_snapshot().compare_to(self.baseline_snapshot, "lineno")
+        print("Top allocations since the baseline:")
+        for statistic in statistics[:self.top]:
+            print("  ", statistic)
+
+    def close(self):
+        # summary of the run, growth per 1000 frames (or files) since the baseline
+        if self.baseline is not None and len(self.samples) > 1 and not self.failed:
+            last = self.samples[-1]
+            units = max(self.count - self.warmup, 1)
+            print("Soak done after {} {}: {}".format(self.count, self.unit, ", ".join(
+                "{} {:+.2f}/1000".format(name, (last[name] - self.baseline[name]) * 1000 / units)
+                for name in self.limits)))
+            self.print_top()
+        if self.log is not None:
+            self.log.close()
+        if self.tracing:
+            tracemalloc.stop()
@@ -0,0 +1,125 @@
+"""
+Software pairing of depth and color frames by timestamp.
+
+wait_for_frames() does not guarantee a matched pair: with different
+stream rates, or with bag playback outside real time, a frameset can
+miss a stream or repeat the previous frame of it. The synchronizer
+buffers each stream in a small ring buffer and emits nearest-match
+pairs within a tolerance. Every frame is pushed and popped once, so
+the cost is O(1) amortized per frame.
+"""
+
+
+from collections import deque
+
+
+class StreamBuffer:
+    def __init__(self, capacity):
+        # (timestamp, frame number, payload), timestamps increasing
+        self.entries = deque()
+        self.capacity = capacity
+        self.last_timestamp = None
+        self.received = 0
+        self.duplicated = 0
+        self.unmatched = 0
+        self.overflow = 0
+
+    def push(self, timestamp, frame_number, payload):
+        # A timestamp that does not move forward is a repeated frame
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            self.duplicated += 1
+            return False
+        self.last_timestamp = timestamp
+        self.received += 1
+        if len(self.entries) == self.capacity:
+            # The other stream is late or missing: forget the oldest frame
+            self.entries.popleft()
+            self.overflow += 1
+        self.entries.append((timestamp, frame_number, payload))
+        return True
+
+    def drop(self):
+        self.entries.popleft()
+        self.unmatched += 1
+
+
+class FrameSynchronizer:
+    def __init__(self, tolerance=10.0, capacity=4):
+        # tolerance is the largest timestamp difference (ms) of an emitted pair
+        self.tolerance = tolerance
+        self.depth = StreamBuffer(capacity)
+        self.color = StreamBuffer(capacity)
+        self.matched = 0
+        self.offset_sum = 0.0
+
+    def push_depth(self, timestamp, frame_number, payload):
+        self.depth.push(timestamp, frame_number, payload)
+        return self._match(final=False)
+
+    def push_color(self, timestamp, frame_number, payload):
+        self.color.push(timestamp, frame_number, payload)
+        return self._match(final=False)
+
+    def push_frameset(self, frames):
+        # Convenience for pyrealsense2 framesets, repeated frames are filtered out
+        pairs = []
+        depth_frame = frames.get_depth_frame()
+        color_frame = frames.get_color_frame()
+        if depth_frame:
+            pairs += self.push_depth(depth_frame.get_timestamp(), depth_frame.get_frame_number(), depth_frame)
+        if color_frame:
+            pairs += self.push_color(color_frame.get_timestamp(), color_frame.get_frame_number(), color_frame)
+        return pairs
+
+    def flush(self):
+        # At the end of a stream there are no later frames to wait for
+        return self._match(final=True)
+
+    def _match(self, final):
+        # Returns a list of (depth entry, color entry) pairs, an entry being
+        # (timestamp, frame number, payload)
+        pairs = []
+        depth = self.depth.entries
+        color = self.color.entries
+        while depth and color:
+            depth_time = depth[0][0]
+            color_time = color[0][0]
+            # Heads too old to ever be matched, the other stream has moved on
+            if color_time < depth_time - self.tolerance:
+                self.color.drop()
+                continue
+            if depth_time < color_time - self.tolerance:
+                self.depth.drop()
+                continue
+
+            # Within tolerance, but a later frame of either stream may be nearer
+            distance = abs(depth_time - color_time)
+            if len(color) > 1 and abs(depth_time - color[1][0]) < distance:
+                self.color.drop()
+                continue
+            if len(depth) > 1 and abs(color_time - depth[1][0]) < distance:
+                self.depth.drop()
+                continue
+            # Later frames can only be nearer to the head that is ahead in time
+            if not final and ((color_time < depth_time and len(color) == 1) or
+                              (depth_time < color_time and len(depth) == 1)):
+                break
+
+            pairs.append((depth.popleft(), color.popleft()))
+            self.matched += 1
+            self.offset_sum += distance
+
+        if final:
+            while depth:
+                self.depth.drop()
+            while color:
+                self.color.drop()
+        return pairs
+
+    def report(self):
+        mean_offset = self.offset_sum / self.matched if self.matched else 0.0
+        return ("Pairs {}  mean offset {:.2f} ms  |  depth: received {} unmatched {} duplicated {} overflow {}"
+                "  |  color: received {} unmatched {} duplicated {} overflow {}").format(
+            self.matched, mean_offset,
+            self.depth.received, self.depth.unmatched, self.depth.duplicated, self.depth.overflow,
+            self.color.received, self.color.unmatched, self.color.duplicated, self.color.overflow)
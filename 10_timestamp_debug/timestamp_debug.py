@@ -4,6 +4,7 @@ import cv2
 import argparse
 import json
 import time
+from frame_sync import FrameSynchronizer
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -16,6 +17,12 @@ def get_parser():
     parser.add_argument(
         '--visual_preset', default="High Accuracy", type=str, 
         choices=["Custom", "Default", "Hand", "High Accuracy", "High Density"])
+    parser.add_argument(
+        '--input', '-i', default='', type=str, help="Read from a bag file instead of the camera")
+    parser.add_argument(
+        '--sync', action='store_true', help="Pair depth and color frames by timestamp in software")
+    parser.add_argument(
+        '--tolerance', default=10.0, type=float, help="Max timestamp difference of a synchronized pair (ms)")
 
     return parser
 
@@ -44,34 +51,44 @@ def main(args):
     # define pipeline and its config
     pipeline = rs.pipeline()
     config = rs.config()
+    if args.input:
+        # Tell config that we will use a recorded device from file to be used by the pipeline through playback.
+        config.enable_device_from_file(args.input, repeat_playback=False)
     config.enable_stream(rs.stream.depth, width, height, rs.format.z16, FPS)
     config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, FPS)
 
     pipe_profile = pipeline.start(config)
     device = pipe_profile.get_device()
 
-    # Load advanced controls settings
-    advnc_mode = rs.rs400_advanced_mode(device)
-    advnc_mode.load_json(json_string)
+    if args.input:
+        # As fast as possible: this is where framesets get skewed or repeated
+        device.as_playback().set_real_time(False)
+    else:
+        # Load advanced controls settings
+        advnc_mode = rs.rs400_advanced_mode(device)
+        advnc_mode.load_json(json_string)
 
-    # DEPTH SENSOR CONFIGURATION
-    # these are the stereo module main parameters
-    depth_sensor = device.first_depth_sensor()
+        # DEPTH SENSOR CONFIGURATION
+        # these are the stereo module main parameters
+        depth_sensor = device.first_depth_sensor()
 
-    # set visual preset -- 0=Custom, 1=Default, 2=Hand, 3=High Accuracy, 4=High Density
-    preset_range = depth_sensor.get_option_range(rs.option.visual_preset)
-    for i in range(int(preset_range.max)):
-        visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, i)
-        if visual_preset == args.visual_preset:
-            depth_sensor.set_option(rs.option.visual_preset, i)
+        # set visual preset -- 0=Custom, 1=Default, 2=Hand, 3=High Accuracy, 4=High Density
+        preset_range = depth_sensor.get_option_range(rs.option.visual_preset)
+        for i in range(int(preset_range.max)):
+            visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, i)
+            if visual_preset == args.visual_preset:
+                depth_sensor.set_option(rs.option.visual_preset, i)
 
-    current_preset = depth_sensor.get_option(rs.option.visual_preset)
-    current_visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, current_preset)
-    print("Depth visual preset:", current_visual_preset)
+        current_preset = depth_sensor.get_option(rs.option.visual_preset)
+        current_visual_preset = depth_sensor.get_option_value_description(rs.option.visual_preset, current_preset)
+        print("Depth visual preset:", current_visual_preset)
 
-    depth_sensor.set_option(rs.option.enable_auto_exposure, True)
-    depth_sensor.set_option(rs.option.emitter_enabled, 1)  # 1=Laser is the default
-    # depth_sensor.set_option(rs.option.hdr_enabled, True)  # DO NOT USE, it makes the image flash
+        depth_sensor.set_option(rs.option.enable_auto_exposure, True)
+        depth_sensor.set_option(rs.option.emitter_enabled, 1)  # 1=Laser is the default
+        # depth_sensor.set_option(rs.option.hdr_enabled, True)  # DO NOT USE, it makes the image flash
+
+    # Pairs depth and color frames by hardware timestamp instead of trusting the frameset
+    synchronizer = FrameSynchronizer(tolerance=args.tolerance) if args.sync else None
 
     try:
         # COLORMAPS
@@ -106,39 +123,61 @@ def main(args):
         # Streaming loop
         while True:
             
-            frames = pipeline.wait_for_frames()
-            depth_frame = frames.get_depth_frame()
-            color_frame = frames.get_color_frame()
+            success, frames = pipeline.try_wait_for_frames(5000)
             previous_timestamp = time.time()
-            
-            if not depth_frame or not color_frame:
-                # If there is no frame, probably camera not connected, return False
-                print("Error, impossible to get the frame, make sure that the Intel Realsense camera is correctly connected")
+            if not success:
+                print("No more frames")
+                if synchronizer is None:
+                    break
+
+            if synchronizer is not None:
+                # the last buffered frames are paired when the stream ends
+                matches = synchronizer.push_frameset(frames) if success else synchronizer.flush()
+                pairs = [(depth[2], color[2]) for depth, color in matches]
+            else:
+                depth_frame = frames.get_depth_frame()
+                color_frame = frames.get_color_frame()
+                if not depth_frame or not color_frame:
+                    # If there is no frame, probably camera not connected, return False
+                    print("Error, impossible to get the frame, make sure that the Intel Realsense camera is correctly connected")
+                    continue
+                pairs = [(depth_frame, color_frame)]
+
+            for depth_frame, color_frame in pairs:
+                # # Apply filters to the depth channel
+                # filtered_depth = depth_frame
+                # filtered_depth = decimation_filter.process(filtered_depth)
+                # filtered_depth = threshold_filter.process(filtered_depth)
+                # filtered_depth = depth_to_disparity_filter.process(filtered_depth)
+                # filtered_depth = spatial_filter.process(filtered_depth)
+                # # filtered_depth = temporal_filter.process(filtered_depth)
+                # filtered_depth = disparity_to_depth_filter.process(filtered_depth)
+
+                # Apply colormap to show the depth of the Objects
+                depth_colormap = np.asanyarray(colorizer.colorize(depth_frame).get_data())
+                # Convert images to numpy arrays
+                color_image = np.asanyarray(color_frame.get_data())
+
+                # Save to disk
+                colorwriter.write(color_image)
+                depthwriter.write(depth_colormap)
+                
+                current_timestamp = time.time()
+                print(current_timestamp - previous_timestamp)
+                np.savetxt(timestamps_file, [previous_timestamp], fmt="%10.5f", newline=", ")
+                if synchronizer is not None:
+                    # also log the hardware timestamps of the pair (ms)
+                    np.savetxt(timestamps_file, [current_timestamp], fmt="%10.5f", newline=", ")
+                    np.savetxt(timestamps_file, [depth_frame.get_timestamp()], fmt="%.3f", newline=", ")
+                    np.savetxt(timestamps_file, [color_frame.get_timestamp()], fmt="%.3f")
+                else:
+                    np.savetxt(timestamps_file, [current_timestamp], fmt="%10.5f")
+             
+            if not success:
+                break
+            if not pairs:
                 continue
 
-            # # Apply filters to the depth channel
-            # filtered_depth = depth_frame
-            # filtered_depth = decimation_filter.process(filtered_depth)
-            # filtered_depth = threshold_filter.process(filtered_depth)
-            # filtered_depth = depth_to_disparity_filter.process(filtered_depth)
-            # filtered_depth = spatial_filter.process(filtered_depth)
-            # # filtered_depth = temporal_filter.process(filtered_depth)
-            # filtered_depth = disparity_to_depth_filter.process(filtered_depth)
-
-            # Apply colormap to show the depth of the Objects
-            depth_colormap = np.asanyarray(colorizer.colorize(depth_frame).get_data())
-            # Convert images to numpy arrays
-            color_image = np.asanyarray(color_frame.get_data())
-
-            # Save to disk
-            colorwriter.write(color_image)
-            depthwriter.write(depth_colormap)
-            
-            current_timestamp = time.time()
-            print(current_timestamp - previous_timestamp)
-            np.savetxt(timestamps_file, [previous_timestamp], fmt="%10.5f", newline=", ")
-            np.savetxt(timestamps_file, [current_timestamp], fmt="%10.5f")
-             
             # Show to screen
             cv2.imshow('RGB', color_image)
             cv2.imshow('Depth', depth_colormap)
@@ -152,6 +191,8 @@ def main(args):
         depthwriter.release()
         pipeline.stop()
         timestamps_file.close()
+        if synchronizer is not None:
+            print(synchronizer.report())
 
 if __name__ == '__main__':
     parser = get_parser()
@@ -0,0 +1,252 @@
+"""
+Capture from several RealSense devices (or .bag files standing in
+for them) at once. Each pipeline runs on its own thread and copies
+its frames into its own pool of preallocated buffers, then framesets
+from all devices are merged by timestamp within a tolerance.
+"""
+
+
+import time
+import threading
+from collections import deque
+import numpy as np
+import pyrealsense2 as rs
+
+
+class FramePool:
+    # Preallocated depth/color buffers handed out by slot index
+    def __init__(self, size):
+        self.size = size
+        self.free = deque(range(size))
+        self.depth = None
+        self.color = None
+
+    def allocate(self, depth_image, color_image):
+        self.depth = np.empty((self.size,) + depth_image.shape, depth_image.dtype)
+        if color_image is not None:
+            self.color = np.empty((self.size,) + color_image.shape, color_image.dtype)
+
+    def acquire(self):
+        # None when every buffer is still in use downstream
+        return self.free.popleft() if self.free else None
+
+    def release(self, slot):
+        self.free.append(slot)
+
+
+class CameraThread(threading.Thread):
+    def __init__(self, source, condition, pool_size=8, width=1280, height=720, fps=30, real_time=True):
+        super().__init__(name=source, daemon=True)
+        self.source = source
+        self.condition = condition
+        self.real_time = real_time
+        self.pool = FramePool(pool_size)
+        # (timestamp, frame number, slot) waiting to be merged
+        self.buffer = deque()
+
+        # A .bag path is played back, anything else is a device serial number
+        self.is_bag = source.endswith(".bag")
+        self.pipeline = rs.pipeline()
+        self.config = rs.config()
+        if self.is_bag:
+            self.config.enable_device_from_file(source, repeat_playback=False)
+        else:
+            self.config.enable_device(source)
+            self.config.enable_stream(rs.stream.depth, width, height, rs.format.z16, fps)
+            self.config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
+
+        self.running = False
+        self.finished = False
+        self.error = None
+        self.first_timestamp = None
+        self.start_time = None
+        self.received = 0
+        self.dropped = 0
+        self.unmatched = 0
+
+    def run(self):
+        try:
+            profile = self.pipeline.start(self.config)
+            device = profile.get_device()
+            if self.is_bag:
+                device.as_playback().set_real_time(self.real_time)
+            else:
+                # Put the frame timestamps of every device in the host clock domain
+                for sensor in device.query_sensors():
+                    if sensor.supports(rs.option.global_time_enabled):
+                        sensor.set_option(rs.option.global_time_enabled, 1)
+            self.start_time = time.perf_counter()
+            self._loop()
+        except Exception as error:
+            self.error = error
+        finally:
+            try:
+                self.pipeline.stop()
+            except RuntimeError:
+                pass
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def _loop(self):
+        while self.running:
+            success, frames = self.pipeline.try_wait_for_frames(1000)
+            if not success:
+                if self.is_bag:
+                    # Nothing more from a bag played back without repeat: recording is over
+                    break
+                continue
+            depth_frame = frames.get_depth_frame()
+            color_frame = frames.get_color_frame()
+            if not depth_frame:
+                continue
+
+            depth_image = np.asanyarray(depth_frame.get_data())
+            color_image = np.asanyarray(color_frame.get_data()) if color_frame else None
+            timestamp = frames.get_timestamp()
+
+            with self.condition:
+                self.received += 1
+                if self.pool.depth is None:
+                    self.pool.allocate(depth_image, color_image)
+                slot = self.pool.acquire()
+                if slot is None:
+                    if not self.buffer:
+                        # every buffer is held by the frameset being consumed
+                        self.dropped += 1
+                        continue
+                    # Pool exhausted by frames waiting for the other devices:
+                    # drop the oldest one, the freshest frame is more useful
+                    _, _, slot = self.buffer.popleft()
+                    self.dropped += 1
+                if self.first_timestamp is None:
+                    self.first_timestamp = timestamp
+
+            # Copy out of the librealsense frame so its own pool is never starved
+            np.copyto(self.pool.depth[slot], depth_image)
+            if color_image is not None and self.pool.color is not None:
+                np.copyto(self.pool.color[slot], color_image)
+
+            with self.condition:
+                self.buffer.append((timestamp, frames.get_frame_number(), slot))
+                self.condition.notify_all()
+
+    def fps(self):
+        if self.start_time is None:
+            return 0.0
+        return self.received / max(time.perf_counter() - self.start_time, 1e-6)
+
+
+class MultiFrameset:
+    def __init__(self, sources, timestamps, frame_numbers, depth_images, color_images):
+        self.sources = sources
+        self.timestamps = timestamps
+        self.frame_numbers = frame_numbers
+        self.depth_images = depth_images
+        self.color_images = color_images
+
+    @property
+    def skew(self):
+        # Spread of the timestamps merged in this frameset, in ms
+        return max(self.timestamps) - min(self.timestamps)
+
+
+class MultiCameraCapture:
+    def __init__(self, sources, tolerance=10.0, pool_size=8, width=1280, height=720, fps=30,
+                 real_time=True, relative_time=False):
+        # tolerance is the largest timestamp difference (ms) inside a merged frameset.
+        # relative_time matches on the time since each source's first frame, for bags
+        # recorded separately that stand in for cameras started together.
+        self.condition = threading.Condition()
+        self.tolerance = tolerance
+        self.relative_time = relative_time
+        self.cameras = [CameraThread(source, self.condition, pool_size, width, height, fps, real_time)
+                        for source in sources]
+        self.pending_release = []
+        self.merged = 0
+        self.skew_sum = 0.0
+        self.skew_max = 0.0
+
+    @staticmethod
+    def connected_devices():
+        return [device.get_info(rs.camera_info.serial_number) for device in rs.context().query_devices()]
+
+    def start(self):
+        for camera in self.cameras:
+            camera.running = True
+            camera.start()
+
+    def stop(self):
+        for camera in self.cameras:
+            camera.running = False
+        for camera in self.cameras:
+            camera.join()
+
+    def _timestamp(self, camera, entry):
+        if self.relative_time:
+            return entry[0] - camera.first_timestamp
+        return entry[0]
+
+    def _match(self):
+        # Drop the heads that are too old to ever be matched, until
+        # every buffer head lies within the tolerance of the newest head
+        while True:
+            if any(not camera.buffer for camera in self.cameras):
+                return None
+            heads = [self._timestamp(camera, camera.buffer[0]) for camera in self.cameras]
+            reference = max(heads)
+            if reference - min(heads) <= self.tolerance:
+                return [camera.buffer.popleft() for camera in self.cameras]
+            for camera, head in zip(self.cameras, heads):
+                if head < reference - self.tolerance:
+                    _, _, slot = camera.buffer.popleft()
+                    camera.pool.release(slot)
+                    camera.unmatched += 1
+
+    def get_frameset(self, timeout=1.0):
+        # Images of the returned frameset stay valid until the next call,
+        # then their buffers go back to the pools. None on timeout or when
+        # a source has ended.
+        deadline = time.perf_counter() + timeout
+        with self.condition:
+            for camera, slot in self.pending_release:
+                camera.pool.release(slot)
+            self.pending_release = []
+
+            while True:
+                entries = self._match()
+                if entries is not None:
+                    break
+                if any(camera.finished and not camera.buffer for camera in self.cameras):
+                    return None
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+            self.pending_release = [(camera, entry[2]) for camera, entry in zip(self.cameras, entries)]
+
+        frameset = MultiFrameset(
+            [camera.source for camera in self.cameras],
+            [self._timestamp(camera, entry) for camera, entry in zip(self.cameras, entries)],
+            [entry[1] for entry in entries],
+            [camera.pool.depth[entry[2]] for camera, entry in zip(self.cameras, entries)],
+            [None if camera.pool.color is None else camera.pool.color[entry[2]]
+             for camera, entry in zip(self.cameras, entries)])
+        self.merged += 1
+        self.skew_sum += frameset.skew
+        self.skew_max = max(self.skew_max, frameset.skew)
+        return frameset
+
+    def errors(self):
+        return [(camera.source, camera.error) for camera in self.cameras if camera.error is not None]
+
+    def report(self):
+        lines = []
+        for camera in self.cameras:
+            lines.append("{:<30} {:6.1f} fps  received {:6d}  dropped {:5d}  unmatched {:5d}".format(
+                camera.source[-30:], camera.fps(), camera.received, camera.dropped, camera.unmatched))
+        if self.merged:
+            lines.append("Merged framesets {}  skew mean {:.2f} ms  max {:.2f} ms".format(
+                self.merged, self.skew_sum / self.merged, self.skew_max))
+        return "\n".join(lines)
@@ -0,0 +1,94 @@
+"""
+Stream from all the connected RealSense cameras, or from several
+.bag files played back at once, and merge their framesets by timestamp.
+"""
+
+
+import cv2
+import time
+import argparse
+import numpy as np
+from capture_manager import MultiCameraCapture
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--inputs', '-i', default=[], type=str, nargs='*', help="Bag files standing in for cameras, connected devices if none")
+    parser.add_argument(
+        '--width', default=1280, type=int, choices=[1280, 848, 640])
+    parser.add_argument(
+        '--height', default=720, type=int, choices=[720, 480, 360])
+    parser.add_argument(
+        '--FPS', '-fps', default=30, type=int, choices=[15, 25, 30, 60, 90])
+    parser.add_argument(
+        '--tolerance', default=10.0, type=float, help="Max timestamp difference in a merged frameset (ms)")
+    parser.add_argument(
+        '--pool_size', default=8, type=int, help="Preallocated frame buffers per source")
+    parser.add_argument(
+        '--relative_time', action='store_true', help="Match on time since each source's first frame")
+    parser.add_argument(
+        '--max_speed', action='store_true', help="Play bags back as fast as possible instead of real time")
+    parser.add_argument(
+        '--duration', default=0, type=float, help="Stop after this many seconds, 0 to run until the end")
+    parser.add_argument(
+        '--no_preview', action='store_true', help="Do not show the merged depth views")
+    return parser
+
+
+def main(args):
+    sources = args.inputs or MultiCameraCapture.connected_devices()
+    if not sources:
+        print("No camera connected and no bag file given.")
+        exit()
+    print("Sources:", sources)
+
+    capture = MultiCameraCapture(sources, tolerance=args.tolerance, pool_size=args.pool_size,
+                                 width=args.width, height=args.height, fps=args.FPS,
+                                 real_time=not args.max_speed, relative_time=args.relative_time)
+    colorizer_alpha = 255 / 6000  # 0-6 m to 8 bit
+    capture.start()
+    start_time = time.perf_counter()
+    last_report = start_time
+
+    try:
+        while True:
+            frameset = capture.get_frameset(timeout=2.0)
+            now = time.perf_counter()
+            if frameset is None:
+                print("No more merged framesets")
+                break
+
+            if not args.no_preview:
+                # Depth views side by side, all scaled to the height of the first one
+                height = frameset.depth_images[0].shape[0]
+                views = []
+                for depth_image in frameset.depth_images:
+                    view = cv2.applyColorMap(cv2.convertScaleAbs(depth_image, alpha=colorizer_alpha), cv2.COLORMAP_JET)
+                    if view.shape[0] != height:
+                        view = cv2.resize(view, (view.shape[1] * height // view.shape[0], height))
+                    views.append(view)
+                cv2.imshow('Depth', np.hstack(views))
+                # if pressed escape exit program
+                if cv2.waitKey(1) in [27, ord("q")]:
+                    break
+
+            if now - last_report >= 5:
+                print(capture.report())
+                last_report = now
+            if args.duration and now - start_time >= args.duration:
+                break
+    finally:
+        capture.stop()
+        if not args.no_preview:
+            cv2.destroyAllWindows()
+        print(capture.report())
+        for source, error in capture.errors():
+            print("Error on", source, error)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
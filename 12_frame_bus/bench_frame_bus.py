@@ -0,0 +1,122 @@
+"""
+Publish -> subscribe latency and throughput of the frame bus. A child
+process publishes synthetic frames (or the frames of a .bag) and this
+process reads them in both modes, optionally with some work per frame
+to show how slow readers are overrun.
+"""
+
+
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from frame_bus import FrameBusPublisher, FrameBusSubscriber
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default=None, type=str, help="Bag file to publish, synthetic frames if not given")
+    parser.add_argument(
+        '--width', default=1280, type=int)
+    parser.add_argument(
+        '--height', default=720, type=int)
+    parser.add_argument(
+        '--frames', default=300, type=int, help="Frames published per measure")
+    parser.add_argument(
+        '--fps', default=0, type=float, help="Publishing rate, 0 for as fast as possible")
+    parser.add_argument(
+        '--slots', default=8, type=int)
+    parser.add_argument(
+        '--work_ms', default=0.0, type=float, help="Simulated processing time per received frame")
+    return parser
+
+
+def source_frames(args):
+    if args.input is None:
+        rng = np.random.RandomState(0)
+        depth = rng.randint(300, 5000, (args.height, args.width)).astype(np.uint16)
+        color = rng.randint(0, 255, (args.height, args.width, 3)).astype(np.uint8)
+        for i in range(args.frames):
+            yield depth, color, i * 1000 / 30, i
+        return
+    import pyrealsense2 as rs
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(args.input, repeat_playback=True)
+    pipeline.start(config)
+    align = rs.align(rs.stream.color)
+    try:
+        for i in range(args.frames):
+            frames = align.process(pipeline.wait_for_frames())
+            # copies, the frames are all kept and librealsense would run out of buffers
+            yield (np.asanyarray(frames.get_depth_frame().get_data()).copy(),
+                   np.asanyarray(frames.get_color_frame().get_data()).copy(),
+                   frames.get_timestamp(), frames.get_frame_number())
+    finally:
+        pipeline.stop()
+
+
+def publish(name, args, ready):
+    frames = list(source_frames(args))
+    height, width = frames[0][0].shape
+    publisher = FrameBusPublisher(name, width, height, frames[0][1].shape[2], args.slots)
+    ready.wait()
+    start = time.perf_counter()
+    for i, (depth, color, timestamp, frame_number) in enumerate(frames):
+        if args.fps:
+            delay = start + i / args.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        publisher.publish(depth, color, timestamp, frame_number)
+    # let the readers catch up before the bus goes away
+    time.sleep(0.5)
+    publisher.close()
+
+
+def measure(args, mode):
+    name = "bench_{}".format(mode)
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=publish, args=(name, args, ready))
+    process.start()
+    subscriber = FrameBusSubscriber(name, mode=mode, timeout=30.0)
+    ready.set()
+
+    latencies = []
+    start = last = None
+    while True:
+        frame = subscriber.get(timeout=2.0)
+        if frame is None:
+            break
+        received = time.perf_counter()
+        if start is None:
+            start = received
+        last = received
+        # touch the images, as a consumer would
+        int(frame.depth[::64, ::64].sum()) + int(frame.color[::64, ::64].sum())
+        if args.work_ms:
+            time.sleep(args.work_ms / 1000)
+        if subscriber.is_current(frame):
+            latencies.append(received - frame.publish_time)
+    elapsed = last - start if start is not None else 0.0
+    process.join()
+    subscriber.close()
+
+    latencies = np.array(latencies) * 1000
+    print("{:<7} received {:5d}  lost {:5d}  torn {:4d}  {:8.1f} frames/s  latency ms: median {:.3f}  p99 {:.3f}".format(
+        mode, subscriber.received, subscriber.lost, subscriber.torn, subscriber.received / max(elapsed, 1e-6),
+        np.median(latencies) if len(latencies) else float('nan'),
+        np.percentile(latencies, 99) if len(latencies) else float('nan')))
+
+
+def main(args):
+    print("Publishing {} frames at {}".format(args.frames, "{} fps".format(args.fps) if args.fps else "full speed"))
+    for mode in ("every", "latest"):
+        measure(args, mode)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,181 @@
+"""
+Shared-memory frame bus: one process owns the RealSense pipeline and
+publishes its depth and color frames, any number of other processes
+read them without copies.
+
+The frames go into a ring buffer of slots in a memory-mapped file
+(in /dev/shm when it exists, so it never touches the disk). Each slot
+holds a sequence number, the frame timestamp and number, the publish
+time, and the images. The publisher clears the slot sequence number
+before it overwrites a slot and sets it again once the slot is
+complete, so a subscriber can tell whether the images it is looking
+at were overwritten meanwhile (the reader was overrun).
+
+Subscribers either follow the latest frame, skipping the ones they
+were too slow for, or read every frame in order. Frames overwritten
+before they were read are counted as lost, frames overwritten while
+they were in use as torn, each once.
+"""
+
+
+import os
+import mmap
+import time
+import tempfile
+import numpy as np
+
+
+MAGIC = 0x52534255  # "RSBU"
+# magic, slots, width, height, color channels, last published sequence number, closed
+HEADER_FIELDS = 7
+HEADER_SIZE = 64
+
+
+def bus_path(name):
+    folder = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(folder, "realsense_bus_" + name)
+
+
+def slot_dtype(width, height, color_channels):
+    return np.dtype([("seq", "<u8"), ("frame_number", "<u8"), ("timestamp", "<f8"), ("publish_time", "<f8"),
+                     ("depth", "<u2", (height, width)), ("color", "u1", (height, width, color_channels))])
+
+
+class BusFrame:
+    def __init__(self, seq, frame_number, timestamp, publish_time, depth, color):
+        # depth and color are views of the shared slot, valid while the slot is not overwritten
+        self.seq = seq
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.publish_time = publish_time
+        self.depth = depth
+        self.color = color
+
+
+class FrameBusPublisher:
+    def __init__(self, name, width, height, color_channels=3, slots=8):
+        self.path = bus_path(name)
+        dtype = slot_dtype(width, height, color_channels)
+        size = HEADER_SIZE + slots * dtype.itemsize
+        with open(self.path, "w+b") as f:
+            f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size)
+        self.header = np.ndarray((HEADER_FIELDS,), np.uint64, buffer=self.map)
+        self.slots = np.ndarray((slots,), dtype, buffer=self.map, offset=HEADER_SIZE)
+        self.header[:] = [0, slots, width, height, color_channels, 0, 0]
+        # magic last, subscribers wait for it
+        self.header[0] = MAGIC
+        self.seq = 0
+
+    def publish(self, depth_image, color_image, timestamp, frame_number):
+        self.seq += 1
+        index = self.seq % len(self.slots)
+        # mark the slot as being written, readers of its previous frame see the change
+        self.slots["seq"][index] = 0
+        self.slots["frame_number"][index] = frame_number
+        self.slots["timestamp"][index] = timestamp
+        np.copyto(self.slots["depth"][index], depth_image)
+        if color_image is not None:
+            np.copyto(self.slots["color"][index], color_image)
+        self.slots["publish_time"][index] = time.perf_counter()
+        self.slots["seq"][index] = self.seq
+        self.header[5] = self.seq
+        return self.seq
+
+    def close(self):
+        self.header[6] = 1
+        del self.header, self.slots
+        self.map.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            # still mapped by a subscriber on Windows, it is reused by the next publisher
+            pass
+
+
+class FrameBusSubscriber:
+    def __init__(self, name, mode="latest", timeout=5.0):
+        # mode "latest" returns the newest frame, "every" every frame in order
+        if mode not in ("latest", "every"):
+            raise ValueError("mode is 'latest' or 'every'")
+        self.mode = mode
+        path = bus_path(name)
+        deadline = time.perf_counter() + timeout
+        while True:
+            if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+                with open(path, "r+b") as f:
+                    self.map = mmap.mmap(f.fileno(), 0)
+                self.header = np.ndarray((HEADER_FIELDS,), np.uint64, buffer=self.map)
+                if self.header[0] == MAGIC:
+                    break
+                del self.header
+                self.map.close()
+            if time.perf_counter() > deadline:
+                raise TimeoutError("No frame bus named " + name)
+            time.sleep(0.05)
+        slots, width, height, color_channels = (int(value) for value in self.header[1:5])
+        self.slots = np.ndarray((slots,), slot_dtype(width, height, color_channels), buffer=self.map,
+                                offset=HEADER_SIZE)
+        # start with the frames published from now on
+        self.last_seq = int(self.header[5])
+        self.received = 0
+        self.lost = 0
+        self.torn = 0
+        self.torn_seq = 0
+
+    @property
+    def closed(self):
+        return bool(self.header[6])
+
+    def get(self, timeout=1.0, poll=0.0002):
+        # Next frame for the mode, None on timeout or once the publisher has closed.
+        # There is no cross-process notification, the header is polled.
+        deadline = time.perf_counter() + timeout
+        while True:
+            published = int(self.header[5])
+            if published > self.last_seq:
+                seq = published if self.mode == "latest" else self.last_seq + 1
+                if published - seq >= len(self.slots) - 1:
+                    # every-frame reader more than a ring behind: skip to the oldest safe frame
+                    skipped_to = published - len(self.slots) + 2
+                    self.lost += skipped_to - seq
+                    seq = skipped_to
+                frame = self._read(seq)
+                if frame is not None:
+                    return frame
+                continue
+            if self.closed or time.perf_counter() > deadline:
+                return None
+            time.sleep(poll)
+
+    def _read(self, seq):
+        index = seq % len(self.slots)
+        if int(self.slots["seq"][index]) != seq:
+            # overwritten (or being written) before we got to it
+            self.lost += 1
+            self.last_seq = seq
+            return None
+        frame = BusFrame(seq, int(self.slots["frame_number"][index]), float(self.slots["timestamp"][index]),
+                         float(self.slots["publish_time"][index]), self.slots["depth"][index],
+                         self.slots["color"][index])
+        self.last_seq = seq
+        self.received += 1
+        return frame
+
+    def is_current(self, frame):
+        # False once the publisher has started to overwrite the slot of the frame:
+        # whatever was computed from its views may be torn and should be dropped
+        current = int(self.slots["seq"][frame.seq % len(self.slots)]) == frame.seq
+        if not current and frame.seq != self.torn_seq:
+            # counted once however often the frame is checked
+            self.torn += 1
+            self.torn_seq = frame.seq
+        return current
+
+    def close(self):
+        del self.header, self.slots
+        try:
+            self.map.close()
+        except BufferError:
+            # frames still hold views of the slots, the mapping goes with them
+            pass
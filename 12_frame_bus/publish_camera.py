@@ -0,0 +1,87 @@
+"""
+Own the RealSense camera (or play back a .bag) and publish its depth
+and color frames on a shared-memory frame bus, for any number of
+subscriber processes (see subscribe.py).
+"""
+
+
+import time
+import argparse
+import numpy as np
+import pyrealsense2 as rs
+from frame_bus import FrameBusPublisher
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--name', default='camera', type=str, help="Name of the frame bus")
+    parser.add_argument(
+        '--input', '-i', default=None, type=str, help="Bag file to publish instead of the camera")
+    parser.add_argument(
+        '--width', default=1280, type=int, choices=[1280, 848, 640])
+    parser.add_argument(
+        '--height', default=720, type=int, choices=[720, 480, 360])
+    parser.add_argument(
+        '--FPS', '-fps', default=30, type=int, choices=[15, 25, 30, 60, 90])
+    parser.add_argument(
+        '--slots', default=8, type=int, help="Frames kept in the ring buffer")
+    parser.add_argument(
+        '--align', action='store_true', help="Publish the depth aligned to the color stream")
+    return parser
+
+
+def main(args):
+    pipeline = rs.pipeline()
+    config = rs.config()
+    if args.input is None:
+        config.enable_stream(rs.stream.depth, args.width, args.height, rs.format.z16, args.FPS)
+        config.enable_stream(rs.stream.color, args.width, args.height, rs.format.bgr8, args.FPS)
+    else:
+        config.enable_device_from_file(args.input, repeat_playback=True)
+    pipeline.start(config)
+    align = rs.align(rs.stream.color) if args.align else None
+
+    publisher = None
+    published = 0
+    start_time = last_report = time.perf_counter()
+    try:
+        while True:
+            frames = pipeline.wait_for_frames()
+            if align is not None:
+                frames = align.process(frames)
+            depth_frame = frames.get_depth_frame()
+            color_frame = frames.get_color_frame()
+            if not depth_frame or not color_frame:
+                continue
+            depth_image = np.asanyarray(depth_frame.get_data())
+            color_image = np.asanyarray(color_frame.get_data())
+
+            if publisher is None:
+                # sized after the first frames, a bag decides its own resolution
+                height, width = depth_image.shape
+                if color_image.shape[:2] != (height, width):
+                    print("Depth and color sizes differ, use --align")
+                    break
+                publisher = FrameBusPublisher(args.name, width, height, color_image.shape[2], args.slots)
+                print("Publishing {}x{} on bus '{}'".format(width, height, args.name))
+            publisher.publish(depth_image, color_image, frames.get_timestamp(), frames.get_frame_number())
+            published += 1
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print("Published {} frames, {:.1f} fps".format(published, published / (now - start_time)))
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if publisher is not None:
+            publisher.close()
+        pipeline.stop()
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
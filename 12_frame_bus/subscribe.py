@@ -0,0 +1,79 @@
+"""
+Read the frames of a frame bus published by publish_camera.py: show
+the latest ones, or record every one of them to video files like
+05_save_video does. Several of these can run at once.
+"""
+
+
+import cv2
+import time
+import argparse
+from frame_bus import FrameBusSubscriber
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--name', default='camera', type=str, help="Name of the frame bus")
+    parser.add_argument(
+        '--record', '-r', default=None, type=str, help="Record every frame to <record>_rgb.mp4 and <record>_depth.mp4")
+    parser.add_argument(
+        '--FPS', '-fps', default=30, type=int, help="Frame rate of the recorded videos")
+    return parser
+
+
+def main(args):
+    # a recorder needs every frame, a viewer only the newest one
+    subscriber = FrameBusSubscriber(args.name, mode="every" if args.record else "latest")
+    colorwriter = depthwriter = None
+    start_time = last_report = time.perf_counter()
+    try:
+        while True:
+            frame = subscriber.get(timeout=2.0)
+            if frame is None:
+                print("Publisher closed or silent")
+                break
+            depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(frame.depth, alpha=0.03), cv2.COLORMAP_JET)
+            color_image = frame.color.copy()
+            # the slot may have been overwritten while we read it
+            if not subscriber.is_current(frame):
+                continue
+
+            if args.record:
+                if colorwriter is None:
+                    height, width = frame.depth.shape
+                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                    colorwriter = cv2.VideoWriter(args.record + '_rgb.mp4', fourcc, args.FPS, (width, height), 1)
+                    depthwriter = cv2.VideoWriter(args.record + '_depth.mp4', fourcc, args.FPS, (width, height), 1)
+                colorwriter.write(color_image)
+                depthwriter.write(depth_colormap)
+            else:
+                cv2.imshow('RGB', color_image)
+                cv2.imshow('Depth', depth_colormap)
+                # if pressed escape exit program
+                if cv2.waitKey(1) in [27, ord("q")]:
+                    break
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print("Received {}  lost {}  torn {}  latency {:.1f} ms".format(
+                    subscriber.received, subscriber.lost, subscriber.torn, 1000 * (now - frame.publish_time)))
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if colorwriter is not None:
+            colorwriter.release()
+            depthwriter.release()
+        if not args.record:
+            cv2.destroyAllWindows()
+        print("Received {} frames in {:.1f} s, lost {}, torn {}".format(
+            subscriber.received, time.perf_counter() - start_time, subscriber.lost, subscriber.torn))
+        subscriber.close()
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
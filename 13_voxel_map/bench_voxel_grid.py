@@ -0,0 +1,104 @@
+"""
+Ingest rate of the voxel grid: deprojection and integration of 848x480
+depth frames (synthetic, or the frames of a .bag) for a few voxel
+sizes. With a bag, rs.pointcloud on the same frames is timed too, as
+a yardstick of what the machine does for the deprojection alone.
+"""
+
+
+import time
+import argparse
+import numpy as np
+import pyrealsense2 as rs
+from voxel_grid import VoxelGrid, DepthDeprojector
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default=None, type=str, help="Bag file, synthetic frames if not given")
+    parser.add_argument(
+        '--frames', default=60, type=int)
+    parser.add_argument(
+        '--voxel_sizes', default=[0.05, 0.02, 0.01], type=float, nargs='+')
+    parser.add_argument(
+        '--stride', default=1, type=int)
+    return parser
+
+
+def synthetic_frames(count, width=848, height=480):
+    # a wavy wall 1 to 2 m away with some noise and holes
+    intrinsics = rs.intrinsics()
+    intrinsics.width, intrinsics.height = width, height
+    intrinsics.fx = intrinsics.fy = 420.0
+    intrinsics.ppx, intrinsics.ppy = width / 2, height / 2
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[0:height, 0:width]
+    wall = 1500 + 500 * np.sin(x / 80) + 300 * np.cos(y / 60)
+    frames = []
+    for i in range(count):
+        depth = (wall + rng.normal(0, 5, wall.shape)).astype(np.uint16)
+        depth[rng.rand(height, width) < 0.05] = 0
+        frames.append(depth)
+    return frames, intrinsics, 0.001, None
+
+
+def bag_frames(path, count):
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(path, repeat_playback=True)
+    config.enable_stream(rs.stream.depth)
+    profile = pipeline.start(config)
+    intrinsics = profile.get_stream(rs.stream.depth).as_video_stream_profile().get_intrinsics()
+    frames, rs_frames = [], []
+    pointcloud = rs.pointcloud()
+    try:
+        for i in range(count):
+            depth_frame = pipeline.wait_for_frames().get_depth_frame()
+            # copies, librealsense would run out of buffers
+            frames.append(np.asanyarray(depth_frame.get_data()).copy())
+            units = depth_frame.get_units()
+            if i < 30:
+                rs_frames.append(depth_frame)
+        start = time.perf_counter()
+        for depth_frame in rs_frames:
+            pointcloud.calculate(depth_frame)
+        pointcloud_time = (time.perf_counter() - start) / len(rs_frames)
+    finally:
+        pipeline.stop()
+    return frames, intrinsics, units, pointcloud_time
+
+
+def main(args):
+    if args.input is None:
+        frames, intrinsics, units, pointcloud_time = synthetic_frames(args.frames)
+    else:
+        frames, intrinsics, units, pointcloud_time = bag_frames(args.input, args.frames)
+    print("{} frames {}x{}, stride {}".format(len(frames), intrinsics.width, intrinsics.height, args.stride))
+    if pointcloud_time is not None:
+        print("rs.pointcloud        {:6.2f} ms/frame".format(1000 * pointcloud_time))
+
+    deprojector = DepthDeprojector(intrinsics, units, args.stride)
+    for voxel_size in args.voxel_sizes:
+        grid = VoxelGrid(voxel_size)
+        # first frame apart, it allocates the table
+        grid.integrate(deprojector.deproject(frames[0]))
+        deproject_time = integrate_time = 0.0
+        for depth_image in frames[1:]:
+            start = time.perf_counter()
+            points = deprojector.deproject(depth_image)
+            deproject_time += time.perf_counter() - start
+            start = time.perf_counter()
+            grid.integrate(points)
+            integrate_time += time.perf_counter() - start
+        count = len(frames) - 1
+        print("voxel {:5.3f} m  deproject {:6.2f} ms  integrate {:6.2f} ms  {:6.1f} frames/s  {} voxels".format(
+            voxel_size, 1000 * deproject_time / count, 1000 * integrate_time / count,
+            count / (deproject_time + integrate_time), grid.size))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
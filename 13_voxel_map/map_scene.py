@@ -0,0 +1,110 @@
+"""
+Accumulate the depth frames of the camera (or of a .bag) into a sparse
+voxel map and export it as a PLY point cloud of the voxel means.
+The voxels evicted to keep the map within --max_voxels are appended
+to the PLY as they go, the rest when the capture ends.
+
+Points are kept in camera coordinates: the camera should not move,
+or the poses have to be passed to VoxelGrid.integrate.
+"""
+
+
+import time
+import argparse
+import pyrealsense2 as rs
+import numpy as np
+from voxel_grid import VoxelGrid, DepthDeprojector
+from ply_writer import PlyWriter
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--input', '-i', default=None, type=str, help="Bag file to map instead of the camera")
+    parser.add_argument(
+        '--output', '-o', default='map.ply', type=str, help="PLY file of the voxel means")
+    parser.add_argument(
+        '--width', default=848, type=int, choices=[1280, 848, 640])
+    parser.add_argument(
+        '--height', default=480, type=int, choices=[720, 480, 360])
+    parser.add_argument(
+        '--FPS', '-fps', default=30, type=int, choices=[15, 25, 30, 60, 90])
+    parser.add_argument(
+        '--voxel_size', default=0.02, type=float, help="Voxel edge in meters")
+    parser.add_argument(
+        '--max_voxels', default=2000000, type=int, help="Voxels kept in memory, the least recently seen go first")
+    parser.add_argument(
+        '--max_depth', default=4.0, type=float, help="Ignore the depth beyond this distance in meters, 0 to keep all")
+    parser.add_argument(
+        '--stride', default=1, type=int, help="Use one pixel out of stride in each direction")
+    parser.add_argument(
+        '--min_count', default=2, type=int, help="Export only the voxels with at least this many points")
+    parser.add_argument(
+        '--frames', default=0, type=int, help="Stop after this many frames, 0 to run until the end or ctrl-c")
+    return parser
+
+
+def main(args):
+    pipeline = rs.pipeline()
+    config = rs.config()
+    if args.input is None:
+        config.enable_stream(rs.stream.depth, args.width, args.height, rs.format.z16, args.FPS)
+    else:
+        config.enable_device_from_file(args.input, repeat_playback=False)
+        config.enable_stream(rs.stream.depth)
+    profile = pipeline.start(config)
+    if args.input is not None:
+        # every frame of the recording, as fast as they can be mapped
+        profile.get_device().as_playback().set_real_time(False)
+    intrinsics = profile.get_stream(rs.stream.depth).as_video_stream_profile().get_intrinsics()
+
+    writer = PlyWriter(args.output)
+
+    def export(points, counts):
+        keep = counts >= args.min_count
+        writer.write(points[keep], counts[keep])
+
+    grid = VoxelGrid(args.voxel_size, args.max_voxels, on_evict=export)
+    deprojector = None
+    frame_count = 0
+    integrate_time = 0.0
+    start_time = last_report = time.perf_counter()
+    try:
+        while not args.frames or frame_count < args.frames:
+            ret, frames = pipeline.try_wait_for_frames(5000)
+            if not ret:
+                # end of the recording
+                break
+            depth_frame = frames.get_depth_frame()
+            if not depth_frame:
+                continue
+            if deprojector is None:
+                deprojector = DepthDeprojector(intrinsics, depth_frame.get_units(), args.stride)
+
+            integrate_start = time.perf_counter()
+            grid.integrate(deprojector.deproject(np.asanyarray(depth_frame.get_data()), args.max_depth))
+            integrate_time += time.perf_counter() - integrate_start
+            frame_count += 1
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print("{} frames  {:.1f} frames/s mapped  {} voxels  {} evicted".format(
+                    frame_count, frame_count / max(integrate_time, 1e-6), grid.size, grid.evicted))
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        export(*grid.points())
+        writer.close()
+
+    print("{} frames in {:.1f} s, {:.1f} frames/s mapped, {} points written to {}".format(
+        frame_count, time.perf_counter() - start_time, frame_count / max(integrate_time, 1e-6),
+        writer.vertices, args.output))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -0,0 +1,50 @@
+"""
+Binary PLY point cloud written in chunks, for maps larger than memory.
+The vertex count in the header has a fixed width and is rewritten after
+every chunk, so the file is a valid point cloud at any time.
+"""
+
+
+import numpy as np
+
+
+VERTEX = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("count", "<u4")])
+HEADER = ("ply\n"
+          "format binary_little_endian 1.0\n"
+          "comment voxel means, count is the number of points averaged\n"
+          "element vertex {:010d}\n"
+          "property float x\n"
+          "property float y\n"
+          "property float z\n"
+          "property uint count\n"
+          "end_header\n")
+
+
+class PlyWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.format(0).encode("ascii"))
+        self.vertices = 0
+
+    def write(self, points, counts):
+        vertices = np.empty(len(points), VERTEX)
+        vertices["x"], vertices["y"], vertices["z"] = points[:, 0], points[:, 1], points[:, 2]
+        vertices["count"] = counts
+        self.file.write(vertices.tobytes())
+        self.vertices += len(vertices)
+        self.file.seek(0)
+        self.file.write(HEADER.format(self.vertices).encode("ascii"))
+        self.file.seek(0, 2)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def write_ply(path, points, counts):
+    writer = PlyWriter(path)
+    writer.write(points, counts)
+    writer.close()
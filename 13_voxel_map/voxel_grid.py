@@ -0,0 +1,195 @@
+"""
+Sparse voxel grid that accumulates the points of many depth frames.
+
+Each z16 frame is deprojected with the depth stream intrinsics and its
+points are binned into voxels. The voxels live in a hash table made of
+flat NumPy arrays (open addressing, linear probing): the packed
+integer voxel coordinates as keys, and per voxel the running mean of
+its points, their count and the last frame that saw it. Lookups and
+inserts are done for a whole frame at once, probe round by probe round,
+so there is no Python work per point.
+
+Memory is bounded by max_voxels: when the grid is full, the voxels
+seen least recently (the regions the camera has moved away from) are
+evicted, and can be streamed to a PLY file as they go.
+"""
+
+
+import numpy as np
+
+
+EMPTY = -1
+# voxel coordinates are packed in 21 bits each, about +-1 km with 1 cm voxels
+COORD_BITS = 21
+COORD_OFFSET = 1 << (COORD_BITS - 1)
+COORD_MASK = (1 << COORD_BITS) - 1
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class DepthDeprojector:
+    # Depth image -> 3D points in meters (camera coordinates), rays computed once
+    def __init__(self, intrinsics, depth_scale, stride=1):
+        # the depth stream of the D400 cameras has no distortion, the pinhole model is exact
+        self.stride = stride
+        u = np.arange(0, intrinsics.width, stride, dtype=np.float32)
+        v = np.arange(0, intrinsics.height, stride, dtype=np.float32)
+        self.ray_x = np.tile((u - intrinsics.ppx) / intrinsics.fx, len(v))
+        self.ray_y = np.repeat((v - intrinsics.ppy) / intrinsics.fy, len(u))
+        self.depth_scale = depth_scale
+
+    def deproject(self, depth_image, max_depth=0.0):
+        depth = depth_image[::self.stride, ::self.stride].ravel()
+        valid = depth > 0
+        if max_depth > 0:
+            valid &= depth <= max_depth / self.depth_scale
+        z = depth[valid].astype(np.float32) * np.float32(self.depth_scale)
+        points = np.empty((len(z), 3), np.float32)
+        np.multiply(self.ray_x[valid], z, out=points[:, 0])
+        np.multiply(self.ray_y[valid], z, out=points[:, 1])
+        points[:, 2] = z
+        return points
+
+
+class VoxelGrid:
+    def __init__(self, voxel_size=0.02, max_voxels=2000000, evict_fraction=0.25, on_evict=None):
+        # on_evict(points, counts) gets the means and counts of the evicted voxels
+        self.voxel_size = voxel_size
+        self.max_voxels = max_voxels
+        self.evict_fraction = evict_fraction
+        self.on_evict = on_evict
+        self._allocate(2 * max_voxels)
+        self.frames = 0
+        self.evicted = 0
+
+    def _allocate(self, voxels):
+        # at most half full, probe sequences stay short
+        self.capacity = 1 << int(np.ceil(np.log2(max(voxels, 2))))
+        self.hash_shift = np.uint64(64 - int(np.log2(self.capacity)))
+        self.keys = np.full(self.capacity, EMPTY, np.int64)
+        self.mean = np.zeros((self.capacity, 3), np.float32)
+        self.count = np.zeros(self.capacity, np.uint32)
+        self.last_seen = np.zeros(self.capacity, np.int64)
+        # slot -> index in the current frame, to group the points of a frame by voxel without sorting
+        self.scratch = np.zeros(self.capacity, np.int64)
+        self.size = 0
+
+    def _rebuild(self, keep, voxels):
+        # New table for at least voxels voxels, holding the voxels of the slots keep
+        keys, mean, count, last_seen = self.keys[keep], self.mean[keep], self.count[keep], self.last_seen[keep]
+        self._allocate(voxels)
+        slots = self._slots(keys, insert=True)
+        self.mean[slots] = mean
+        self.count[slots] = count
+        self.last_seen[slots] = last_seen
+
+    def voxel_keys(self, points):
+        coords = np.floor(points * np.float32(1.0 / self.voxel_size)).astype(np.int64)
+        coords += COORD_OFFSET
+        np.bitwise_and(coords, COORD_MASK, out=coords)
+        return (coords[:, 0] << (2 * COORD_BITS)) | (coords[:, 1] << COORD_BITS) | coords[:, 2]
+
+    def key_centers(self, keys):
+        coords = np.stack([(keys >> (2 * COORD_BITS)) & COORD_MASK, (keys >> COORD_BITS) & COORD_MASK,
+                           keys & COORD_MASK], axis=1) - COORD_OFFSET
+        return (coords + 0.5) * self.voxel_size
+
+    def _slots(self, keys, insert):
+        # Table slot of every key, inserting the missing ones (or -1 for them if not insert)
+        with np.errstate(over='ignore'):
+            home = (keys.astype(np.uint64) * HASH_MULTIPLIER) >> self.hash_shift
+        home = home.astype(np.int64)
+        slots = np.full(len(keys), -1, np.int64)
+        pending = np.arange(len(keys))
+        mask = self.capacity - 1
+        probe = 0
+        while len(pending):
+            candidate = (home[pending] + probe) & mask
+            wanted = keys[pending]
+            stored = self.keys[candidate]
+            found = stored == wanted
+            empty = stored == EMPTY
+            if insert:
+                if empty.any():
+                    # keys racing for the same empty slot: the last write wins, the others probe on
+                    claim = candidate[empty]
+                    self.keys[claim] = wanted[empty]
+                    self.size += len(np.unique(claim))
+                    found[empty] = self.keys[claim] == wanted[empty]
+                done = found
+            else:
+                # an empty slot ends the probe sequence of a missing key
+                done = found | empty
+            slots[pending[found]] = candidate[found]
+            pending = pending[~done]
+            probe += 1
+        return slots
+
+    def integrate(self, points, pose=None):
+        # Add the points (N x 3, meters) of one frame, pose is the 4x4 camera to world transform
+        if pose is not None:
+            pose = np.asarray(pose, np.float32)
+            points = points @ pose[:3, :3].T + pose[:3, 3]
+        self.frames += 1
+        if len(points) == 0:
+            return
+        keys = self.voxel_keys(points)
+        # neighbouring pixels mostly fall in the same voxel: only the first key of each run
+        # of equal keys goes to the hash table, which spares it most of its random accesses
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        if self.size + len(starts) > self.capacity * 3 // 4:
+            # the table must never fill up, worst case every run is a new voxel: only
+            # happens when a single frame has more voxels than max_voxels
+            self._rebuild(np.flatnonzero(self.keys != EMPTY), 2 * (self.size + len(starts)))
+        slots = self._slots(keys[starts], insert=True)
+
+        # group the runs by slot: mark each slot with one of its runs, number the marked ones
+        n = len(slots)
+        self.scratch[slots] = np.arange(n)
+        first = np.flatnonzero(self.scratch[slots] == np.arange(n))
+        voxels = slots[first]
+        self.scratch[voxels] = np.arange(len(voxels))
+        index = np.repeat(self.scratch[slots], np.diff(np.append(starts, len(keys))))
+        added = np.bincount(index, minlength=len(voxels))
+        sums = np.stack([np.bincount(index, points[:, axis], len(voxels)) for axis in range(3)], axis=1)
+
+        # running mean, a frame at a time
+        total = np.take(self.count, voxels) + added
+        mean = np.take(self.mean, voxels, axis=0)
+        mean += (sums - added[:, None] * mean) / total[:, None]
+        self.mean[voxels] = mean
+        self.count[voxels] = total
+        self.last_seen[voxels] = self.frames
+
+        if self.size > self.max_voxels:
+            # evict a good share at once, every eviction rebuilds the table
+            self.evict(self.size - self.max_voxels + int(self.evict_fraction * self.max_voxels))
+
+    def evict(self, number):
+        # Remove the number least recently seen voxels and rebuild the table without them
+        occupied = np.flatnonzero(self.keys != EMPTY)
+        number = min(number, len(occupied))
+        if number <= 0:
+            return
+        oldest = occupied[np.argpartition(self.last_seen[occupied], number - 1)[:number]]
+        if self.on_evict is not None:
+            self.on_evict(self.mean[oldest], self.count[oldest])
+        self._rebuild(np.setdiff1d(occupied, oldest, assume_unique=True), 2 * self.max_voxels)
+        self.evicted += number
+
+    def points(self, min_count=1):
+        # Means and counts of the voxels with at least min_count points
+        occupied = np.flatnonzero((self.keys != EMPTY) & (self.count >= min_count))
+        return self.mean[occupied], self.count[occupied]
+
+    def lookup(self, points):
+        # Mean and count of the voxels holding the points, NaN and 0 where there is none
+        slots = self._slots(self.voxel_keys(np.asarray(points, np.float32)), insert=False)
+        found = slots >= 0
+        mean = np.full((len(slots), 3), np.nan, np.float32)
+        count = np.zeros(len(slots), np.uint32)
+        mean[found] = self.mean[slots[found]]
+        count[found] = self.count[slots[found]]
+        return mean, count
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.keys, self.mean, self.count, self.last_seen, self.scratch))
@@ -0,0 +1,175 @@
+"""
+Write a synthetic .bag, for the converters and readers of the other
+folders without a camera: rs.software_device plays the depth and/or
+color streams of a procedural scene (synthetic_scene.py) into a
+recorder. The frames are the same for the same arguments, so
+benchmark and regression inputs of any size can be made on any box.
+
+The recorder stamps the messages with the time they are written: with
+--no_pace the time of the bag runs as fast as the frames are made, not
+at the frame rate, and seeks land away from the frame timestamps.
+"""
+
+
+import os
+import time
+import argparse
+import numpy as np
+import pyrealsense2 as rs
+from synthetic_scene import SyntheticScene
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--output', '-o', default='synthetic.bag', type=str, help="Path of the bag file")
+    parser.add_argument(
+        '--streams', default=["depth", "color"], type=str, nargs='+', choices=["depth", "color"])
+    parser.add_argument(
+        '--width', default=640, type=int)
+    parser.add_argument(
+        '--height', default=480, type=int)
+    parser.add_argument(
+        '--FPS', '-fps', default=30, type=int, choices=[6, 15, 25, 30, 60, 90])
+    parser.add_argument(
+        '--duration', '-d', default=10.0, type=float, help="Length of the recording in seconds")
+    parser.add_argument(
+        '--depth_hfov', default=87.0, type=float, help="Horizontal field of view of the depth camera, degrees")
+    parser.add_argument(
+        '--color_hfov', default=69.0, type=float, help="Horizontal field of view of the color camera, degrees")
+    parser.add_argument(
+        '--baseline', default=0.05, type=float, help="Stereo baseline in meters, also the depth to color offset")
+    parser.add_argument(
+        '--depth_units', default=0.001, type=float, help="Meters per depth unit")
+    parser.add_argument(
+        '--wall', default=3.0, type=float, help="Distance of the back wall in meters, 0 for none")
+    parser.add_argument(
+        '--floor', default=1.2, type=float, help="Height of the camera above the floor in meters, 0 for none")
+    parser.add_argument(
+        '--spheres', default=3, type=int, help="Number of moving spheres")
+    parser.add_argument(
+        '--radius', default=0.25, type=float, help="Radius of the spheres in meters")
+    parser.add_argument(
+        '--noise', default=2.0, type=float, help="Depth noise in mm at 1 m, it grows with the square of the distance")
+    parser.add_argument(
+        '--holes', default=0.02, type=float, help="Fraction of the depth pixels without depth")
+    parser.add_argument(
+        '--seed', default=0, type=int)
+    parser.add_argument(
+        '--no_pace', action='store_true', help="Write the frames as fast as they are made, not at the frame rate")
+    return parser
+
+
+def get_args(parser):
+    args = parser.parse_args()
+    if os.path.splitext(args.output)[1] != ".bag":
+        print("The output has to be a .bag file")
+        exit()
+    return args
+
+
+def intrinsics_from_fov(width, height, hfov, color=False):
+    # pinhole with square pixels and the principal point in the middle, a bit off for color
+    intrinsics = rs.intrinsics()
+    intrinsics.width, intrinsics.height = width, height
+    intrinsics.fx = intrinsics.fy = width / 2 / np.tan(np.radians(hfov) / 2)
+    intrinsics.ppx, intrinsics.ppy = (width - 1) / 2 + (3 if color else 0), (height - 1) / 2 - (2 if color else 0)
+    intrinsics.model = rs.distortion.inverse_brown_conrady if color else rs.distortion.brown_conrady
+    intrinsics.coeffs = [0.0] * 5
+    return intrinsics
+
+
+def write_bag(path, scene, width=640, height=480, fps=30, frames=300, streams=("depth", "color"),
+              depth_hfov=87.0, color_hfov=69.0, baseline=0.05, depth_units=0.001, pace=True, progress=None):
+    # Record frames frames of the scene, progress(index) is called after each one
+    device = rs.software_device()
+    device.register_info(rs.camera_info.name, "Synthetic Depth Camera")
+    device.register_info(rs.camera_info.serial_number, "000000000000")
+    sensors = []
+    for uid, stream in enumerate(streams):
+        color = stream == "color"
+        sensor = device.add_sensor("RGB Camera" if color else "Stereo Module")
+        intrinsics = intrinsics_from_fov(width, height, color_hfov if color else depth_hfov, color)
+        video = rs.video_stream()
+        video.type = rs.stream.color if color else rs.stream.depth
+        video.index, video.uid = 0, uid
+        video.width, video.height, video.fps = width, height, fps
+        video.bpp = 3 if color else 2
+        video.fmt = rs.format.bgr8 if color else rs.format.z16
+        video.intrinsics = intrinsics
+        profile = sensor.add_video_stream(video)
+        if not color:
+            sensor.add_read_only_option(rs.option.depth_units, depth_units)
+            sensor.add_read_only_option(rs.option.stereo_baseline, baseline * 1000)
+        sensors.append((stream, sensor, profile, intrinsics))
+    if len(sensors) == 2:
+        # the color camera is at the right of the depth camera, by the baseline
+        extrinsics = rs.extrinsics()
+        extrinsics.rotation = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
+        extrinsics.translation = [-baseline, 0.0, 0.0]
+        sensors[0][2].register_extrinsics_to(sensors[1][2], extrinsics)
+
+    recorder = rs.recorder(path, device)
+    for stream, sensor, profile, intrinsics in sensors:
+        sensor.open(profile)
+        sensor.start(lambda frame: None)
+    start = time.perf_counter()
+    try:
+        for index in range(frames):
+            for stream, sensor, profile, intrinsics in sensors:
+                if stream == "depth":
+                    image = scene.depth(intrinsics, index, fps, depth_units)
+                else:
+                    image = scene.color(intrinsics, index, fps, origin=(baseline, 0, 0))
+                frame = rs.software_video_frame()
+                frame.pixels = image
+                frame.bpp = image.itemsize * (image.shape[2] if image.ndim == 3 else 1)
+                frame.stride = width * frame.bpp
+                frame.timestamp = index * 1000.0 / fps
+                frame.domain = rs.timestamp_domain.hardware_clock
+                frame.frame_number = index
+                frame.profile = profile.as_video_stream_profile()
+                if stream == "depth":
+                    frame.depth_units = depth_units
+                sensor.on_video_frame(frame)
+            if progress is not None:
+                progress(index)
+            if pace:
+                # the recorder stamps the frames when they arrive: at the frame rate, the
+                # time of the bag follows the frame timestamps
+                delay = start + (index + 1) / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        for stream, sensor, profile, intrinsics in sensors:
+            sensor.stop()
+            sensor.close()
+        # the bag is complete when the recorder is gone
+        del recorder
+
+
+def main(args):
+    scene = SyntheticScene(wall=args.wall, floor=args.floor, spheres=args.spheres, radius=args.radius,
+                           noise=args.noise, holes=args.holes, baseline=args.baseline, seed=args.seed)
+    frames = int(round(args.duration * args.FPS))
+    last_print = [time.perf_counter()]
+
+    def progress(index):
+        now = time.perf_counter()
+        if now - last_print[0] >= 2 or index == frames - 1:
+            last_print[0] = now
+            print("{}/{} frames".format(index + 1, frames))
+
+    start = time.perf_counter()
+    write_bag(args.output, scene, args.width, args.height, args.FPS, frames, args.streams, args.depth_hfov,
+              args.color_hfov, args.baseline, args.depth_units, not args.no_pace, progress)
+    elapsed = time.perf_counter() - start
+    print("{} frames in {:.1f} s ({:.1f} frames/s), {:.1f} MB written to {}".format(
+        frames, elapsed, frames / elapsed, os.path.getsize(args.output) / 1e6, args.output))
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = get_args(parser)
+    print(args)
+    main(args)
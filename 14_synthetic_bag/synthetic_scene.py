@@ -0,0 +1,169 @@
+"""
+Procedural scene seen by a depth camera and a color camera, for
+synthetic bags and benchmarks without a camera.
+
+The scene is a back wall (tilted around the vertical axis), a floor,
+and spheres moving on smooth closed paths in front of them. The depth
+has the defects of a stereo camera: a noise growing with the square
+of the distance, random holes, the invalid band left of near objects
+that the right imager does not see, and nothing beyond max_depth.
+Frame n is always the same for the same parameters and seed.
+"""
+
+
+import numpy as np
+
+
+class SyntheticScene:
+    # Everything is in meters, in the coordinates of the depth camera (x right, y down,
+    # z forward). A wall or floor at distance 0 is left out. noise is the noise in mm at
+    # 1 m, holes the fraction of the pixels without depth.
+    def __init__(self, wall=3.0, wall_tilt=15.0, floor=1.2, spheres=3, radius=0.25, speed=0.5,
+                 noise=2.0, holes=0.02, baseline=0.05, max_depth=10.0, seed=0):
+        self.wall = wall
+        self.wall_tilt = np.radians(wall_tilt)
+        self.floor = floor
+        self.radius = radius
+        self.noise = noise / 1000
+        self.holes = holes
+        self.baseline = baseline
+        self.max_depth = max_depth
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        # sphere paths: center + amplitude * sin(frequency * t + phase) on each axis, in
+        # front of the wall and inside a 60 degree wide view
+        far = (wall if wall > 0 else 4.0) - 2 * radius
+        depth = rng.uniform(0.8, max(far, 1.0), spheres)
+        self.centers = np.column_stack([rng.uniform(-0.3, 0.3, spheres) * depth,
+                                        rng.uniform(-0.2, 0.2, spheres) * depth, depth])
+        self.amplitudes = np.column_stack([0.3 * depth, 0.1 * depth,
+                                           np.minimum(0.3, (depth - 0.6) / 2)])
+        self.frequencies = rng.uniform(0.5, 1.5, (spheres, 3)) * speed / np.maximum(self.amplitudes, 0.1)
+        self.phases = rng.uniform(0, 2 * np.pi, (spheres, 3))
+        self.colors = rng.randint(40, 256, (spheres, 3)).astype(np.uint8)
+        # static layers of each camera (planes, rays), the noise and holes banks of each size
+        self.layers = {}
+        self.banks = {}
+
+    def sphere_centers(self, seconds):
+        return self.centers + self.amplitudes * np.sin(self.frequencies * seconds + self.phases)
+
+    def _layer(self, intrinsics, origin):
+        # per pixel ray, distance to the planes and their colors, computed once per camera
+        key = (intrinsics.width, intrinsics.height, intrinsics.fx, intrinsics.fy,
+               intrinsics.ppx, intrinsics.ppy, tuple(origin))
+        if key in self.layers:
+            return self.layers[key]
+        u = (np.arange(intrinsics.width, dtype=np.float32) - intrinsics.ppx) / intrinsics.fx
+        v = (np.arange(intrinsics.height, dtype=np.float32) - intrinsics.ppy) / intrinsics.fy
+        rays = np.stack([np.broadcast_to(u, (len(v), len(u))), np.broadcast_to(v[:, None], (len(v), len(u))),
+                         np.ones((len(v), len(u)), np.float32)], -1)
+        origin = np.asarray(origin, np.float32)
+        z = np.full(rays.shape[:2], np.inf, np.float32)
+        color = np.zeros(rays.shape[:2] + (3,), np.uint8)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.wall > 0:
+                normal = np.array([np.sin(self.wall_tilt), 0, np.cos(self.wall_tilt)], np.float32)
+                t = (self.wall - normal @ origin) / (rays @ normal)
+                hit = (t > 0) & (t < z)
+                points = origin + rays * t[..., None]
+                # checkerboard of 25 cm squares
+                check = (np.floor(points[..., 0] / 0.25) + np.floor(points[..., 1] / 0.25)) % 2
+                color[hit] = np.where(check[hit, None] > 0, (200, 190, 170), (120, 110, 100))
+                z[hit] = t[hit]
+            if self.floor > 0:
+                t = (self.floor - origin[1]) / rays[..., 1]
+                hit = (t > 0) & (t < z)
+                points = origin + rays * t[..., None]
+                # grid lines every 50 cm
+                line = (np.abs((points[..., 0] + 0.25) % 0.5 - 0.25) < 0.01) | \
+                       (np.abs((points[..., 2] + 0.25) % 0.5 - 0.25) < 0.01)
+                color[hit] = np.where(line[hit, None], (60, 60, 60), (90, 140, 110))
+                z[hit] = t[hit]
+        layer = (rays, origin, z, color)
+        self.layers[key] = layer
+        return layer
+
+    def _bank(self, shape):
+        # a few frames of unit noise and of holes, each frame picks one, shifted
+        if shape not in self.banks:
+            rng = np.random.RandomState(self.seed + 1)
+            self.banks[shape] = (rng.standard_normal((8,) + shape).astype(np.float32),
+                                 rng.random_sample((8,) + shape) < self.holes)
+        return self.banks[shape]
+
+    def _spheres(self, intrinsics, rays, origin, z, seconds, on_hit):
+        # nearest hit of each sphere, over its bounding box only
+        for index, center in enumerate(self.sphere_centers(seconds)):
+            center = center - origin
+            if center[2] <= self.radius:
+                continue
+            # bounding box of the projection, with the width of the sphere seen from its front
+            extent = self.radius / (center[2] - self.radius)
+            x0 = int(max(intrinsics.ppx + intrinsics.fx * (center[0] / center[2] - extent), 0))
+            x1 = int(min(intrinsics.ppx + intrinsics.fx * (center[0] / center[2] + extent) + 2, intrinsics.width))
+            y0 = int(max(intrinsics.ppy + intrinsics.fy * (center[1] / center[2] - extent), 0))
+            y1 = int(min(intrinsics.ppy + intrinsics.fy * (center[1] / center[2] + extent) + 2, intrinsics.height))
+            if x0 >= x1 or y0 >= y1:
+                continue
+            box = rays[y0:y1, x0:x1]
+            # |t ray - center| = radius, nearest root
+            a = np.einsum('ijk,ijk->ij', box, box)
+            b = box @ center.astype(np.float32)
+            discriminant = b * b - a * (center @ center - self.radius ** 2)
+            hit = discriminant > 0
+            t = (b - np.sqrt(np.maximum(discriminant, 0))) / a
+            hit &= t < z[y0:y1, x0:x1]
+            on_hit(index, y0, x0, hit, t, box, center)
+
+    def depth(self, intrinsics, index, fps, depth_units=0.001):
+        # z16 depth frame n, intrinsics of the depth camera
+        rays, origin, static, _ = self._layer(intrinsics, (0, 0, 0))
+        z = static.copy()
+        shadow = np.zeros(z.shape, bool)
+
+        def on_hit(sphere, y0, x0, hit, t, box, center):
+            height, width = hit.shape
+            window = z[y0:y0 + height, x0:x0 + width]
+            behind = window[hit]
+            if not behind.size:
+                return
+            window[hit] = t[hit]
+            # the right imager does not see the background just left of the sphere, over
+            # the disparity difference between them
+            band = int(max(self.baseline * intrinsics.fx * (1 / center[2] - 1 / np.median(behind)), 0))
+            if band:
+                left = x0 + hit.argmax(axis=1)
+                columns = np.arange(max(x0 - band, 0), x0 + width)
+                band_mask = (columns >= left[:, None] - band) & (columns < left[:, None]) & hit.any(axis=1)[:, None]
+                shadow[y0:y0 + height, columns[0]:columns[-1] + 1] |= band_mask
+
+        self._spheres(intrinsics, rays, origin, z, index / fps, on_hit)
+
+        noise, holes = self._bank(z.shape)
+        pick = index % len(noise)
+        shift = (index // len(noise)) * 7 % z.shape[1]
+        sigma = self.noise * z * z
+        z += np.roll(noise[pick], shift, axis=1) * sigma
+        invalid = ~np.isfinite(z) | (z > self.max_depth) | (z <= 0) | shadow | np.roll(holes[pick], shift, axis=1)
+        z[invalid] = 0
+        return np.round(z / depth_units).astype(np.uint16)
+
+    def color(self, intrinsics, index, fps, origin=(0, 0, 0)):
+        # bgr8 color frame n, origin is the position of the color camera in depth coordinates
+        rays, origin, static, background = self._layer(intrinsics, origin)
+        z = static.copy()
+        color = background.copy()
+
+        def on_hit(sphere, y0, x0, hit, t, box, center):
+            height, width = hit.shape
+            z[y0:y0 + height, x0:x0 + width][hit] = t[hit]
+            # lambertian shading, light from the camera
+            normals = box[hit] * t[hit, None] - center
+            shade = np.abs(np.einsum('ij,ij->i', normals, box[hit])) / (
+                np.linalg.norm(normals, axis=1) * np.linalg.norm(box[hit], axis=1) + 1e-9)
+            color[y0:y0 + height, x0:x0 + width][hit] = (self.colors[sphere] * (0.3 + 0.7 * shade[:, None])).astype(np.uint8)
+
+        self._spheres(intrinsics, rays, origin, z, index / fps, on_hit)
+        return color
+